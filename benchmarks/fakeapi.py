@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# benchmarks.fakeapi - A local stand-in for the parts of the Twitter API
+# which twactor uses.
+
+"""
+A fake Twitter API server for benchmarks.
+
+The server answers ``/users/show``, ``/users/lookup``, ``/statuses/show``,
+``/statuses/public_timeline`` and ``/statuses/user_timeline`` with generated
+(but consistent) data: ``users`` users, each with ``statuses`` tweets. Every
+response can be delayed (``latency`` seconds, plus up to ``jitter`` more),
+and a fraction of them (``error_rate``) fail with a 503. The public timeline
+moves on by ``public_rate`` tweets per request, so polling it gives a list
+something new to merge each time. Responses carry an ``ETag``, and a request
+whose ``If-None-Match`` matches the response it would get is answered with a
+304 instead.
+
+Run it on its own with ``python benchmarks/fakeapi.py --port 8000``.
+"""
+
+import BaseHTTPServer
+import hashlib
+import optparse
+import random
+import re
+import SocketServer
+import sys
+import time
+import urlparse
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+# The time of the first tweet; each tweet is a second younger than the next.
+EPOCH = 1230000000
+
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+
+ROUTES = (
+    ('users_show', re.compile(r'^/users/show/([^/]+)\.json$')),
+    ('users_lookup', re.compile(r'^/users/lookup\.json$')),
+    ('statuses_show', re.compile(r'^/statuses/show/(\d+)\.json$')),
+    ('public_timeline', re.compile(r'^/statuses/public_timeline\.json$')),
+    ('user_timeline', re.compile(r'^/statuses/user_timeline/([^/]+)\.json$')),
+)
+
+
+def twitter_time(timestamp):
+    return time.strftime(TWITTER_TIME_FORMAT, time.gmtime(timestamp))
+
+
+class FakeTwitter(object):
+    
+    """
+    The data behind the fake API.
+    
+    User ``n`` (counting from zero) is called ``'user<n>'`` and has ID
+    ``n + 1``; their tweets have IDs ``n * statuses + 1`` to ``(n + 1) *
+    statuses``. Tweets on the public timeline beyond those belong to users in
+    rotation. Timelines are served newest-first, at most ``page_size`` tweets
+    a page (or 20, for the public timeline).
+    """
+    
+    PUBLIC_PAGE_SIZE = 20
+    
+    def __init__(self, users=100, statuses=1000, page_size=200,
+        public_rate=5):
+        self.users = users
+        self.statuses = statuses
+        self.page_size = page_size
+        self.public_rate = public_rate
+        self.public_head = users * statuses
+        self._lock = threading.Lock()
+    
+    def user_number(self, identifier):
+        """Return the number of a user, from their screen name or ID."""
+        identifier = unicode(identifier).lower()
+        if identifier.startswith('user'):
+            number = identifier[4:]
+        else:
+            number = unicode(int(identifier) - 1)
+        if not number.isdigit() or int(number) >= self.users:
+            raise KeyError(identifier)
+        return int(number)
+    
+    def user(self, number, status=True):
+        data = {
+            'id': number + 1,
+            'screen_name': 'user%d' % (number,),
+            'name': 'Benchmark User %d' % (number,),
+            'description': 'One of %d generated users.' % (self.users,),
+            'location': 'Localhost',
+            'url': 'http://example.com/user%d' % (number,),
+            'protected': False,
+            'profile_image_url': 'http://example.com/user%d.png' % (number,),
+            'created_at': twitter_time(EPOCH - 86400 * (number + 1)),
+            'utc_offset': 0,
+            'time_zone': 'London',
+            'favourites_count': number % 17,
+            'followers_count': number * 3,
+            'friends_count': number * 2,
+            'statuses_count': self.statuses,
+        }
+        if status:
+            data['status'] = self.tweet((number + 1) * self.statuses,
+                user=False)
+        return data
+    
+    def tweet(self, id, user=True):
+        data = {
+            'id': id,
+            'text': 'Tweet number %d, which says nothing in particular.' % (
+                id,),
+            'created_at': twitter_time(EPOCH + id),
+            'source': '<a href="http://example.com/">benchmark</a>',
+            'truncated': False,
+            'favorited': False,
+            'in_reply_to_status_id': None,
+            'in_reply_to_user_id': None,
+            'in_reply_to_screen_name': None,
+        }
+        if user:
+            data['user'] = self.user(((id - 1) // self.statuses) % self.users,
+                status=False)
+        return data
+    
+    def user_timeline(self, number, page=1, count=20, since_id=None,
+        max_id=None):
+        count = min(count, self.page_size)
+        newest = (number + 1) * self.statuses
+        oldest = number * self.statuses + 1
+        if max_id is not None:
+            newest = min(newest, max_id)
+        if since_id is not None:
+            oldest = max(oldest, since_id + 1)
+        first = newest - (page - 1) * count
+        last = max(oldest, first - count + 1)
+        return [self.tweet(id) for id in xrange(first, last - 1, -1)]
+    
+    def public_timeline(self):
+        self._lock.acquire()
+        try:
+            self.public_head += self.public_rate
+            head = self.public_head
+        finally:
+            self._lock.release()
+        return [self.tweet(id)
+            for id in xrange(head, head - self.PUBLIC_PAGE_SIZE, -1)]
+
+
+class FakeAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, keep-alive
+    # responses stall on delayed ACKs.
+    disable_nagle_algorithm = True
+    
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return self.respond(404, {'error': 'Not found'})
+        server.count(endpoint)
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if random.random() < server.error_rate:
+            return self.respond(503, {'error': 'Over capacity'})
+        try:
+            body = getattr(self, endpoint)(params, *match.groups())
+        except (KeyError, ValueError):
+            return self.respond(404, {'error': 'Not found'})
+        self.respond(200, body)
+    
+    def users_show(self, params, identifier):
+        api = self.server.api
+        return api.user(api.user_number(identifier))
+    
+    def users_lookup(self, params):
+        api = self.server.api
+        identifiers = (params.get('screen_name') or
+            params.get('user_id', '')).split(',')
+        users = []
+        for identifier in identifiers:
+            try:
+                users.append(api.user(api.user_number(identifier)))
+            except (KeyError, ValueError):
+                pass
+        return users
+    
+    def statuses_show(self, params, id):
+        api = self.server.api
+        if not 0 < int(id) <= api.public_head:
+            raise KeyError(id)
+        return api.tweet(int(id))
+    
+    def public_timeline(self, params):
+        return self.server.api.public_timeline()
+    
+    def user_timeline(self, params, identifier):
+        api = self.server.api
+        optional = dict((name, int(params[name]))
+            for name in ('since_id', 'max_id') if name in params)
+        return api.user_timeline(api.user_number(identifier),
+            page=int(params.get('page', 1)),
+            count=int(params.get('count', 20)), **optional)
+    
+    def respond(self, status, body):
+        body = json.dumps(body)
+        etag = '"%s"' % (hashlib.md5(body).hexdigest(),)
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            status, body = 304, ''
+        self.send_response(status)
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        if status != 304:
+            self.send_header('Content-Type',
+                'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class FakeAPIServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    
+    """A threaded HTTP server for a ``FakeTwitter``; see ``start()``."""
+    
+    daemon_threads = True
+    request_queue_size = 128
+    
+    def __init__(self, address, api, latency=0, jitter=0, error_rate=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeAPIHandler)
+        self.api = api
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def netloc(self):
+        return '%s:%d' % self.server_address[:2]
+    
+    def count(self, endpoint):
+        self._lock.acquire()
+        try:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        finally:
+            self._lock.release()
+    
+    def request_count(self):
+        return sum(self.requests.values())
+
+
+def start(api=None, host='127.0.0.1', port=0, **kwargs):
+    """
+    Start a ``FakeAPIServer`` in a background thread, and return it.
+    
+    ``api`` defaults to a ``FakeTwitter()``; other keyword arguments are
+    passed on to the server. With ``port=0`` a free port is picked, and
+    ``server.netloc`` says which.
+    """
+    server = FakeAPIServer((host, port), api or FakeTwitter(), **kwargs)
+    thread = threading.Thread(target=server.serve_forever,
+        name='benchmarks.fakeapi')
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def add_options(parser):
+    """Add the server's settings to an ``optparse`` parser."""
+    parser.add_option('--latency', type='float', default=0,
+        help='seconds to wait before each response [%default]')
+    parser.add_option('--jitter', type='float', default=0,
+        help='up to this many more seconds, at random [%default]')
+    parser.add_option('--error-rate', type='float', default=0,
+        help='fraction of requests which fail with a 503 [%default]')
+    parser.add_option('--page-size', type='int', default=200,
+        help='most tweets per timeline page [%default]')
+    parser.add_option('--users', type='int', default=100,
+        help='number of users [%default]')
+    parser.add_option('--statuses', type='int', default=1000,
+        help='tweets per user [%default]')
+    parser.add_option('--public-rate', type='int', default=5,
+        help='new public tweets per public timeline request [%default]')
+
+
+def from_options(options, port=0):
+    """Start a server configured by ``add_options()``'s options."""
+    api = FakeTwitter(users=options.users, statuses=options.statuses,
+        page_size=options.page_size, public_rate=options.public_rate)
+    return start(api, port=port, latency=options.latency,
+        jitter=options.jitter, error_rate=options.error_rate)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--port', type='int', default=8000,
+        help='port to listen on [%default]')
+    add_options(parser)
+    options, args = parser.parse_args(argv)
+    server = from_options(options, port=options.port)
+    print 'Serving the fake Twitter API on http://%s/' % (server.netloc,)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
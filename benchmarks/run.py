@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# benchmarks.run - Time twactor against the fake API server.
+
+"""
+Benchmarks for twactor's cache and connection layers.
+
+Usage: ``python benchmarks/run.py [options] [benchmark ...]``
+
+A ``fakeapi`` server is started on a free local port, and each benchmark (all
+of them, unless some are named) is run against it in a child process of its
+own, so that memory figures aren't muddied by earlier benchmarks. Every
+operation is timed, and the results are reported as throughput, latency
+percentiles, the number of API requests made, and the memory (resident set
+size, and live container objects) still held when the benchmark finished.
+
+Save a run's results with ``--save FILE`` and compare a later run against
+them with ``--compare FILE`` to see whether a change helps or hurts.
+"""
+
+import gc
+import logging
+import optparse
+import os
+import random
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import fakeapi
+from twactor import cache, codec, connection, governor, log, models
+
+
+BENCHMARKS = []
+
+def benchmark(function):
+    """
+    Register a benchmark.
+    
+    A benchmark is a generator function taking the command-line options; it
+    does any setup, then yields the operations (callables taking no
+    arguments) to time. Whatever an operation returns is kept until the
+    benchmark has finished, and counts towards its memory use.
+    """
+    BENCHMARKS.append(function)
+    return function
+
+
+@benchmark
+def user_lookups(options):
+    """Look up distinct users by screen name (one ``/users/show`` each)."""
+    for number in xrange(min(options.ops, options.users)):
+        def lookup(number=number):
+            user = models.User('user%d' % (number,))
+            user.name
+            return user
+        yield lookup
+
+
+@benchmark
+def history_deep_index(options):
+    """Index the oldest tweet in a new ``UserHistory``, fetching every page."""
+    for number in xrange(min(options.histories, options.users)):
+        def deep_index(number=number):
+            history = models.UserHistory('user%d' % (number,))
+            history[-1].id
+            return history
+        yield deep_index
+
+
+@benchmark
+def forward_merge(options):
+    """Poll the public timeline, merging new tweets into a growing list."""
+    timeline = models.PublicTimeline()
+    for i in xrange(options.ops):
+        def poll():
+            timeline._update_cache()
+            return len(timeline._cache)
+        yield poll
+
+
+def random_slices(options):
+    """
+    Return a large, fully-cached ``ForwardCachedList`` and slices to take.
+    
+    The slices are ``(start, stop)`` pairs, of a range of sizes, at random
+    (but repeatable) offsets; there are ``options.ops`` of them.
+    """
+    api = fakeapi.FakeTwitter(users=options.users, statuses=options.statuses)
+    timeline = models.PublicTimeline()
+    timeline._insert_into_cache([api.tweet(id)
+        for id in xrange(1, options.list_size + 1)])
+    rng = random.Random(0)
+    sizes = [size for size in (10, 100, 1000) if size < options.list_size]
+    sizes.append(options.list_size)
+    slices = []
+    for i in xrange(options.ops):
+        size = sizes[i % len(sizes)]
+        start = rng.randint(0, options.list_size - size)
+        slices.append((start, start + size))
+    return timeline, slices
+
+
+@benchmark
+def slice_copying(options):
+    """Slice a large, fully-cached ``ForwardCachedList`` at random offsets."""
+    timeline, slices = random_slices(options)
+    for start, stop in slices:
+        yield lambda start=start, stop=stop: timeline[start:stop]
+
+
+@benchmark
+def slice_copies(options):
+    """
+    Slice a large, fully-cached ``ForwardCachedList``, copying each slice.
+    
+    Slices are views, so ``slice_copying`` only times making one; this times
+    ``copy()`` as well, the work slicing did before views.
+    """
+    timeline, slices = random_slices(options)
+    for start, stop in slices:
+        yield lambda start=start, stop=stop: timeline[start:stop].copy()
+
+
+def memory_usage():
+    """Return the resident set size in kilobytes (``None`` if unknown)."""
+    try:
+        fp = open('/proc/self/statm')
+        try:
+            return int(fp.read().split()[1]) * resource.getpagesize() // 1024
+        finally:
+            fp.close()
+    except (IOError, IndexError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        # Peak, rather than current, usage; kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_benchmark(function, options):
+    """Run a benchmark in this process, and return its results."""
+    cache.IDENTITY_MAP.clear()
+    operations = iter(function(options))
+    try:
+        pending = [operations.next()] # Setup runs up to the first operation.
+    except StopIteration:
+        pending = []
+    gc.collect()
+    memory, objects = memory_usage(), len(gc.get_objects())
+    timings, kept, errors = [], [], 0
+    for operation in pending + list(operations):
+        started = time.time()
+        try:
+            kept.append(operation())
+        except Exception, exc:
+            errors += 1
+        timings.append(time.time() - started)
+    gc.collect()
+    if memory is not None:
+        memory = memory_usage() - memory
+    objects = len(gc.get_objects()) - objects
+    timings.sort()
+    total = sum(timings)
+    return {
+        'ops': len(timings),
+        'errors': errors,
+        'seconds': total,
+        'ops_per_second': len(timings) / total if total else 0.0,
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p90_ms': percentile(timings, 0.9) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'max_ms': percentile(timings, 1.0) * 1000,
+        'memory_kb': memory,
+        'objects': objects,
+    }
+
+
+def run_isolated(function, options):
+    """Run a benchmark in a child process (where possible)."""
+    if options.in_process or not hasattr(os, 'fork'):
+        return run_benchmark(function, options)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        try:
+            try:
+                results = run_benchmark(function, options)
+            except Exception, exc:
+                results = {'failed': '%s: %s' % (type(exc).__name__, exc)}
+            output = os.fdopen(write_fd, 'w')
+            output.write(json.dumps(results))
+            output.close()
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    input = os.fdopen(read_fd)
+    try:
+        data = input.read()
+    finally:
+        input.close()
+        os.waitpid(pid, 0)
+    if not data:
+        return {'failed': 'benchmark process died'}
+    return json.loads(data)
+
+
+def use_server(server, options):
+    """Point every cached object and list at ``server``."""
+    broker_class = type('BenchmarkBroker', (connection.ConnectionBroker,),
+        {'HTTP_AUTH_URI': server.netloc, 'SECURE': False})
+    broker = broker_class('benchmark', 'benchmark')
+    # Errors should be retried quickly.
+    broker.governor = governor.RequestGovernor(
+        backoff_base=options.backoff, backoff_cap=options.backoff * 10)
+    cache.CachedObject._connection_broker = broker
+    cache.CachedList._connection_broker = broker
+    return broker
+
+
+COLUMNS = (
+    ('benchmark', '%-20s', 'name'),
+    ('ops', '%6s', 'ops'),
+    ('errors', '%6s', 'errors'),
+    ('requests', '%8s', 'requests'),
+    ('ops/s', '%9.1f', 'ops_per_second'),
+    ('p50 ms', '%8.2f', 'p50_ms'),
+    ('p90 ms', '%8.2f', 'p90_ms'),
+    ('p99 ms', '%8.2f', 'p99_ms'),
+    ('max ms', '%8.2f', 'max_ms'),
+    ('mem KB', '%8s', 'memory_kb'),
+    ('objects', '%8s', 'objects'),
+)
+
+# Compared with a saved run: higher is better for throughput, lower for the
+# rest.
+COMPARED = (('ops_per_second', 1), ('p50_ms', -1), ('p99_ms', -1),
+    ('memory_kb', -1))
+
+
+def report(results, baseline=None):
+    print ' '.join((format.replace('.1f', 's').replace('.2f', 's')) % (
+        title,) for title, format, key in COLUMNS)
+    for result in results:
+        if 'failed' in result:
+            print '%-20s failed: %s' % (result['name'], result['failed'])
+            continue
+        print ' '.join(format % (result[key],)
+            for title, format, key in COLUMNS)
+        previous = (baseline or {}).get(result['name'])
+        if previous and 'failed' not in previous:
+            changes = []
+            for key, sign in COMPARED:
+                if previous.get(key) and result.get(key) is not None:
+                    change = (float(result[key]) / previous[key] - 1) * 100
+                    changes.append('%s %+.1f%%%s' % (key, change,
+                        (change * sign < 0) and ' (worse)' or ''))
+            print '%-20s vs. baseline: %s' % ('', ', '.join(changes))
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(
+        usage='%prog [options] [benchmark ...]',
+        description='Benchmarks: %s.' % (', '.join(
+            function.__name__ for function in BENCHMARKS),))
+    fakeapi.add_options(parser)
+    parser.add_option('--ops', type='int', default=100,
+        help='operations per benchmark [%default]')
+    parser.add_option('--histories', type='int', default=5,
+        help='histories to index deeply [%default]')
+    parser.add_option('--list-size', type='int', default=10000,
+        help='items in the list to slice [%default]')
+    parser.add_option('--codec', default=None,
+        help="JSON codec to decode responses with, e.g. 'lazy'")
+    parser.add_option('--backoff', type='float', default=0.01,
+        help='base delay, in seconds, before retrying errors [%default]')
+    parser.add_option('--in-process', action='store_true', default=False,
+        help="run every benchmark in this process; don't fork")
+    parser.add_option('--save', metavar='FILE',
+        help='save the results (as JSON) to FILE')
+    parser.add_option('--compare', metavar='FILE',
+        help='compare the results with those saved in FILE')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+        help="show twactor's log output")
+    options, names = parser.parse_args(argv)
+    functions = dict((function.__name__, function) for function in BENCHMARKS)
+    for name in names:
+        if name not in functions:
+            parser.error('Unknown benchmark: %r' % (name,))
+    if options.verbose:
+        logging.getLogger('twactor').setLevel(logging.DEBUG)
+    else:
+        log.DEFAULT_HANDLER.setLevel(logging.CRITICAL)
+    if options.codec:
+        codec.configure(options.codec)
+    baseline = None
+    if options.compare:
+        baseline = dict((result['name'], result)
+            for result in json.load(open(options.compare))['results'])
+    
+    server = fakeapi.from_options(options)
+    use_server(server, options)
+    results = []
+    for function in BENCHMARKS:
+        if names and function.__name__ not in names:
+            continue
+        requests = server.request_count()
+        result = run_isolated(function, options)
+        result['name'] = function.__name__
+        result['requests'] = server.request_count() - requests
+        results.append(result)
+    report(results, baseline)
+    if options.save:
+        output = open(options.save, 'w')
+        try:
+            json.dump({'options': options.__dict__, 'results': results},
+                output, indent=2)
+        finally:
+            output.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
\ No newline at end of file
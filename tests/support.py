@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# tests.support - Shared fixtures for the test suite.
+
+import atexit
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import fakeapi
+
+from twactor import connection
+
+
+# Generated data for tests which fill lists directly, without a server.
+API = fakeapi.FakeTwitter(users=5, statuses=100)
+
+_server = None
+_brokers = []
+
+def fake_server():
+    """Return a ``fakeapi`` server, started the first time it's needed."""
+    global _server
+    if _server is None:
+        _server = fakeapi.start(fakeapi.FakeTwitter(users=10, statuses=300))
+        atexit.register(shutdown)
+    return _server
+
+
+def shutdown():
+    # Closing the pooled connections lets the server's handlers finish,
+    # rather than failing as the interpreter exits.
+    for broker in _brokers:
+        broker.close()
+    _server.shutdown()
+
+
+def broker_class(base=connection.ConnectionBroker):
+    """Return a subclass of ``base`` which talks to the fake server."""
+    return type('Fake' + base.__name__, (base,),
+        {'HTTP_AUTH_URI': fake_server().netloc, 'SECURE': False})
+
+
+def broker():
+    """Return a ``ConnectionBroker`` for the fake server."""
+    fake_broker = broker_class()('test', 'test')
+    _brokers.append(fake_broker)
+    return fake_broker
+
+
+def tweets(ids):
+    """Return ``API``'s data for the tweets with these IDs."""
+    return [API.tweet(id) for id in ids]
+
+
+def ids(objects):
+    """Return the IDs of a sequence of models."""
+    return [obj.id for obj in objects]
\ No newline at end of file
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import support
+
+from twactor import archive, json, models
+
+
+class ArchiveTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'tweets')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class RecordArchiveTest(ArchiveTestCase):
+    
+    def test_append_and_read(self):
+        records = archive.RecordArchive(self.path)
+        for id in range(10, 0, -1):
+            records.append(id, id * 60.0, {'id': id, 'text': u'caf\xe9'})
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records.load(0), {'id': 10, 'text': u'caf\xe9'})
+        self.assertEqual(records.entry(-1)[:2], (1, 60.0))
+        self.assertRaises(IndexError, records.entry, 10)
+        self.assertEqual([records.find(id) for id in (10, 5, 1, 11)],
+            [0, 5, 9, -1])
+        # Appending after reading re-maps the files.
+        records.append(0, 0.0, {'id': 0})
+        self.assertEqual(records.load(10), {'id': 0})
+        records.close()
+        reopened = archive.RecordArchive(self.path)
+        self.assertEqual(len(reopened), 11)
+        self.assertEqual(json.loads(reopened.read(3)),
+            {'id': 7, 'text': u'caf\xe9'})
+        reopened.close()
+
+
+class ArchivedUserHistoryTest(ArchiveTestCase):
+    
+    def history(self):
+        broker = support.broker()
+        user = models.User('user7')._with_connection_broker(broker)
+        return models.ArchivedUserHistory(user,
+            archive=self.path)._with_connection_broker(broker)
+    
+    def test_crawl_and_resume(self):
+        server = support.fake_server()
+        history = self.history()
+        tweet = history[150]
+        self.assert_(len(history.archive) > 150)
+        self.assert_(isinstance(history._cache[150], models.TweetRecord))
+        self.assertEqual(history.index(tweet), 150)
+        ids = [item.id for item in history[:151]]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+        history.archive.close()
+        requests = server.request_count()
+        resumed = self.history()
+        self.assertEqual(resumed[150].id, tweet.id)
+        self.assertEqual(server.request_count(), requests)
+        resumed.archive.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+
+from twactor import codec, json
+
+
+TWEETS = json.dumps([
+    {'id': 1, 'text': u'caf\xe9 "quoted" {braces} [brackets], commas',
+        'user': {'id': 10, 'screen_name': 'bob', 'tags': [1, [2], {}]}},
+    {'id': 2, 'text': '', 'user': None, 'empty': {}, 'list': []},
+])
+
+
+class LazyLoadsTest(unittest.TestCase):
+    
+    def test_matches_decoding_whole(self):
+        records = codec.lazy_loads(TWEETS)
+        self.assertEqual([record.copy() for record in records],
+            json.loads(TWEETS))
+    
+    def test_members_are_decoded_on_demand(self):
+        record = codec.lazy_loads(TWEETS)[0]
+        self.failIf(record.is_decoded('user'))
+        self.assertEqual(sorted(record.keys()), ['id', 'text', 'user'])
+        self.assertEqual(record['user']['screen_name'], 'bob')
+        self.assert_(record.is_decoded('user'))
+        self.assert_(record['user'] is record['user'])
+    
+    def test_single_objects_and_other_documents(self):
+        record = codec.lazy_loads('{"a": [1, 2], "b": {"c": null}}')
+        self.assert_(isinstance(record, codec.LazyRecord))
+        self.assertEqual(record.copy(), {'a': [1, 2], 'b': {'c': None}})
+        self.assertEqual(codec.lazy_loads('[]'), [])
+        self.assertEqual(codec.lazy_loads('[1, 2]'), [1, 2])
+        self.assertEqual(codec.lazy_loads('"text"'), 'text')
+    
+    def test_unterminated_documents(self):
+        self.assertRaises(ValueError, codec.lazy_loads, '[{"a": 1}, {"b": ')
+
+
+class LazyRecordTest(unittest.TestCase):
+    
+    def test_mapping_interface(self):
+        record = codec.lazy_loads('{"a": 1, "b": 2}')
+        record['c'] = 3
+        del record['a']
+        self.assertRaises(KeyError, record.__delitem__, 'a')
+        self.failIf('a' in record)
+        self.assertEqual(record.get('a', 'missing'), 'missing')
+        self.assertEqual(len(record), 2)
+        self.assertEqual(record.copy(), {'b': 2, 'c': 3})
+    
+    def test_update_keeps_members_undecoded(self):
+        record = codec.lazy_loads('{"a": 1, "b": {"old": true}}')
+        record['b']
+        record.update(codec.lazy_loads('{"b": {"new": true}, "c": 3}'))
+        self.failIf(record.is_decoded('b'))
+        self.assertEqual(record.copy(), {'a': 1, 'b': {'new': True}, 'c': 3})
+
+
+class CodecTest(unittest.TestCase):
+    
+    def test_get(self):
+        self.assert_(codec.get('json') is codec.JSON)
+        lazy = codec.get('lazy:json')
+        self.assert_(isinstance(lazy, codec.LazyCodec))
+        self.assert_(lazy.base is codec.JSON)
+        self.assertRaises(KeyError, codec.get, 'no-such-codec')
+    
+    def test_encodings(self):
+        text = json.dumps({'text': u'caf\xe9'}, ensure_ascii=False)
+        for name in ('json', 'lazy'):
+            loads = codec.get(name).loads
+            self.assertEqual(loads(text.encode('utf-8'))['text'], u'caf\xe9')
+            self.assertEqual(loads(text.encode('latin-1'),
+                encoding='latin-1')['text'], u'caf\xe9')
+    
+    def test_configure(self):
+        default = codec.DEFAULT
+        try:
+            self.assert_(isinstance(codec.configure('lazy'), codec.LazyCodec))
+            self.assert_(isinstance(codec.DEFAULT, codec.LazyCodec))
+        finally:
+            codec.configure(default)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+import support
+from support import ids, tweets
+
+from twactor import cache, models
+
+
+class ObjectLockTest(unittest.TestCase):
+    
+    def test_stripes(self):
+        tweet = models.Tweet(1)
+        self.assert_(cache.object_lock(tweet) is cache.object_lock(tweet))
+        self.assert_(cache.object_lock(tweet) in cache._object_locks)
+        # Objects allocated together are spread over all of the locks.
+        for objects in ([models.Tweet(id) for id in range(1000)],
+            [models.User('user%d' % (id,)) for id in range(1000)]):
+            locks = map(cache.object_lock, objects)
+            self.assertEqual(len(set(locks)), cache.OBJECT_LOCK_STRIPES)
+            self.assert_(max(map(locks.count, set(locks))) < 50)
+    
+    def test_concurrent_updates_are_counted(self):
+        tweets = [models.Tweet(id) for id in range(10)]
+        def update():
+            for i in range(200):
+                for tweet in tweets:
+                    cache.CachedObject._update_cache(tweet)
+        threads = [threading.Thread(target=update) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([tweet._updated['__count'] for tweet in tweets],
+            [800] * 10)
+
+
+class ConcurrentListTest(unittest.TestCase):
+    
+    def test_iterating_during_merges(self):
+        timeline = models.PublicTimeline()
+        timeline._insert_into_cache(tweets(range(1, 51)))
+        done, errors = threading.Event(), []
+        def merge():
+            try:
+                for start in range(51, 1000, 25):
+                    timeline._insert_into_cache(tweets(range(start,
+                        start + 25)))
+            finally:
+                done.set()
+        def read():
+            try:
+                while not done.isSet():
+                    # Each pass sees a consistent prefix of the list.
+                    seen = ids(timeline)
+                    self.assertEqual(seen, range(1, len(seen) + 1))
+                    self.assertEqual(timeline.index(models.Tweet(seen[-1])),
+                        len(seen) - 1)
+            except Exception, exc:
+                errors.append(exc)
+        readers = [threading.Thread(target=read) for i in range(3)]
+        for reader in readers:
+            reader.start()
+        merge()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(ids(timeline), range(1, 1001))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+
+from twactor import connection, models
+
+
+class ConditionalGetTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = support.fake_server()
+        self.broker = support.broker()
+    
+    def test_get_conditional(self):
+        path = '/users/show/user8.json'
+        data, headers = self.broker.get_conditional(path)
+        self.assertEqual(data['screen_name'], 'user8')
+        self.assert_(headers['etag'])
+        not_modified, headers = self.broker.get_conditional(path,
+            etag=headers['etag'])
+        self.assert_(not_modified is connection.NOT_MODIFIED)
+        data, headers = self.broker.get_conditional(path, etag='"stale"')
+        self.assertEqual(data['screen_name'], 'user8')
+        # The 304 left the pooled connection usable.
+        self.assertEqual(self.broker.connection_stats['created'], 1)
+    
+    def test_not_modified_keeps_the_cache(self):
+        user = models.User('user9')._with_connection_broker(self.broker)
+        user._update_cache()
+        data, updated = user._cache, user._updated.copy()
+        self.assertEqual(data['screen_name'], 'user9')
+        self.assert_(updated['__etag'])
+        before = self.server.requests.get('not_modified', 0)
+        user._update_cache()
+        self.assertEqual(self.server.requests['not_modified'] - before, 1)
+        self.assert_(user._cache is data)
+        self.assertEqual(user._updated['__count'], updated['__count'])
+        self.assertEqual(user._updated['__etag'], updated['__etag'])
+        self.assert_(user._updated['__time'] > updated['__time'])
+
+
+if __name__ == '__main__':
+    unittest.main()
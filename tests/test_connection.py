@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import httplib
+import socket
+import unittest
+import urllib2
+
+import support
+
+from twactor import connection
+
+
+class StaleConnection(object):
+    
+    """A connection whose server has gone away, failing as it is used."""
+    
+    opened = []
+    
+    def __init__(self, host, timeout=None, fail_to_send=False):
+        self.fail_to_send = fail_to_send
+        self.requests = []
+        StaleConnection.opened.append(self)
+    
+    def request(self, method, selector, data=None, headers={}):
+        if self.fail_to_send:
+            raise socket.error('Broken pipe')
+        self.requests.append(method)
+    
+    def getresponse(self, buffering=False):
+        raise httplib.BadStatusLine('')
+    
+    def close(self):
+        pass
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    
+    def setUp(self):
+        StaleConnection.opened = []
+        self.pool = connection.ConnectionPool()
+    
+    def urlopen(self, method, fail_to_send=False):
+        stale = StaleConnection('example.com', fail_to_send=fail_to_send)
+        self.pool.release(StaleConnection, 'example.com', stale)
+        request = connection.Request('http://example.com/', method=method)
+        request.timeout = 1
+        self.assertRaises(urllib2.URLError, self.pool.urlopen,
+            StaleConnection, request)
+        return stale
+    
+    def test_safe_methods_are_retried(self):
+        stale = self.urlopen('GET')
+        self.assertEqual(stale.requests, ['GET'])
+        self.assertEqual(len(StaleConnection.opened), 2)
+        self.assertEqual(StaleConnection.opened[1].requests, ['GET'])
+        self.assertEqual(self.pool.stats(),
+            {'created': 1, 'reused': 1, 'idle': 0})
+    
+    def test_sent_posts_are_not_retried(self):
+        for method in ('POST', 'DELETE'):
+            stale = self.urlopen(method)
+            self.assertEqual(stale.requests, [method])
+        self.assertEqual(len(StaleConnection.opened), 2)
+        self.assertEqual(self.pool.created, 0)
+    
+    def test_unsent_posts_are_retried(self):
+        self.urlopen('POST', fail_to_send=True)
+        self.assertEqual(len(StaleConnection.opened), 2)
+        self.assertEqual(StaleConnection.opened[1].requests, ['POST'])
+        self.assertEqual(self.pool.created, 1)
+
+
+class PooledBrokerTest(unittest.TestCase):
+    
+    def test_connections_are_reused(self):
+        broker = support.broker()
+        for name in ('user1', 'user2', 'user3'):
+            self.assertEqual(broker.get('/users/show/%s.json' % (name,))[
+                'screen_name'], name)
+        self.assertEqual(broker.connection_stats,
+            {'created': 1, 'reused': 2, 'idle': 1})
+        broker.close()
+        self.assertEqual(broker.connection_stats['idle'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
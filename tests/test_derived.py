@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import calendar
+import datetime
+import unittest
+
+import pytz
+
+from support import API
+
+from twactor import cache, models
+
+
+class DateParsingTest(unittest.TestCase):
+    
+    def test_utc(self):
+        value = 'Wed Aug 27 13:08:45 +0000 2008'
+        expected = datetime.datetime(2008, 8, 27, 13, 8, 45, tzinfo=pytz.utc)
+        self.assertEqual(models.parse_twitter_datetime(value), expected)
+        self.assertEqual(models.parse_twitter_timestamp(value),
+            calendar.timegm(expected.utctimetuple()))
+    
+    def test_offsets(self):
+        for value, expected in (
+            ('Wed Aug 27 13:08:45 +0530 2008', (2008, 8, 27, 7, 38, 45)),
+            ('Wed Dec 31 20:00:00 -0800 2008', (2009, 1, 1, 4, 0, 0))):
+            expected = datetime.datetime(*expected).replace(tzinfo=pytz.utc)
+            parsed = models.parse_twitter_datetime(value)
+            self.assertEqual(parsed, expected)
+            self.assertEqual(parsed.tzinfo, pytz.utc)
+            self.assertEqual(models.parse_twitter_timestamp(value),
+                calendar.timegm(expected.utctimetuple()))
+    
+    def test_matches_strptime(self):
+        for id in (1, 86400, 10 ** 7):
+            value = API.tweet(id)['created_at']
+            self.assertEqual(models.parse_twitter_timestamp(value),
+                calendar.timegm(datetime.datetime.strptime(value,
+                    models.TWITTER_TIME_FORMAT).utctimetuple()))
+
+
+class DerivedTest(unittest.TestCase):
+    
+    def test_computed_once(self):
+        tweet = models.Tweet(1, cache=API.tweet(1))
+        self.assert_(tweet.created is tweet.created)
+        self.assertEqual(tweet.source_name, 'benchmark')
+    
+    def test_replaced_cache(self):
+        tweet = models.Tweet(1, cache=API.tweet(1))
+        first = tweet.created
+        tweet._cache = API.tweet(61)
+        self.assertEqual(tweet.created - first, datetime.timedelta(minutes=1))
+    
+    def test_updated_cache(self):
+        tweet = models.Tweet(1, cache=API.tweet(1))
+        first = tweet.created
+        tweet._cache['created_at'] = API.tweet(2)['created_at']
+        self.assert_(tweet.created is first)
+        cache.CachedObject._update_cache(tweet)
+        self.assertEqual(tweet.created - first, datetime.timedelta(seconds=1))
+    
+    def test_merged_data(self):
+        identity_map = cache.IdentityMap()
+        tweet = identity_map.resolve(models.Tweet, 1, cache=API.tweet(1),
+            fetched=1)
+        first = tweet.created
+        identity_map.resolve(models.Tweet, 1, cache=dict(API.tweet(1),
+            created_at=API.tweet(3)['created_at']), fetched=2)
+        self.assertEqual(tweet.created - first, datetime.timedelta(seconds=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
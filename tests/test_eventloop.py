@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+
+from twactor import cache, connection, eventloop, exceptions, models
+
+
+class FutureTest(unittest.TestCase):
+    
+    def test_then_chains_results(self):
+        future = eventloop.Future()
+        chained = future.then(lambda value: value + 1).then(
+            lambda value: eventloop.succeed(value * 2))
+        self.failIf(chained.done())
+        future.set_result(1)
+        self.assertEqual(chained.result(), 4)
+    
+    def test_then_propagates_exceptions(self):
+        calls = []
+        future = eventloop.Future()
+        chained = future.then(calls.append)
+        future.set_exception(ValueError('failed'))
+        self.assert_(isinstance(chained.exception(), ValueError))
+        self.assertRaises(ValueError, chained.result)
+        self.assertEqual(calls, [])
+    
+    def test_resolving_twice_fails(self):
+        future = eventloop.succeed(None)
+        self.assertRaises(RuntimeError, future.set_result, None)
+
+
+class EventLoopTest(unittest.TestCase):
+    
+    def test_timers_run_in_order(self):
+        loop, calls = eventloop.EventLoop(), []
+        loop.call_later(0.02, calls.append, 'later')
+        loop.call_soon(calls.append, 'soon')
+        loop.call_later(0.01, calls.append, 'sooner').cancel()
+        loop.run()
+        self.assertEqual(calls, ['soon', 'later'])
+    
+    def test_periodic_call(self):
+        loop, calls = eventloop.EventLoop(), []
+        def tick():
+            calls.append(None)
+            if len(calls) == 3:
+                periodic.stop()
+        periodic = eventloop.PeriodicCall(loop, 0.001, tick).start()
+        loop.run()
+        self.assertEqual(len(calls), 3)
+
+
+class AsyncConnectionBrokerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = support.fake_server()
+        self.loop = eventloop.EventLoop()
+        self.broker = support.broker_class(connection.AsyncConnectionBroker)(
+            'test', 'test', loop=self.loop)
+    
+    def test_get(self):
+        user = self.loop.run_until_complete(
+            self.broker.get('/users/show/user3.json'))
+        self.assertEqual(user['screen_name'], 'user3')
+    
+    def test_many_requests_at_once(self):
+        futures = [self.broker.get('/statuses/show/%d.json' % (id,))
+            for id in range(1, 11)]
+        for future in futures:
+            self.loop.run_until_complete(future)
+        self.assertEqual([future.result()['id'] for future in futures],
+            range(1, 11))
+    
+    def test_error_status(self):
+        future = self.broker.get('/users/show/nobody.json')
+        self.loop.run(until=future)
+        self.assert_(isinstance(future.exception(),
+            exceptions.NotFoundError))
+    
+    def test_concurrent_refreshes_share_a_request(self):
+        user = models.User('user4')._with_connection_broker(
+            support.broker())
+        user._async_connection_broker = self.broker
+        before = self.server.requests.get('users_show', 0)
+        futures = [cache.refresh_async(user) for i in range(3)]
+        self.assert_(futures[0] is futures[1] is futures[2])
+        self.loop.run_until_complete(futures[0])
+        self.assertEqual(user._cache['screen_name'], 'user4')
+        self.assertEqual(self.server.requests['users_show'] - before, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
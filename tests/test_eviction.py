@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import unittest
+
+from support import tweets
+
+from twactor import cache, codec, json, models
+
+
+class LimitedTimeline(models.PublicTimeline):
+    MAX_ITEMS = 10
+
+
+class AgedTimeline(models.PublicTimeline):
+    MAX_AGE = 100
+
+
+class SizedTimeline(models.PublicTimeline):
+    MAX_BYTES = 20000
+
+
+class RecordTimeline(SizedTimeline):
+    RECORD_CLASS = models.TweetRecord
+
+
+class EvictionTest(unittest.TestCase):
+    
+    def test_max_items(self):
+        timeline = LimitedTimeline()
+        timeline._insert_into_cache(tweets(range(1, 15)))
+        self.assertEqual([tweet.id for tweet in timeline], range(5, 15))
+        self.assertEqual(timeline._offset, 4)
+        self.assertEqual(len(timeline._ids), 10)
+        self.assertEqual(len(timeline._freshness), 10)
+    
+    def test_evicted_items_leave_the_identity_map(self):
+        timeline = LimitedTimeline()
+        timeline._insert_into_cache(tweets(range(1001, 1015)))
+        self.failIf((models.Tweet, 1001) in cache.IDENTITY_MAP)
+        self.assert_((models.Tweet, 1014) in cache.IDENTITY_MAP)
+    
+    def test_views_survive_eviction(self):
+        timeline = LimitedTimeline()
+        timeline._insert_into_cache(tweets(range(1, 9)))
+        view, open_view = timeline[2:5], timeline[3:]
+        timeline._insert_into_cache(tweets(range(9, 15)))
+        self.assertEqual([tweet.id for tweet in view], [5])
+        self.assertEqual([tweet.id for tweet in open_view], range(5, 15))
+        self.assertEqual(open_view.index(models.Tweet(12)), 7)
+    
+    def test_reverse_list_evicts_the_newest(self):
+        history = models.UserHistory(models.User('user0'))
+        history.MAX_ITEMS = 3
+        history._insert_into_cache(tweets(range(50, 40, -1)))
+        self.assertEqual([tweet.id for tweet in history], [43, 42, 41])
+    
+    def test_max_age(self):
+        timeline = AgedTimeline()
+        timeline._insert_into_cache(tweets(range(1, 6)))
+        for position in (0, 1):
+            timeline._freshness.set(position, 1, time.time() - 200)
+        self.assertEqual(timeline._enforce_limits(), 2)
+        self.assertEqual([tweet.id for tweet in timeline], [3, 4, 5])
+    
+    def test_max_bytes(self):
+        for timeline_class in (SizedTimeline, RecordTimeline):
+            timeline = timeline_class()
+            for start in range(1, 400, 37):
+                timeline._insert_into_cache(tweets(range(start, start + 37)))
+                total = sum(map(timeline._item_size, timeline._cache))
+                # The running total matches measuring everything afresh.
+                self.assertEqual(timeline._bytes, total)
+                self.assert_(total <= timeline.MAX_BYTES)
+            self.assert_(0 < len(timeline._cache) < 37)
+            self.assertEqual(timeline._cache[-1]['id'], 407)
+
+
+class ItemSizeTest(unittest.TestCase):
+    
+    def test_records_count_their_values(self):
+        text = 'x' * 1000
+        record = models.TweetRecord({'id': 1, 'text': text})
+        self.assert_(sys.getsizeof(record) > sys.getsizeof(text))
+        lazy = codec.get('lazy').loads(json.dumps({'id': 1, 'text': text}))
+        self.assert_(sys.getsizeof(lazy) > sys.getsizeof(text))
+        timeline = models.PublicTimeline()
+        for item in (record, lazy, {'id': 1, 'text': text}):
+            self.assert_(timeline._item_size(item) > sys.getsizeof(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import urllib2
+
+import support
+
+import fakeapi
+
+from twactor import connection, exceptions, governor
+
+
+KEY = ('user', 'statuses')
+
+def limit_headers(limit, remaining, reset):
+    return {'x-ratelimit-limit': str(limit),
+        'x-ratelimit-remaining': str(remaining),
+        'x-ratelimit-reset': str(reset)}
+
+
+class RequestGovernorTest(unittest.TestCase):
+    
+    def test_endpoint_family(self):
+        self.assertEqual(governor.endpoint_family('/statuses/show/1.json'),
+            'statuses')
+        self.assertEqual(governor.endpoint_family('/account.json'), 'account')
+    
+    def test_unlimited_until_a_limit_is_advertised(self):
+        requests = governor.RequestGovernor(max_wait=0)
+        for i in range(1000):
+            requests.acquire(KEY)
+        requests.record(KEY, 200, {})
+        self.failIf(KEY in requests._buckets)
+        requests.record(KEY, 200, limit_headers(150, 2, time.time() + 3600))
+        requests.acquire(KEY)
+        requests.acquire(KEY)
+        self.assertRaises(exceptions.APILimitError, requests.acquire, KEY)
+    
+    def test_background_requests_leave_a_reserve(self):
+        requests = governor.RequestGovernor(limit=100, max_wait=0)
+        requests.record(KEY, 200, limit_headers(100, 10, time.time() + 3600))
+        self.assertRaises(exceptions.APILimitError, requests.acquire, KEY,
+            governor.PRIORITY_BACKGROUND)
+        requests.acquire(KEY, governor.PRIORITY_INTERACTIVE)
+    
+    def test_exhausted_limit_waits_for_the_reset(self):
+        requests = governor.RequestGovernor()
+        requests.record(KEY, 400, limit_headers(150, 0, time.time() + 0.05))
+        self.assert_(governor.limit_exhausted(
+            limit_headers(150, 0, time.time())))
+        self.failIf(governor.limit_exhausted({}))
+        start = time.time()
+        requests.acquire(KEY)
+        self.assert_(time.time() - start >= 0.04)
+    
+    def test_backoff(self):
+        requests = governor.RequestGovernor(backoff_base=1, backoff_cap=4)
+        for attempt in range(5):
+            delay = requests.backoff(KEY, attempt)
+            self.assert_(0.5 <= delay <= 6, delay)
+        self.assertEqual(requests.backoff(KEY, 0, {'retry-after': '0.01'}),
+            0.01)
+
+
+class RetryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = fakeapi.start(fakeapi.FakeTwitter(users=2, statuses=5),
+            error_rate=1.0)
+        broker_class = type('FailingBroker', (connection.ConnectionBroker,),
+            {'HTTP_AUTH_URI': self.server.netloc, 'SECURE': False})
+        self.broker = broker_class('test', 'test')
+        self.broker.governor = governor.RequestGovernor(backoff_base=0.001,
+            backoff_cap=0.01)
+    
+    def tearDown(self):
+        self.broker.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_gets_are_retried(self):
+        self.assertRaises(urllib2.HTTPError, self.broker.get,
+            '/users/show/user1.json')
+        self.assertEqual(self.server.requests['users_show'],
+            self.broker.MAX_RETRIES + 1)
+    
+    def test_only_safe_methods_are_retried(self):
+        get = connection.Request('http://example.com/', method='GET')
+        post = connection.Request('http://example.com/', method='POST')
+        delete = connection.Request('http://example.com/', method='DELETE')
+        exhausted = limit_headers(150, 0, time.time())
+        self.assert_(self.broker._retryable(get, 503, {}))
+        self.failIf(self.broker._retryable(post, 503, {}))
+        self.failIf(self.broker._retryable(delete, 503, {}))
+        self.failIf(self.broker._retryable(get, 404, {}))
+        self.failIf(self.broker._retryable(get, 400, {}))
+        self.assert_(self.broker._retryable(get, 400, exhausted))
+        self.failIf(self.broker._retryable(post, 400, exhausted))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
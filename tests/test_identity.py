@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+from support import tweets
+
+from twactor import cache, models
+
+
+class IdentityMapTest(unittest.TestCase):
+    
+    def test_resolve(self):
+        identity_map = cache.IdentityMap(max_size=2)
+        data = support.API.tweet(1)
+        tweet = identity_map.resolve(models.Tweet, 1, cache=data)
+        self.assert_(tweet._cache is data)
+        self.assert_(identity_map.resolve(models.Tweet, 1) is tweet)
+        # Older data only fills in missing keys; newer data replaces values.
+        identity_map.resolve(models.Tweet, 1, cache={'text': 'old', 'x': 1},
+            fetched=0)
+        self.assertEqual((tweet.text, tweet._cache['x']), (data['text'], 1))
+        identity_map.resolve(models.Tweet, 1, cache={'text': 'new'},
+            fetched=tweet._data_time() + 1)
+        self.assertEqual(tweet.text, 'new')
+        identity_map.resolve(models.Tweet, 2)
+        identity_map.resolve(models.Tweet, 3)
+        self.failIf((models.Tweet, 1) in identity_map)
+
+
+class BoundListTest(unittest.TestCase):
+    
+    def test_lists_share_the_mapped_objects(self):
+        broker = support.broker()
+        timeline = models.PublicTimeline()._with_connection_broker(broker)
+        timeline._insert_into_cache(tweets(range(201, 204)))
+        other = models.PublicTimeline()
+        other._insert_into_cache(tweets(range(202, 205)))
+        mapped = cache.IDENTITY_MAP.get(models.Tweet, 202)
+        self.assert_(timeline[1] is timeline[1])
+        self.assert_(timeline[1]._connection_broker is broker)
+        self.assert_(other[0] is mapped)
+        self.assert_(timeline._cache[1] is mapped._cache)
+        self.assert_(other._cache[0] is mapped._cache)
+        self.assert_(timeline[1]._updated is mapped._updated)
+    
+    def test_bound_copies_see_updates(self):
+        broker = support.broker()
+        tweet = models.Tweet._resolve(5)
+        bound = tweet._with_connection_broker(broker)
+        self.assert_(bound._with_connection_broker(broker) is bound)
+        self.assert_(bound._with_connection_broker(
+            tweet._connection_broker) is tweet)
+        bound._update_cache()
+        self.assertEqual(tweet._updated['__count'], 1)
+        self.assert_(tweet._cache is bound._cache)
+        self.assertEqual(tweet._cache['id'], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
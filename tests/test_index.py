@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from support import tweets
+
+from twactor import models
+
+
+class IndexTest(unittest.TestCase):
+    
+    def check(self, timeline):
+        """Check indexed lookups against a scan of the cached objects."""
+        objects = [obj for obj in timeline]
+        keys = [timeline._sort_key(obj) for obj in objects]
+        self.assertEqual(timeline._keys, keys)
+        self.assertEqual(sorted(timeline._ids), sorted(obj.id
+            for obj in objects))
+        for position, obj in enumerate(objects):
+            self.assertEqual(timeline.index(models.Tweet(obj.id)), position)
+            self.assert_(models.Tweet(obj.id) in timeline)
+            # Lookups by time find the first item at (or after) that time.
+            probe = (obj.created, 0)
+            if timeline._descending:
+                expected = len([key for key in keys if key > probe])
+            else:
+                expected = len([key for key in keys if key < probe])
+            self.assertEqual(timeline._bisect(probe), expected)
+        self.failIf(models.Tweet(10000) in timeline)
+        self.assertRaises(ValueError, timeline.index, models.Tweet(10000))
+    
+    def test_forward_list(self):
+        timeline = models.UserTimeline(models.User('user0'))
+        timeline.MAX_ITEMS = 12
+        pages = [range(1, 6), range(4, 12), [15, 13, 12, 14], range(16, 21)]
+        for page in pages:
+            timeline._insert_into_cache(tweets(page))
+            self.check(timeline)
+        self.assertEqual([tweet.id for tweet in timeline], range(9, 21))
+    
+    def test_reverse_list(self):
+        history = models.UserHistory(models.User('user0'))
+        history.MAX_ITEMS = 12
+        pages = [range(90, 85, -1), range(88, 80, -1), [75, 77, 76, 78],
+            range(74, 69, -1)]
+        for page in pages:
+            history._insert_into_cache(tweets(page))
+            self.check(history)
+        self.assertEqual([tweet.id for tweet in history],
+            [83, 82, 81] + range(78, 69, -1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+
+import support
+
+from twactor import log
+
+
+class GetLoggerTest(unittest.TestCase):
+    
+    def test_quiet_by_default(self):
+        logger = log.getLogger('twactor.tests.quiet')
+        self.failIf(logger.isEnabledFor(logging.DEBUG))
+        self.assert_(logger.isEnabledFor(logging.WARNING))
+        self.assertEqual(logging.getLogger('twactor').handlers,
+            [log.DEFAULT_HANDLER])
+    
+    def test_application_settings_are_kept(self):
+        root = logging.getLogger('twactor_tests_verbose')
+        root.setLevel(logging.DEBUG)
+        handler = logging.NullHandler()
+        root.addHandler(handler)
+        logger = log.getLogger('twactor_tests_verbose')
+        self.assert_(logger.isEnabledFor(logging.DEBUG))
+        self.assertEqual(logger.handlers, [handler])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+
+import support
+
+from twactor import metrics, models
+
+
+class MetricsTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.metrics = metrics.Metrics()
+    
+    def test_cache_counts_from_many_threads(self):
+        def lookups():
+            for i in range(1000):
+                self.metrics.record_cache('User', 'update_once', 'hit')
+            self.metrics.record_cache('User', 'update_once', 'miss')
+        threads = [threading.Thread(target=lookups) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts = self.metrics.snapshot()['cache']['User']['update_once']
+        self.assertEqual(counts, {'hit': 4000, 'miss': 4, 'refresh': 0,
+            'stale': 0})
+    
+    def test_finished_threads_are_folded_together(self):
+        def lookup():
+            self.metrics.record_cache('User', 'update_once', 'hit')
+        for i in range(100):
+            thread = threading.Thread(target=lookup)
+            thread.start()
+            thread.join()
+        self.assert_(len(self.metrics._thread_caches) <
+            self.metrics.RETIRE_THREADS_AT)
+        lookup()
+        counts = self.metrics.snapshot()['cache']['User']['update_once']
+        self.assertEqual(counts['hit'], 101)
+        # Only this (still running) thread keeps counts of its own.
+        self.assertEqual(len(self.metrics._thread_caches), 1)
+        lookup()
+        counts = self.metrics.snapshot()['cache']['User']['update_once']
+        self.assertEqual(counts['hit'], 102)
+    
+    def test_reset_and_disable(self):
+        self.metrics.record_cache('User', 'update_once', 'hit')
+        self.metrics.reset()
+        self.assertEqual(self.metrics.snapshot()['cache'], {})
+        self.metrics.record_cache('User', 'update_once', 'hit')
+        self.metrics.enabled = False
+        self.metrics.record_cache('User', 'update_once', 'hit')
+        self.assertEqual(self.metrics.snapshot()['cache']['User'][
+            'update_once']['hit'], 1)
+    
+    def test_request_stats(self):
+        for elapsed, status in ((0.001, 200), (0.2, 200), (60, None)):
+            event = metrics.RequestEvent('GET', 'http://example.com/',
+                '/statuses/show/1.json')
+            event.status, event.elapsed = status, elapsed
+            self.metrics.record_request(event)
+        stats = self.metrics.snapshot()['requests']['GET statuses']
+        self.assertEqual((stats['count'], stats['errors']), (3, 1))
+        self.assertEqual(stats['statuses'], {'200': 2})
+        self.assertEqual(stats['max_seconds'], 60)
+        self.assertEqual([count for bound, count in stats['histogram']
+            if count], [1, 1, 1])
+        self.assertEqual(stats['histogram'][-1], (None, 1))
+
+
+class RequestHookTest(unittest.TestCase):
+    
+    def test_hooks_see_each_request(self):
+        broker = support.broker()
+        started, finished = [], []
+        broker.before_request.append(started.append)
+        broker.after_request.append(finished.append)
+        metrics.reset()
+        user = broker.get('/users/show/user1.json')
+        self.assertEqual(user['screen_name'], 'user1')
+        self.assertEqual(started, finished)
+        event = finished[0]
+        self.assertEqual((event.method, event.family, event.status),
+            ('GET', 'users', 200))
+        self.assert_(event.bytes_received > 0)
+        self.assertEqual(
+            metrics.snapshot()['requests']['GET users']['count'], 1)
+    
+    def test_cache_lookups_are_counted(self):
+        metrics.reset()
+        user = models.User('user2')._with_connection_broker(
+            support.broker())
+        user.username
+        user.username
+        counts = metrics.snapshot()['cache']['User']
+        self.assertEqual(sum(sum(outcomes.values())
+            for outcomes in counts.values()), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+from support import ids
+
+from twactor import models
+
+
+class FailingBroker(object):
+    
+    def get(self, path, params={}, priority=None):
+        raise IOError('Connection refused')
+
+
+class UserPrefetchTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = support.fake_server()
+        self.broker = support.broker()
+    
+    def lookups(self):
+        return self.server.requests.get('users_lookup', 0)
+    
+    def test_chunks(self):
+        before = self.lookups()
+        chunk_size = models.User.LOOKUP_CHUNK_SIZE
+        models.User.LOOKUP_CHUNK_SIZE = 2
+        try:
+            users = models.User.prefetch(['user%d' % (n,) for n in range(5)],
+                connection_broker=self.broker)
+        finally:
+            models.User.LOOKUP_CHUNK_SIZE = chunk_size
+        self.assertEqual(self.lookups() - before, 3)
+        self.assertEqual([user._cache['id'] for user in users], range(1, 6))
+    
+    def test_matched_by_id_and_screen_name(self):
+        before = self.lookups()
+        named = models.User('user3')
+        users = models.User.prefetch([2, 'USER5', named, 'nobody'],
+            connection_broker=self.broker)
+        # One request for the IDs, one for the names.
+        self.assertEqual(self.lookups() - before, 2)
+        self.assert_(users[2] is named)
+        self.assertEqual([user._cache.get('screen_name') for user in users],
+            ['user1', 'user5', 'user3', 'nobody'])
+        self.assertEqual([user._cache.get('id') for user in users],
+            [2, 6, 4, None])
+        self.assertEqual(users[0]._cache['followers_count'], 3)
+    
+    def test_failed_lookups_leave_caches_alone(self):
+        users = models.User.prefetch(['user1', 7],
+            connection_broker=FailingBroker())
+        self.assertEqual([user._cache for user in users],
+            [{'screen_name': 'user1'}, {'id': 7}])
+
+
+
+class HistoryPrefetchTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = support.fake_server()
+        broker = support.broker()
+        user = models.User('user2')._with_connection_broker(broker)
+        user._update_cache()
+        self.history = models.UserHistory(user)._with_connection_broker(broker)
+        self.history._count = 20
+    
+    def pages(self):
+        return self.server.requests.get('user_timeline', 0)
+    
+    def test_pages_are_merged_in_order(self):
+        before = self.pages()
+        self.history._prefetch_to(99)
+        self.assertEqual(self.pages() - before, 5)
+        self.assertEqual(self.history._cache_page, 6)
+        self.assertEqual(ids(self.history._cache_to_obj(item)
+            for item in self.history._cache), range(900, 800, -1))
+        # Everything else, for a negative index.
+        self.history._prefetch_to(-1)
+        self.assertEqual(self.pages() - before, 15)
+        self.assertEqual(ids(self.history._cache_to_obj(item)
+            for item in self.history._cache), range(900, 600, -1))
+    
+    def test_nothing_to_prefetch(self):
+        before = self.pages()
+        self.history._prefetch_to(19)
+        self.assertEqual(self.pages(), before)
+    
+    def test_stops_at_a_failed_page(self):
+        fetch_page = self.history._fetch_page
+        self.history._fetch_page = lambda page: (None if page == 3 else
+            fetch_page(page))
+        self.history._prefetch_to(99)
+        self.assertEqual(self.history._cache_page, 3)
+        self.assertEqual(len(self.history._cache), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+import pytz
+
+from support import API
+
+from twactor import codec, json, models
+
+
+class RecordTimeline(models.PublicTimeline):
+    RECORD_CLASS = models.TweetRecord
+
+
+class TweetRecordTest(unittest.TestCase):
+    
+    def test_round_trip(self):
+        data = API.tweet(3)
+        record = models.TweetRecord(data)
+        self.assertEqual(record.copy(), data)
+        self.assertEqual(sorted(record.keys()), sorted(data.keys()))
+        self.assertEqual(dict(record.iteritems()), data)
+        self.assertEqual(json.loads(json.dumps(record.copy())),
+            json.loads(json.dumps(data)))
+        self.assertEqual(models.TweetRecord(record.copy()).copy(), data)
+    
+    def test_round_trip_from_lazy_record(self):
+        data = API.tweet(4)
+        lazy = codec.get('lazy').loads(json.dumps(data))
+        self.assertEqual(models.TweetRecord(lazy).copy(),
+            json.loads(json.dumps(data)))
+    
+    def test_created_at_is_parsed(self):
+        record = models.TweetRecord(API.tweet(5))
+        self.assert_(isinstance(record.created, (int, long)))
+        self.assertEqual(record['created_at'], API.tweet(5)['created_at'])
+    
+    def test_extra_keys(self):
+        data = dict(API.tweet(6), geo={'type': 'Point'})
+        record = models.TweetRecord(data)
+        self.assertEqual(record.extra, {'geo': {'type': 'Point'}})
+        self.assertEqual(record.copy(), data)
+    
+    def test_mapping_interface(self):
+        record = models.TweetRecord({'id': 7})
+        self.assertRaises(KeyError, record.__getitem__, 'text')
+        self.assertEqual(record.get('text', 'none'), 'none')
+        self.failIf('text' in record)
+        self.assertEqual(record.setdefault('text', 'hello'), 'hello')
+        self.assertEqual(record.setdefault('text', 'goodbye'), 'hello')
+        record.update({'truncated': True}, extra_key=1)
+        record.update([('favorited', False)])
+        self.assertEqual(record.copy(), {'id': 7, 'text': 'hello',
+            'truncated': True, 'favorited': False, 'extra_key': 1})
+        self.assertEqual(len(record), 5)
+    
+    def test_users_are_interned(self):
+        first = models.TweetRecord(API.tweet(1))
+        second = models.TweetRecord(API.tweet(1 + API.users))
+        self.assertEqual(first['user']['id'], second['user']['id'])
+        self.assert_(first['user'] is second['user'])
+    
+    def test_newer_user_data_replaces_interned_values(self):
+        user = {'id': 9001, 'screen_name': 'interned', 'followers_count': 5}
+        first = models.TweetRecord({'id': 9001, 'user': user})
+        models.TweetRecord({'id': 9002,
+            'user': dict(user, followers_count=20)})
+        self.assertEqual(first['user']['followers_count'], 20)
+        # Possibly older data, as from an archive, only fills in gaps.
+        models.TweetRecord({'id': 9000, 'user': dict(user, followers_count=1,
+            location='Nowhere')}, fresh=False)
+        self.assertEqual(first['user']['followers_count'], 20)
+        self.assertEqual(first['user']['location'], 'Nowhere')
+    
+    def test_tweet_users_see_newer_data(self):
+        timeline = RecordTimeline()
+        older = API.tweet(301)
+        older['user']['followers_count'] = 5
+        timeline._insert_into_cache([older])
+        self.assertEqual(timeline[0].user._cache['followers_count'], 5)
+        newer = API.tweet(302)
+        newer['user']['followers_count'] = 20
+        timeline._insert_into_cache([newer])
+        for tweet in timeline:
+            self.assertEqual(tweet.user._cache['followers_count'], 20)
+    
+    def test_tweet_reads_record(self):
+        record = models.TweetRecord(API.tweet(9))
+        tweet = models.Tweet(9, cache=record)
+        self.assertEqual(tweet.text, API.tweet(9)['text'])
+        self.assertEqual(tweet.created.tzinfo, pytz.utc)
+        self.assertEqual(tweet.created.replace(tzinfo=None),
+            datetime.datetime.utcfromtimestamp(record.created))
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
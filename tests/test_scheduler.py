@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import threading
+import time
+import unittest
+import weakref
+
+import support
+
+from twactor import cache
+
+
+class Polled(object):
+    
+    UPDATE_INTERVAL = 60
+    
+    def __init__(self):
+        self._updated = {}
+        self.updates = []
+    
+    def _update_cache(self):
+        self.updates.append(time.time())
+
+
+class RefreshSchedulerTest(unittest.TestCase):
+    
+    def test_dispatch_interval(self):
+        scheduler = cache.RefreshScheduler(workers=2, jitter=0)
+        polled = Polled()
+        start = time.time()
+        scheduler.register(polled, interval=0.05, delay=0.02)
+        time.sleep(0.3)
+        scheduler.unregister(polled)
+        updates = polled.updates[:]
+        self.assert_(4 <= len(updates) <= 6, updates)
+        self.assert_(updates[0] - start >= 0.02)
+        for previous, update in zip(updates, updates[1:]):
+            self.assert_(update - previous >= 0.045, update - previous)
+        time.sleep(0.1)
+        self.assertEqual(len(polled.updates), len(updates))
+        self.failIf(scheduler.is_registered(polled))
+    
+    def test_jitter_bounds(self):
+        scheduler = cache.RefreshScheduler(jitter=0.2)
+        polled = Polled()
+        entry = cache.ScheduleEntry(weakref.ref(polled), None)
+        intervals = []
+        for i in range(200):
+            scheduler._refresh(entry)
+            due = scheduler._heap.pop()[0]
+            intervals.append(due - polled.updates[-1])
+        # Within 20% of UPDATE_INTERVAL, and spread across that range.
+        self.assert_(48 <= min(intervals) < 54, min(intervals))
+        self.assert_(66 < max(intervals) <= 72.01, max(intervals))
+    
+    def test_unregistered_on_collection(self):
+        scheduler = cache.RefreshScheduler()
+        polled = Polled()
+        scheduler.register(polled, delay=60)
+        self.assert_(scheduler.is_registered(polled))
+        self.assertEqual(len(scheduler), 1)
+        del polled
+        gc.collect()
+        self.assertEqual(len(scheduler), 0)
+
+
+
+class Revalidated(cache.CachedObject):
+    
+    def __init__(self, *args, **kwargs):
+        self.updates = []
+        self.finish = threading.Event()
+        self.finish.set()
+    
+    def _update_cache(self):
+        self.finish.wait()
+        self.updates.append(threading.currentThread())
+    
+    @property
+    @cache.update_on_time(1, max_age=10)
+    def value(self):
+        return len(self.updates)
+
+
+class StaleWhileRevalidateTest(unittest.TestCase):
+    
+    def revalidated(self, age):
+        obj = Revalidated()
+        obj._updated.update({'__count': 1, '__time': time.time() - age})
+        return obj
+    
+    def test_stale_reads_return_at_once(self):
+        obj = self.revalidated(5)
+        obj.finish.clear()
+        start = time.time()
+        self.assertEqual([obj.value for i in range(5)], [0] * 5)
+        self.assert_(time.time() - start < 0.5)
+        # One background update was queued, however many reads saw it stale.
+        self.failIf(cache.SCHEDULER.refresh_soon(obj))
+        obj.finish.set()
+        for i in range(100):
+            if obj.updates and id(obj) not in cache.SCHEDULER._pending:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(obj.updates), 1)
+        self.assert_(obj.updates[0] is not threading.currentThread())
+        self.assertEqual(obj._updated['__count'], 2)
+        self.assert_(time.time() - obj._updated['__time'] < 1)
+        self.assertEqual(obj.value, 1)
+    
+    def test_expired_reads_wait(self):
+        for obj in (self.revalidated(20), Revalidated()):
+            self.assertEqual(obj.value, 1)
+            self.assertEqual(obj.updates, [threading.currentThread()])
+    
+    def test_fresh_reads(self):
+        obj = self.revalidated(0)
+        self.assertEqual(obj.value, 0)
+        self.failIf(id(obj) in cache.SCHEDULER._pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
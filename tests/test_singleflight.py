@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+import urllib2
+
+import support
+
+import fakeapi
+
+from twactor import cache, connection, models
+
+
+def in_threads(count, function):
+    """Call ``function`` in ``count`` threads at once, and wait for them."""
+    threads = [threading.Thread(target=function) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class SingleFlightTest(unittest.TestCase):
+    
+    def test_waiters_get_the_leaders_exception(self):
+        flight = cache.SingleFlight()
+        calls, errors = [], []
+        started, finish = threading.Event(), threading.Event()
+        def work():
+            calls.append(None)
+            started.set()
+            finish.wait()
+            raise ValueError('failed')
+        def call():
+            try:
+                flight.do('key', work)
+            except ValueError, exc:
+                errors.append(exc)
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        waiters = threading.Thread(target=in_threads, args=(4, call))
+        waiters.start()
+        time.sleep(0.05)
+        finish.set()
+        leader.join()
+        waiters.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(errors), 5)
+        self.assert_(all(error is errors[0] for error in errors))
+        self.assertEqual(len(flight), 0)
+    
+    def test_reentrant_calls_run_directly(self):
+        flight = cache.SingleFlight()
+        self.assertEqual(flight.do('key', flight.do, 'key', lambda: 1), 1)
+
+
+class ColdMissTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.server = fakeapi.start(fakeapi.FakeTwitter(users=5, statuses=5),
+            latency=0.1)
+        broker_class = type('SlowBroker', (connection.ConnectionBroker,),
+            {'HTTP_AUTH_URI': self.server.netloc, 'SECURE': False})
+        self.broker = broker_class('test', 'test')
+    
+    def tearDown(self):
+        self.broker.close()
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def test_cold_misses_share_one_request(self):
+        users, errors = [], []
+        def lookup():
+            user = models.User('user3')._with_connection_broker(self.broker)
+            users.append(user)
+            user._update_cache()
+        in_threads(8, lookup)
+        self.assertEqual(self.server.requests['users_show'], 1)
+        self.assertEqual([user._cache.get('id') for user in users], [4] * 8)
+        # A failed request fails every thread which waited for it.
+        def failed_lookup():
+            user = models.User('nobody')._with_connection_broker(self.broker)
+            try:
+                user._conditional_get(*user._update_request())
+            except urllib2.HTTPError, exc:
+                errors.append(exc)
+        in_threads(8, failed_lookup)
+        self.assertEqual(self.server.requests['users_show'], 2)
+        self.assertEqual(len(errors), 8)
+        self.assert_(all(error is errors[0] for error in errors))
+        self.assertEqual(errors[0].code, 404)
+        errors[0].close()
+
+
+if __name__ == '__main__':
+    unittest.main()
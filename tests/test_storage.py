@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import support
+
+from twactor import models, storage
+
+
+class SQLiteStorageTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.storage = storage.SQLiteStorage()
+    
+    def tearDown(self):
+        self.storage.close()
+    
+    def test_objects(self):
+        self.assertEqual(self.storage.load_object('User', 'bob'), None)
+        self.storage.save_object('User', ['bob', '1'], {'id': 1},
+            {'__count': 1})
+        for key in ('bob', '1'):
+            self.assertEqual(self.storage.load_object('User', key),
+                ({'id': 1}, {'__count': 1}))
+    
+    def test_lists(self):
+        self.assertEqual(self.storage.load_list('UserTimeline', 'bob'), None)
+        self.storage.save_list('UserTimeline', 'bob', {'__count': 1},
+            [(2, {'id': 2}, 1, 100.0), (1, {'id': 1}, 1, 100.0)])
+        self.storage.save_list('UserTimeline', 'bob', {'__count': 2},
+            [(3, {'id': 3}, 1, 200.0), (1, {'id': 1}, 2, 200.0)])
+        meta, items = self.storage.load_list('UserTimeline', 'bob')
+        self.assertEqual(meta, {'__count': 2})
+        # Items keep the place they were first saved in.
+        self.assertEqual([(data['id'], count) for item_id, data, count, time
+            in items], [(2, 1), (1, 2), (3, 1)])
+        meta, items = self.storage.load_list('UserTimeline', 'bob',
+            since=150)
+        self.assertEqual([data['id'] for item_id, data, count, time in items],
+            [1, 3])
+    
+    def test_records_are_encoded_as_plain_json(self):
+        record = models.TweetRecord({'id': 1, 'text': 'hello'})
+        self.storage.save_object('Tweet', ['1'], record, {})
+        self.assertEqual(self.storage.load_object('Tweet', '1')[0],
+            {'id': 1, 'text': 'hello'})
+
+
+class SharedSQLiteStorageTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = storage.SharedSQLiteStorage(
+            os.path.join(self.directory, 'cache.db'), lease_ttl=30)
+    
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+    
+    def test_leases(self):
+        results = []
+        def other_owner():
+            results.append(self.storage.acquire_lease('User', 'bob'))
+        def in_thread():
+            thread = threading.Thread(target=other_owner)
+            thread.start()
+            thread.join()
+            return results.pop()
+        self.assert_(self.storage.acquire_lease('User', 'bob'))
+        self.assert_(self.storage.acquire_lease('User', 'bob'))
+        self.failIf(in_thread())
+        self.storage.release_lease('User', 'bob')
+        self.assert_(in_thread())
+
+
+class StoredTimeline(models.UserTimeline):
+    _storage = storage.SQLiteStorage()
+
+
+class StoredListTest(unittest.TestCase):
+    
+    def test_list_is_loaded_from_storage(self):
+        server = support.fake_server()
+        broker = support.broker()
+        timeline = StoredTimeline(models.User('user6'))._with_connection_broker(
+            broker)
+        timeline._update_cache()
+        ids = [tweet.id for tweet in timeline]
+        self.assert_(ids)
+        requests = server.request_count()
+        stored = StoredTimeline(models.User('user6'))
+        self.assertEqual([tweet.id for tweet in stored], ids)
+        self.assertEqual(stored._updated['__count'],
+            timeline._updated['__count'])
+        self.assertEqual(server.request_count(), requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
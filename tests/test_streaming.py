@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import StringIO
+import unittest
+
+import support
+
+from twactor import connection, json, models
+
+
+DOCUMENT = json.dumps([
+    {'id': 1, 'text': 'brackets ] } [ { in a string'},
+    {'id': 2, 'text': 'an escaped \\" quote, and a \\\\'},
+    {'id': 3, 'nested': {'list': [1, [2, 3]], 'object': {}}},
+    [4, 5],
+])
+
+
+def stream(text, chunk_size):
+    return list(connection.iter_json_array(StringIO.StringIO(text),
+        chunk_size=chunk_size))
+
+
+class IterJSONArrayTest(unittest.TestCase):
+    
+    def test_matches_decoding_whole(self):
+        expected = json.loads(DOCUMENT)
+        # Every chunk size splits tokens (and escapes) at different places.
+        for chunk_size in range(1, len(DOCUMENT) + 2):
+            self.assertEqual(stream(DOCUMENT, chunk_size), expected)
+    
+    def test_yields_items_as_they_arrive(self):
+        class Source(StringIO.StringIO):
+            reads = 0
+            def read(self, size=-1):
+                self.reads += 1
+                return StringIO.StringIO.read(self, size)
+        source = Source(DOCUMENT)
+        items = connection.iter_json_array(source, chunk_size=8)
+        self.assertEqual(items.next()['id'], 1)
+        self.assert_(source.reads * 8 < len(DOCUMENT))
+    
+    def test_whitespace_and_empty_arrays(self):
+        self.assertEqual(stream('  [ ]  ', 1), [])
+        self.assertEqual(stream('\n[ {"a": 1} ,\n {"b": 2} ]\n', 3),
+            [{'a': 1}, {'b': 2}])
+    
+    def test_documents_which_are_not_arrays(self):
+        self.assertRaises(ValueError, stream, '{"error": "Not found"}', 4)
+        self.assertRaises(ValueError, stream, '[{"id": 1}, {"id":', 4)
+
+
+class StreamUpdateTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.broker = support.broker()
+    
+    def test_get_stream_matches_get(self):
+        path = '/statuses/user_timeline/user2.json'
+        params = {'count': 50}
+        self.assertEqual(list(self.broker.get_stream(path, params)),
+            self.broker.get(path, params))
+    
+    def test_stream_update(self):
+        timeline = models.UserTimeline(
+            models.User('user5'))._with_connection_broker(self.broker)
+        updates = timeline.stream_update()
+        first = updates.next()
+        self.assert_(isinstance(first, models.Tweet))
+        # Nothing is recorded until the whole response has been read.
+        self.assertEqual(timeline._updated['__count'], 0)
+        added = [first] + list(updates)
+        self.assertEqual(timeline._updated['__count'], 1)
+        self.assertEqual(len(timeline._cache), len(added))
+        self.assertEqual(sorted(tweet.id for tweet in timeline),
+            sorted(tweet.id for tweet in added))
+        self.assertEqual(list(timeline.stream_update()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import threading
+import unittest
+
+from support import ids, tweets
+
+from twactor import models
+
+
+class SubscriptionTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.timeline = models.PublicTimeline()
+        self.timeline._insert_into_cache(tweets(range(1, 6)))
+    
+    def test_queued_items(self):
+        subscription = self.timeline.subscribe(since_id=3)
+        self.timeline._insert_into_cache(tweets(range(6, 9)))
+        self.assertEqual(ids(subscription.poll()), [4, 5, 6, 7, 8])
+        self.assertEqual(subscription.since_id, 8)
+        self.assertRaises(Queue.Empty, subscription.next, 0.01)
+        self.timeline._insert_into_cache(tweets([9]))
+        self.assertEqual(subscription.next().id, 9)
+        subscription.close()
+        self.assertRaises(StopIteration, subscription.next)
+        self.timeline._insert_into_cache(tweets([10]))
+        self.assertEqual(subscription.poll(), [])
+    
+    def test_blocking_iteration(self):
+        subscription = self.timeline.subscribe()
+        received = []
+        def consume():
+            received.extend(ids(subscription))
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        self.timeline._insert_into_cache(tweets(range(6, 9)))
+        subscription.close()
+        consumer.join(5)
+        self.assertEqual(received, [6, 7, 8])
+    
+    def test_callback(self):
+        batches = []
+        self.timeline.subscribe(callback=lambda objects:
+            batches.append(ids(objects)))
+        self.timeline._insert_into_cache(tweets(range(6, 8)))
+        self.timeline._insert_into_cache(tweets(range(1, 9)))
+        self.assertEqual(batches, [[6, 7], [8]])
+    
+    def test_next_async(self):
+        subscription = self.timeline.subscribe()
+        future = subscription.next_async()
+        self.failIf(future.done())
+        self.timeline._insert_into_cache(tweets([6]))
+        self.assertEqual(future.result().id, 6)
+        pending = subscription.next_async()
+        subscription.close()
+        self.assertRaises(StopIteration, pending.result)
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import support
+from support import ids, tweets
+
+from twactor import cache, models
+
+
+class CachedListViewTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.timeline = models.PublicTimeline()
+        self.timeline._insert_into_cache(tweets(range(1, 11)))
+    
+    def test_slices_are_views(self):
+        view = self.timeline[2:8:2]
+        self.assert_(isinstance(view, cache.CachedListView))
+        self.assertEqual(ids(view), [3, 5, 7])
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view[-1].id, 7)
+        self.assertEqual(ids(view[1:]), [5, 7])
+        self.assertEqual(ids(self.timeline[8:2:-3]), [9, 6])
+        self.assertEqual(ids(view[5:]), [])
+        self.assert_(models.Tweet(5) in view)
+        self.failIf(models.Tweet(4) in view)
+        self.assertRaises(ValueError, view.index, models.Tweet(4))
+    
+    def test_open_views_grow_with_the_list(self):
+        view, closed = self.timeline[7:], self.timeline[7:9]
+        self.timeline._insert_into_cache(tweets(range(11, 14)))
+        self.assertEqual(ids(view), range(8, 14))
+        self.assertEqual(ids(view[2:]), range(10, 14))
+        self.assertEqual(ids(closed), [8, 9])
+    
+    def test_copy(self):
+        copy = self.timeline[1:4].copy()
+        self.assert_(isinstance(copy, models.PublicTimeline))
+        self.timeline._insert_into_cache(tweets(range(11, 14)))
+        self.assertEqual(ids(copy), [2, 3, 4])
+    
+    def test_parent_attributes_are_forwarded(self):
+        user = models.User('user1')
+        history = models.UserHistory(user)
+        view = history[:]
+        self.assert_(view.user is user)
+        self.assert_(view.update_monitor is history.update_monitor)
+        self.assert_(view.OBJ_CLASS is models.Tweet)
+        self.assertEqual(view._update_cache, history._update_cache)
+        self.assertRaises(AttributeError, getattr, view, '_cache')
+        broker = support.broker()
+        moved = view._with_connection_broker(broker)
+        self.assert_(isinstance(moved, cache.CachedListView))
+        self.assert_(moved._connection_broker is broker)
+    
+    def test_str_is_the_parents(self):
+        timeline = models.UserTimeline(models.User('us\xc3\xa9r1'))
+        timeline._insert_into_cache(tweets(range(1, 11)))
+        for view in (timeline[:], timeline[2:5][1:]):
+            self.assertEqual(str(view), 'us\xc3\xa9r1')
+            self.assertEqual(unicode(view), u'us\xe9r1')
+
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -26,5 +26,6 @@ def function_sync(from_fun, to_fun):
     to_fun.__doc__ = from_fun.__doc__
     return to_fun
 
-__all__ = ['cache', 'connection', 'function_sync', 'json', 'log', 'models',
-    'propertyfix']
\ No newline at end of file
+__all__ = ['archive', 'cache', 'codec', 'connection', 'eventloop',
+    'function_sync', 'governor', 'json', 'log', 'metrics', 'models',
+    'propertyfix', 'storage']
\ No newline at end of file
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# twactor.archive - Append-only, memory-mapped record archives.
+
+import mmap
+import os
+import struct
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+from twactor import json
+
+
+class RecordArchive(object):
+    
+    """
+    An append-only archive of JSON records, read through ``mmap``.
+    
+    Records live in two files. The data file holds each record's compact JSON
+    encoding, one after another. The index file (``path + '.idx'``) holds one
+    fixed-size entry per record: its ID, its timestamp, and the offset and
+    length of its encoding in the data file. Entries are read straight out of
+    the mapped index, and a record is only decoded when it is asked for, so an
+    archive of millions of records costs next to nothing until it is read.
+    
+    Records must be appended in sort order (by timestamp and ID, ascending or
+    descending); ``find()`` relies on it.
+    """
+    
+    ENTRY = struct.Struct('<qdQI') # id, timestamp, offset, length.
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data_file = open(path, 'ab+')
+        self._index_file = open(path + '.idx', 'ab+')
+        self._data_map = self._index_map = None
+        self._data_size = os.fstat(self._data_file.fileno()).st_size
+        index_size = os.fstat(self._index_file.fileno()).st_size
+        self._length = index_size // self.ENTRY.size
+    
+    def __len__(self):
+        return self._length
+    
+    def _map(self, fp, current, size):
+        # Map (or re-map, once the file has grown) the first ``size`` bytes.
+        if current is not None and len(current) >= size:
+            return current
+        fp.flush()
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def entry(self, index):
+        """Return the ``(id, timestamp, offset, length)`` of a record."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('archive index out of range')
+        position = (index + 1) * self.ENTRY.size
+        if self._index_map is None or len(self._index_map) < position:
+            self._lock.acquire()
+            try:
+                self._index_map = self._map(self._index_file,
+                    self._index_map, position)
+            finally:
+                self._lock.release()
+        return self.ENTRY.unpack_from(self._index_map,
+            index * self.ENTRY.size)
+    
+    def read(self, index):
+        """Return the raw (JSON-encoded) record at ``index``."""
+        offset, length = self.entry(index)[2:]
+        if self._data_map is None or len(self._data_map) < offset + length:
+            self._lock.acquire()
+            try:
+                self._data_map = self._map(self._data_file, self._data_map,
+                    offset + length)
+            finally:
+                self._lock.release()
+        return self._data_map[offset:offset + length]
+    
+    def load(self, index):
+        """Return the decoded record at ``index``."""
+        return json.loads(self.read(index))
+    
+    def append(self, id, timestamp, record):
+        """Add a record (a JSON-serializable object) to the end."""
+        encoded = json.dumps(record, separators=(',', ':'))
+        self._lock.acquire()
+        try:
+            self._data_file.write(encoded)
+            self._index_file.write(self.ENTRY.pack(id, timestamp,
+                self._data_size, len(encoded)))
+            self._data_size += len(encoded)
+            self._data_file.flush()
+            self._index_file.flush()
+            self._length += 1
+        finally:
+            self._lock.release()
+    
+    def find(self, id):
+        """Return the position of the record with ``id``, or ``-1``."""
+        low, high = 0, self._length
+        if not high:
+            return -1
+        descending = self.entry(0)[0] > self.entry(-1)[0]
+        while low < high:
+            middle = (low + high) // 2
+            middle_id = self.entry(middle)[0]
+            if middle_id == id:
+                return middle
+            elif (middle_id > id) == descending:
+                low = middle + 1
+            else:
+                high = middle
+        return -1
+    
+    def close(self):
+        self._lock.acquire()
+        try:
+            for mapping in (self._data_map, self._index_map):
+                if mapping is not None:
+                    mapping.close()
+            self._data_map = self._index_map = None
+            self._data_file.close()
+            self._index_file.close()
+        finally:
+            self._lock.release()
+
+
+class ArchiveRecords(object):
+    
+    """
+    The records of an archive, as an append-only sequence.
+    
+    This stands in for a cached list's ``_cache``. Items are decoded with
+    ``decode`` as they are read; ``identify(item)`` should return the
+    ``(id, timestamp)`` to index an appended item under.
+    """
+    
+    def __init__(self, archive, decode, identify):
+        self.archive = archive
+        self.decode = decode
+        self.identify = identify
+    
+    def __len__(self):
+        return len(self.archive)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        return self.decode(self.archive.load(index))
+    
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+    
+    def append(self, item):
+        id, timestamp = self.identify(item)
+        if hasattr(item, 'copy') and not isinstance(item, dict):
+            item = item.copy()
+        self.archive.append(id, timestamp, item)
+    
+    def insert(self, index, item):
+        if index != len(self):
+            raise ValueError('records can only be added to the end of an '
+                'archive')
+        self.append(item)
+
+
+class ArchiveKeys(object):
+    
+    """
+    The sort keys of an archive's records, computed from its index.
+    
+    This stands in for a cached list's ``_keys``; ``make_key(id, timestamp)``
+    builds a key. Adding keys is a no-op, since appending a record to the
+    archive indexes it.
+    """
+    
+    def __init__(self, archive, make_key):
+        self.archive = archive
+        self.make_key = make_key
+    
+    def __len__(self):
+        return len(self.archive)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        id, timestamp = self.archive.entry(index)[:2]
+        return self.make_key(id, timestamp)
+    
+    def append(self, key):
+        pass
+    
+    def insert(self, index, key):
+        pass
+
+
+class ArchiveIDs(object):
+    
+    """
+    A mapping from record ID to sort key, looked up in an archive's index.
+    
+    This stands in for a cached list's ``_ids``. Like ``ArchiveKeys``, it is
+    kept up to date by the archive itself, so assignments are ignored.
+    """
+    
+    def __init__(self, archive, make_key):
+        self.archive = archive
+        self.make_key = make_key
+    
+    def __len__(self):
+        return len(self.archive)
+    
+    def __contains__(self, id):
+        return isinstance(id, (int, long)) and self.archive.find(id) >= 0
+    
+    def __getitem__(self, id):
+        index = self.archive.find(id) if isinstance(id, (int, long)) else -1
+        if index < 0:
+            raise KeyError(id)
+        return self.make_key(*self.archive.entry(index)[:2])
+    
+    def __setitem__(self, id, key):
+        pass
+    
+    def get(self, id, default=None):
+        try:
+            return self[id]
+        except KeyError:
+            return default
+    
+    def update(self, *args, **kwargs):
+        pass
\ No newline at end of file
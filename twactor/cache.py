@@ -1,14 +1,24 @@
 # -*- coding:utf-8 -*-
 # twactor.cache - Cache framework for twactor.
 
+import array
+import bisect
+import collections
+import heapq
+import itertools
 import operator
+import Queue
+import random
+import sys
 import time
+import weakref
 try:
     import threading
 except:
     import dummy_threading as threading
 
-from twactor import connection, function_sync, propertyfix
+from twactor import (connection, eventloop, function_sync, governor, log,
+    metrics, propertyfix)
 
 
 class CachedMetaclass(type):
@@ -20,10 +30,17 @@ class CachedMetaclass(type):
         # Fix _update_cache
         update_cache = attrs.get('_update_cache', lambda *args, **kwargs: None)
         def fixed_update_cache(self, *args, **kwargs):
-            val = update_cache(self, *args, **kwargs)
+            self._load_from_storage()
+            def update():
+                val = update_cache(self, *args, **kwargs)
+                if hasattr(bases[-1], '_update_cache'):
+                    bases[-1]._update_cache(self, *args, **kwargs)
+                return val
             if hasattr(bases[-1], '_update_cache'):
-                bases[-1]._update_cache(self, *args, **kwargs)
-            return val
+                # Concurrent updates of one object are coalesced into one.
+                return IN_FLIGHT.do(('object', id(self)), shared_update, self,
+                    update)
+            return update()
         attrs['_update_cache'] = function_sync(update_cache, fixed_update_cache)
         
         # Fix __init__
@@ -37,6 +54,173 @@ class CachedMetaclass(type):
         return type.__new__(cls, name, bases, attrs)
 
 
+class IdentityMap(object):
+    
+    """
+    A thread-safe, size-limited map from ``(class, id)`` to cached objects.
+    
+    Resolving the same tweet or user through the map always yields the same
+    object (and hence the same cache dictionary) for as long as it stays in the
+    map. Once the map holds more than ``max_size`` objects, the least recently
+    used ones are evicted.
+    """
+    
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._objects = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._objects)
+    
+    def __contains__(self, key):
+        return key in self._objects
+    
+    def get(self, cls, id, default=None):
+        self._lock.acquire()
+        try:
+            obj = self._objects.pop((cls, id), None)
+            if obj is None:
+                return default
+            self._objects[(cls, id)] = obj
+            return obj
+        finally:
+            self._lock.release()
+    
+    def resolve(self, cls, id, cache=None, fetched=None):
+        """
+        Get the object for ``(cls, id)``, creating it if necessary.
+        
+        A new object is created as ``cls(id, cache=cache)``. If the object
+        already exists, any keys in ``cache`` which are missing from its own
+        cache are filled in. ``fetched`` is when ``cache`` was fetched; if that
+        is no older than the object's own data (see ``_data_time()``), the
+        values in ``cache`` replace the object's too.
+        """
+        self._lock.acquire()
+        try:
+            obj = self._objects.pop((cls, id), None)
+            if obj is None:
+                obj = cls(id, cache=cache if cache is not None else {})
+                if fetched is not None:
+                    obj._updated['__merged'] = fetched
+            elif cache is not None and cache is not obj._cache:
+                if fetched is not None and fetched >= obj._data_time():
+                    obj._cache.update(cache)
+                    obj._updated['__merged'] = fetched
+                else:
+                    for key in cache.keys():
+                        if key not in obj._cache:
+                            obj._cache[key] = cache[key]
+            self._objects[(cls, id)] = obj
+            while len(self._objects) > self.max_size:
+                self._objects.popitem(last=False)
+            return obj
+        finally:
+            self._lock.release()
+    
+    def discard(self, cls, id, cache=None):
+        """Forget an object (only if it holds ``cache``, when that's given)."""
+        self._lock.acquire()
+        try:
+            obj = self._objects.get((cls, id), None)
+            if cache is None or getattr(obj, '_cache', None) is cache:
+                self._objects.pop((cls, id), None)
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._objects.clear()
+        finally:
+            self._lock.release()
+
+
+global IDENTITY_MAP
+
+IDENTITY_MAP = IdentityMap()
+
+
+class InFlightCall(object):
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.thread = threading.currentThread()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    
+    """
+    Coalesce concurrent calls which would do the same work.
+    
+    While a call for a key is running, other threads calling ``do()`` with the
+    same key wait for it to finish and get its result (or its exception)
+    instead of making the call again. A thread which calls ``do()`` for a key
+    it is already running runs the call directly.
+    """
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._calls)
+    
+    def do(self, key, function, *args, **kwargs):
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = InFlightCall()
+        finally:
+            self._lock.release()
+        if not leader:
+            if call.thread is threading.currentThread():
+                # Called again from within the running call.
+                return function(*args, **kwargs)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.event.set()
+
+
+global IN_FLIGHT
+
+IN_FLIGHT = SingleFlight()
+
+
+# Objects are guarded by a fixed set of locks, picked by object identity,
+# rather than holding a lock each.
+OBJECT_LOCK_STRIPES = 64
+
+_object_locks = [threading.Lock() for i in xrange(OBJECT_LOCK_STRIPES)]
+
+def object_lock(obj):
+    """Return the lock guarding changes to a cached object's state."""
+    # Objects of one size sit a fixed distance apart in memory, so an address
+    # modulo the number of stripes can pick the same stripe every time; the
+    # address is scrambled (by Fibonacci hashing) first.
+    scrambled = ((id(obj) >> 4) * 0x9E3779B1) >> 16
+    return _object_locks[scrambled % OBJECT_LOCK_STRIPES]
+
+
 class CachedObject(object):
     
     """Superclass for cached objects."""
@@ -44,23 +228,207 @@ class CachedObject(object):
     __metaclass__ = CachedMetaclass
     
     _connection_broker = connection.DEFAULT_CB
+    _async_connection_broker = connection.DEFAULT_ASYNC_CB
+    _storage = None # See ``twactor.storage``.
     
     def __init__(self, *args, **kwargs):
         self._cache = kwargs.pop('cache', {})
         self._updated = kwargs.pop('_updated', {'__count': 0, '__time': 0})
     
     def _update_cache(self, *args, **kwargs):
-        self._updated['__count'] = self._updated.get('__count', 0) + 1
-        self._updated['__time'] = time.time()
+        lock = object_lock(self)
+        lock.acquire()
+        try:
+            # A revalidated (not modified) cache is fresh, but not a new
+            # version.
+            if not self.__dict__.pop('_not_modified', False):
+                self._updated['__count'] = self._updated.get('__count', 0) + 1
+            self._updated['__time'] = time.time()
+        finally:
+            lock.release()
+        self._save_to_storage()
+    
+    def _storage_keys(self):
+        """Return the keys this object is stored under (see ``_storage``)."""
+        if self._cache.get('id', None) is None:
+            return []
+        return ['id:%s' % (self._cache['id'],)]
+    
+    def _load_from_storage(self):
+        """
+        Fill an empty cache from ``_storage``, the first time it is needed.
+        
+        Only objects which have never been updated, and whose cache holds no
+        more than an identifier, are loaded; the stored ``_updated`` dictionary
+        comes with the data, so it is as fresh as it was when it was saved.
+        """
+        if self._storage is None or '_storage_loaded' in self.__dict__:
+            return
+        self._storage_loaded = True
+        if self._updated.get('__count', 0) or len(self._cache) > 1:
+            return
+        self._adopt_stored()
+    
+    def _adopt_stored(self, max_age=None):
+        """
+        Update the cache from its stored copy, if there is one.
+        
+        With ``max_age``, the stored copy is only taken if it was saved after
+        our own last update, and less than ``max_age`` seconds ago (as happens
+        when another process shares the storage). Returns whether it was taken.
+        """
+        for storage_key in self._storage_keys():
+            stored = self._storage.load_object(type(self).__name__,
+                storage_key)
+            if stored is None:
+                continue
+            data, updated = stored
+            stored_time = updated.get('__time', 0)
+            if max_age is not None and (
+                stored_time <= self._updated.get('__time', 0) or
+                time.time() - stored_time >= max_age):
+                return False
+            lock = object_lock(self)
+            lock.acquire()
+            try:
+                count = self._updated.get('__count', 0)
+                self._cache.update(data)
+                self._updated.update(updated)
+                self._updated['__count'] = max(count + 1,
+                    updated.get('__count', 0))
+            finally:
+                lock.release()
+            return True
+        return False
+    
+    def _lease_key(self):
+        keys = self._storage_keys()
+        return keys[0] if keys else None
+    
+    def _save_to_storage(self):
+        if self._storage is None:
+            return
+        keys = self._storage_keys()
+        if keys:
+            self._storage.save_object(type(self).__name__, keys, self._cache,
+                self._updated)
+    
+    def _conditional_get(self, path, params={}):
+        """
+        Fetch data for the cache, revalidating the copy we already have.
+        
+        The ``ETag`` and ``Last-Modified`` headers from the last fetch are
+        kept in ``_updated`` and sent back to the server. Returns the decoded
+        data, or ``None`` if the server says the resource has not changed; in
+        that case the update only refreshes the cache's timestamp.
+        """
+        etag = self._updated.get('__etag', None)
+        last_modified = self._updated.get('__last_modified', None)
+        # Concurrent misses for the same resource share one request.
+        key = (getattr(self._connection_broker, 'username', None), path,
+            tuple(sorted(params.items())), etag, last_modified)
+        data, headers = IN_FLIGHT.do(key,
+            self._connection_broker.get_conditional, path, params, etag=etag,
+            last_modified=last_modified)
+        if data is connection.NOT_MODIFIED:
+            self._not_modified = True
+            return None
+        self._updated['__etag'] = headers.get('etag', None)
+        self._updated['__last_modified'] = headers.get('last-modified', None)
+        return data
+    
+    def _update_request(self):
+        """Return the ``(path, params)`` to fetch on update, or ``None``."""
+        return None
+    
+    def _update_received(self, data):
+        """Store freshly-fetched data in the cache (and its bound copies')."""
+        origin = self.__dict__.get('_origin', self)
+        origin._cache = data
+        for copy in origin.__dict__.get('_bound', {}).values():
+            copy._cache = data
+    
+    def _derived_cache(self):
+        """
+        Return the dictionary of values derived from the current cache.
+        
+        The dictionary is thrown away (and a fresh one started) whenever
+        ``_cache`` is replaced, the update count changes or newer data is
+        merged into the cache (see ``IdentityMap.resolve``), so derived values
+        never outlive the data they were computed from.
+        """
+        version = (self._updated.get('__count', 0),
+            self._updated.get('__merged', 0))
+        derived = self.__dict__.get('_derived', None)
+        if (derived is None or derived[0] is not self._cache or
+            derived[1] != version):
+            derived = self._derived = (self._cache, version, {})
+        return derived[2]
+    
+    def _update_cache_async(self, connection_broker=None):
+        """
+        Asynchronous counterpart of ``_update_cache``.
+        
+        Fetches ``_update_request()`` through an ``AsyncConnectionBroker``, and
+        returns an ``eventloop.Future`` which fires with this object once the
+        cache has been updated (or with the error, if the fetch failed).
+        """
+        def received(data):
+            if data is not None:
+                self._update_received(data)
+            CachedObject._update_cache(self)
+            return self
+        return fetch_async(self, connection_broker).then(received)
+    
+    @classmethod
+    def _resolve(cls, id, cache=None, fetched=None):
+        """Get the shared instance of this class for an ID."""
+        return IDENTITY_MAP.resolve(cls, id, cache=cache, fetched=fetched)
+    
+    def _data_time(self):
+        """
+        Return when this object's data was last known to be current.
+        
+        That is the time of its last update, or of the last time fresher data
+        (from a list, or embedded in another object) was merged into it.
+        """
+        return max(self._updated.get('__time', 0),
+            self._updated.get('__merged', 0))
     
     def _with_connection_broker(self, cb):
-        copy = self._copy()
-        copy._connection_broker = cb
-        return copy
+        """
+        Return this object as seen through another connection broker.
+        
+        The copy shares its cache and ``_updated`` dictionaries with the object
+        it was made from (so an object from the identity map and its copies
+        never drift apart), and there is at most one copy per broker, for as
+        long as the copy is in use.
+        """
+        if cb is self._connection_broker:
+            return self
+        origin = self.__dict__.get('_origin', self)
+        if cb is origin._connection_broker:
+            return origin
+        lock = object_lock(origin)
+        lock.acquire()
+        try:
+            bound = origin.__dict__.get('_bound', None)
+            if bound is None:
+                bound = origin._bound = weakref.WeakValueDictionary()
+            copy = bound.get(cb, None)
+            if copy is None:
+                copy = type(self)(origin._cache.get('id', None),
+                    cache=origin._cache, _updated=origin._updated)
+                copy._connection_broker = cb
+                copy._origin = origin
+                bound[cb] = copy
+            return copy
+        finally:
+            lock.release()
     
     def _copy(self):
         return type(self)(self._cache.get('id', None), cache=self._cache.copy(),
-            updated=self._updated.copy())
+            _updated=self._updated.copy())
 
 
 class CachedMirror(object):
@@ -87,11 +455,92 @@ class CachedMirror(object):
     
     _cache = mirror_attribute('_mirrored._cache')
     _update_cache = mirror_attribute('_mirrored._update_cache')
+    _update_cache_async = mirror_attribute('_mirrored._update_cache_async')
+    _derived_cache = mirror_attribute('_mirrored._derived_cache')
+    _load_from_storage = mirror_attribute('_mirrored._load_from_storage')
     _updated = mirror_attribute('_mirrored._updated')
     
     del mirror_attribute
 
 
+class Freshness(object):
+    
+    """
+    Per-item update counts and times, parallel to a cached list's items.
+    
+    Slot ``n`` holds how many updates have seen the item at position ``n`` of
+    the cache, and when the last of them was. The counts and times are kept
+    in two arrays (four and eight bytes a slot), so the store is small, and
+    copying or trimming it is a single memory copy. The first ``untracked``
+    slots have no record (an update count of zero); lists built from items
+    which came without any, such as archives, start that way, and only pay
+    for the items they go on to see.
+    """
+    
+    def __init__(self, counts=None, times=None, untracked=0):
+        self.counts = counts if counts is not None else array.array('I')
+        self.times = times if times is not None else array.array('d')
+        self.untracked = untracked
+    
+    def __len__(self):
+        return self.untracked + len(self.counts)
+    
+    def __repr__(self):
+        return '<Freshness of %d items (%d untracked)>' % (len(self),
+            self.untracked)
+    
+    def _track(self, position):
+        if position < self.untracked:
+            # Rare: give the untracked slots a (zero) record after all.
+            self.counts[:0] = array.array('I', [0]) * self.untracked
+            self.times[:0] = array.array('d', [0]) * self.untracked
+            self.untracked = 0
+        return position - self.untracked
+    
+    def get(self, position):
+        """Return ``(count, time)`` for a position."""
+        if position < self.untracked:
+            return 0, 0
+        position -= self.untracked
+        return self.counts[position], self.times[position]
+    
+    def set(self, position, count, timestamp):
+        position = self._track(position)
+        self.counts[position] = count
+        self.times[position] = timestamp
+    
+    def insert(self, position, count, timestamp):
+        position = self._track(position)
+        self.counts.insert(position, count)
+        self.times.insert(position, timestamp)
+    
+    def touch(self, position, timestamp):
+        """Count another update seeing a position; returns the new count."""
+        position = self._track(position)
+        count = self.counts[position] = self.counts[position] + 1
+        self.times[position] = timestamp
+        return count
+    
+    def copy(self, positions=None):
+        """Copy the store, or (given a sequence of positions) part of it."""
+        if positions is None:
+            return type(self)(self.counts[:], self.times[:], self.untracked)
+        copy = type(self)()
+        for position in positions:
+            count, timestamp = self.get(position)
+            copy.counts.append(count)
+            copy.times.append(timestamp)
+        return copy
+    
+    def delete(self, start, stop):
+        """Drop the slots from ``start`` up to (not including) ``stop``."""
+        untracked = self.untracked
+        tracked = slice(max(0, start - untracked), max(0, stop - untracked))
+        del self.counts[tracked]
+        del self.times[tracked]
+        self.untracked -= max(0, min(stop, untracked) - start)
+
+
 class CachedListMetaclass(type):
     
     def __new__(cls, name, bases, attrs):
@@ -115,11 +564,15 @@ class CachedListMetaclass(type):
                     break
         if update_cache:
             def fixed_update_cache(self, *args, **kwargs):
-                data = update_cache(self, *args, **kwargs)
-                for base in reversed(bases):
-                    if hasattr(base, '_insert_into_cache'):
-                        base._insert_into_cache(self, data)
-                        break
+                self._load_from_storage()
+                def update():
+                    data = update_cache(self, *args, **kwargs)
+                    for base in reversed(bases):
+                        if hasattr(base, '_insert_into_cache'):
+                            base._insert_into_cache(self, data)
+                            break
+                # Concurrent updates of one list are coalesced into one.
+                IN_FLIGHT.do(('list', id(self)), shared_update, self, update)
             attrs['_update_cache'] = function_sync(update_cache,
                 fixed_update_cache)
         
@@ -131,43 +584,67 @@ class CachedList(object):
     __metaclass__ = CachedListMetaclass
     
     _connection_broker = connection.DEFAULT_CB
+    _async_connection_broker = connection.DEFAULT_ASYNC_CB
+    _storage = None # See ``twactor.storage``.
     _sort_attrs = ('created', 'id')
     _reverse_class = None
+    _descending = False
     
     OBJ_CLASS = lambda cache: cache
+    RECORD_CLASS = None # Optional compact, dict-like storage for fetched items.
     UPDATE_INTERVAL = 60 * 3 # Three-minute update interval by default.
     
+    # Capacity limits (see ``_enforce_limits``); ``None`` means no limit.
+    MAX_ITEMS = None
+    MAX_AGE = None # Seconds since an update last saw an item.
+    MAX_BYTES = None
+    
     def __init__(self, *args, **kwargs):
         self._cache = kwargs.pop('cache', [])
-        self._object_cache = kwargs.pop('object_cache', {})
         self._updated = kwargs.pop('updated', {'__count': 0, '__time': 0})
-        self.update_monitor = CachedListUpdateMonitorThread(self)
+        self._keys = kwargs.pop('keys', None)
+        if self._keys is None:
+            self._keys = [self._sort_key(self._cache_to_obj(item))
+                for item in self._cache]
+        self._ids = dict(zip(map(self._item_id, self._cache), self._keys))
+        self._freshness = kwargs.pop('freshness', None)
+        if self._freshness is None:
+            self._freshness = Freshness(untracked=len(self._cache))
+        # How many items have been evicted from the front of the cache.
+        self._offset = 0
+        # The total ``_item_size()`` of the cache, kept up to date once
+        # ``_enforce_limits`` has computed it (only lists with a
+        # ``MAX_BYTES`` need it).
+        self._bytes = None
+        self._subscriptions = []
+        # Held only while the in-memory structures are being changed or copied
+        # (never during a fetch), so readers are only ever held up briefly.
+        self._lock = threading.RLock()
+        self.update_monitor = CachedListUpdateMonitor(self)
     
     def __getitem__(self, pos_or_slice):
         if isinstance(pos_or_slice, (int, long)):
             return self._cache_to_obj(
                 self._cache[self._resolve_cache_index(pos_or_slice)])
+        # Slices are views onto this list; see ``CachedListView``.
+        self._load_from_storage()
         start, stop, step = [getattr(pos_or_slice, attr)
             for attr in ('start', 'stop', 'step')]
-        start = self._resolve_cache_index(start, start=True)
-        stop = self._resolve_cache_index(stop, start=False)
-        new_cache = map(self._cache.__getitem__, range(start, stop, step or 1))
-        new_updated = {'__count': self._updated['__count'],
-            '__time': self._updated['__time']}
-        for item in new_cache:
-            count_key = '%s__count' % (item.get('id', repr(item)))
-            time_key = '%s__time' % (item.get('id', repr(item)))
-            new_updated[count_key] = self._updated.get(count_key, None)
-            new_updated[time_key] = self._updated.get(time_key, None)
-        return type(self)(
-            cache=new_cache, updated=new_updated)._with_connection_broker(
-                self._connection_broker)
+        if start is not None:
+            start = self._offset + self._resolve_cache_index(start, start=True)
+        if stop is not None and stop > 0:
+            # The stop is exclusive; only the item before it need be cached.
+            stop = self._offset + self._resolve_cache_index(stop - 1) + 1
+        elif stop is not None:
+            stop = self._offset + self._resolve_cache_index(stop, start=False)
+        return CachedListView(self, start, stop, step)
     
     def __delitem__(self, pos_or_slice):
         raise NotImplementedError
     
     def __iter__(self):
-        for item in self._cache:
+        self._load_from_storage()
+        for item in self._cache_snapshot():
             yield self._cache_to_obj(item)
     
     def __reversed__(self):
@@ -176,42 +653,448 @@ class CachedList(object):
     def __contains__(self, obj):
         if not isinstance(obj, self.OBJ_CLASS):
             return False
-        return obj.id in (obj2.id for obj2 in self._objects)
+        return obj._cache.get('id', None) in self._ids
     
     def __len__(self):
         raise NotImplementedError
     
-    def _cache_to_obj(self, cache_item):
-        if 'id' in cache_item and cache_item['id'] in self._object_cache:
-            obj = self._object_cache[cache_item['id']]
-        elif 'id' in cache_item and cache_item['id'] not in self._object_cache:
-            obj = self.OBJ_CLASS(cache_item['id'], cache=cache_item)
-            self._object_cache[cache_item['id']] = obj
+    def _cache_to_obj(self, cache_item, fetched=None):
+        if (cache_item.get('id', None) is not None and
+            hasattr(self.OBJ_CLASS, '_resolve')):
+            obj = self.OBJ_CLASS._resolve(cache_item['id'], cache=cache_item,
+                fetched=fetched)
         else:
-            obj = self.OBJ_CLASS(None, cache=cache_item)
-            self._object_cache[repr(obj)] = obj
+            obj = self.OBJ_CLASS(cache_item.get('id', None), cache=cache_item)
         if hasattr(obj, '_with_connection_broker'):
             return obj._with_connection_broker(self._connection_broker)
         return obj
     
-    def _clean_object_cache(self):
-        obj_cache_ids = self._object_cache.keys()
-        data_cache_ids = map(operator.attrgetter('id'), self._objects)
-        for obj_id in obj_cache_ids:
-            if obj_id not in data_cache_ids:
-                del self._objects[obj_id]
+    def _canonical_pairs(self, fetched_data):
+        """
+        Pair fetched items with their objects, sharing one dict per object.
+        
+        Returns ``(data, object)`` pairs where ``data`` is the object's own
+        cache dictionary where possible, so that the list and the object
+        resolved through the identity map hold the same dictionary. If
+        ``RECORD_CLASS`` is set, fetched dictionaries are converted to it first.
+        """
+        fetched = time.time()
+        return [self._canonical_pair(data, fetched) for data in fetched_data]
     
-    def _copy(self):
-        copy = type(self)(cache=self._cache[:],
-            updated=self._updated.copy())
+    def _canonical_pair(self, data, fetched=None):
+        # Any mapping (such as a lazily-decoded record) is converted.
+        if (self.RECORD_CLASS is not None and hasattr(data, 'keys') and
+            not isinstance(data, self.RECORD_CLASS)):
+            data = self.RECORD_CLASS(data)
+        obj = self._cache_to_obj(data, fetched)
+        return getattr(obj, '_cache', data), obj
+    
+    def _copy(self, indices=None):
+        cache, updated, keys, freshness = self._snapshot(indices)
+        copy = type(self)(cache=cache, updated=updated, keys=keys,
+            freshness=freshness)
         copy._connection_broker = self._connection_broker
         return copy
     
+    def _snapshot(self, indices=None):
+        """
+        Return consistent copies of the cache, ``_updated``, the keys and the
+        items' ``Freshness``.
+        
+        If ``indices`` (a sequence of positions) is given, only the items at
+        those positions (and their freshness) are copied.
+        """
+        self._lock.acquire()
+        try:
+            if indices is None:
+                return (self._cache[:], self._updated.copy(), self._keys[:],
+                    self._freshness.copy())
+            return (map(self._cache.__getitem__, indices),
+                self._updated.copy(), map(self._keys.__getitem__, indices),
+                self._freshness.copy(indices))
+        finally:
+            self._lock.release()
+    
+    def _cache_snapshot(self):
+        """Return a consistent copy of just the cache."""
+        self._lock.acquire()
+        try:
+            return self._cache[:]
+        finally:
+            self._lock.release()
+    
+    def _item_id(self, cache_item):
+        if 'id' in cache_item:
+            return cache_item['id']
+        return repr(cache_item)
+    
+    def _bisect(self, key, low=0):
+        """Find the position of a sort key in the (sorted) cache."""
+        if not self._descending:
+            return bisect.bisect_left(self._keys, key, low)
+        high = len(self._keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self._keys[middle] > key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def index(self, obj):
+        """Return the position of an object in the cache, in O(log n)."""
+        item_id = getattr(obj, '_cache', {}).get('id', None)
+        self._lock.acquire()
+        try:
+            if item_id not in self._ids:
+                raise ValueError('%r is not in list' % (obj,))
+            return self._bisect(self._ids[item_id])
+        finally:
+            self._lock.release()
+    
+    def _merge_into_cache(self, fetched_data):
+        """
+        Merge a page of fetched items onto the end of the cache.
+        
+        The page is sorted on ``_sort_attrs`` (descending for reverse lists)
+        and handed to ``_merge_items``. A page of k items costs O(k log k)
+        whatever the size of the cache, and sort keys are computed once each.
+        """
+        keyed = [(self._sort_key(obj), data, obj)
+            for data, obj in self._canonical_pairs(fetched_data or [])]
+        keyed.sort(key=operator.itemgetter(0), reverse=self._descending)
+        for obj in self._merge_items(keyed):
+            pass
+    
+    def _merge_items(self, keyed_items, save=True):
+        """
+        Merge ``(key, data, object)`` triples into the cache as they come.
+        
+        This is a generator, yielding each object as it is added. Items which
+        are already cached (according to the ID index) are skipped, as are
+        any which would not extend the cache beyond the last item it held
+        before the merge started. New items are placed by bisecting only the
+        newly-added region, so they may arrive in any order; items which arrive
+        in cache order are simply appended.
+        
+        The list's lock is taken for each item, and released before the item
+        is yielded (or the next one is read), so readers can carry on while a
+        slow stream is being merged, and merges may safely overlap.
+        """
+        self._lock.acquire()
+        try:
+            # An absolute position, as an overlapping merge may evict items.
+            start = self._offset + len(self._cache)
+            tail_key = self._keys[-1] if self._keys else None
+        finally:
+            self._lock.release()
+        timestamp = time.time()
+        seen = []
+        for key, data, obj in keyed_items:
+            item_id = self._item_id(data)
+            self._lock.acquire()
+            try:
+                if item_id in self._ids:
+                    count = self._freshness.touch(
+                        self._bisect(self._ids[item_id]), timestamp)
+                    seen.append((item_id, data, count, timestamp))
+                    continue
+                seen.append((item_id, data, 1, timestamp))
+                if tail_key is not None and ((key <= tail_key)
+                    if not self._descending else (key >= tail_key)):
+                    continue
+                position = self._bisect(key, max(0, start - self._offset))
+                if position == len(self._cache):
+                    self._cache.append(data)
+                    self._keys.append(key)
+                else:
+                    self._cache.insert(position, data)
+                    self._keys.insert(position, key)
+                self._freshness.insert(position, 1, timestamp)
+                self._ids[item_id] = key
+                if self._bytes is not None:
+                    self._bytes += self._item_size(data)
+                for subscription in self._subscriptions:
+                    subscription._push(obj)
+            finally:
+                self._lock.release()
+            yield obj
+        self._lock.acquire()
+        try:
+            self._updated['__count'] = self._updated.get('__count', 0) + 1
+            self._updated['__time'] = time.time()
+            subscriptions = self._subscriptions[:]
+        finally:
+            self._lock.release()
+        for subscription in subscriptions:
+            subscription._flush()
+        self._enforce_limits()
+        if save:
+            self._save_to_storage(seen)
+    
+    def _enforce_limits(self):
+        """
+        Evict items until the list is within its capacity limits.
+        
+        Items are evicted from the front of the cache: the oldest items of a
+        forward list, and the newest of a reverse list (which grows into the
+        past), so the list holds a sliding window. ``MAX_ITEMS`` caps the
+        number of items, ``MAX_AGE`` evicts items no update has seen for that
+        many seconds (items with no record count as expired, up to the first
+        one which hasn't), and ``MAX_BYTES`` caps the total of
+        ``_item_size()`` (a running total, so only the items evicted are
+        measured). Returns the number of items evicted.
+        """
+        if (self.MAX_ITEMS is None and self.MAX_AGE is None and
+            self.MAX_BYTES is None):
+            return 0
+        self._lock.acquire()
+        try:
+            length = len(self._cache)
+            excess = 0
+            if self.MAX_ITEMS is not None:
+                excess = max(excess, length - self.MAX_ITEMS)
+            if self.MAX_AGE is not None:
+                cutoff = time.time() - self.MAX_AGE
+                while (excess < length and
+                    self._freshness.get(excess)[1] < cutoff):
+                    excess += 1
+            if excess:
+                self._evict(excess)
+            if self.MAX_BYTES is not None:
+                if self._bytes is None:
+                    self._bytes = sum(map(self._item_size, self._cache))
+                count, total = 0, self._bytes
+                while count < len(self._cache) and total > self.MAX_BYTES:
+                    total -= self._item_size(self._cache[count])
+                    count += 1
+                if count:
+                    self._evict(count)
+                    excess += count
+            return excess
+        finally:
+            self._lock.release()
+    
+    def _unsubscribe(self, subscription):
+        self._lock.acquire()
+        try:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        finally:
+            self._lock.release()
+    
+    def _evict(self, count):
+        """
+        Drop the first ``count`` items, and everything kept about them.
+        
+        Their sort keys, ID index entries and freshness go with them, and their
+        objects are dropped from the identity map (unless another list has
+        since put its own in their place). Views keep referring to the same
+        items, as ``_offset`` records how many have gone.
+        """
+        self._lock.acquire()
+        try:
+            evicted = self._cache[:count]
+            del self._cache[:count]
+            del self._keys[:count]
+            self._freshness.delete(0, count)
+            self._offset += count
+            if self._bytes is not None:
+                self._bytes -= sum(map(self._item_size, evicted))
+            for item in evicted:
+                item_id = self._item_id(item)
+                self._ids.pop(item_id, None)
+                if item_id is not None and hasattr(self.OBJ_CLASS, '_resolve'):
+                    IDENTITY_MAP.discard(self.OBJ_CLASS, item_id, cache=item)
+        finally:
+            self._lock.release()
+    
+    def _item_size(self, item):
+        """
+        Estimate the memory (in bytes) an item holds, for ``MAX_BYTES``.
+        
+        Records (such as ``TweetRecord`` and ``codec.LazyRecord``) count their
+        own values in ``__sizeof__``; for plain dictionaries the values are
+        added here.
+        """
+        size = sys.getsizeof(item)
+        if isinstance(item, dict):
+            size += sum(map(sys.getsizeof, item.itervalues()))
+        return size
+    
+    def _storage_key(self):
+        """Return the key this list is stored under, or ``None`` for none."""
+        return None
+    
+    def _storage_meta(self):
+        """Return the list-wide state to store alongside the items."""
+        return dict((key, value) for key, value in self._updated.iteritems()
+            if key.startswith('__'))
+    
+    def _load_storage_meta(self, meta):
+        self._updated.update(meta)
+    
+    def _load_from_storage(self):
+        """
+        Fill an empty list from ``_storage``, the first time it is needed.
+        
+        Stored items go through ``_canonical_pair`` like freshly-fetched ones,
+        and are re-sorted, so the sort order needn't match the stored order.
+        """
+        if self._storage is None or '_storage_loaded' in self.__dict__:
+            return
+        self._storage_loaded = True
+        if self._cache or self._updated.get('__count', 0):
+            return
+        self._adopt_stored()
+    
+    def _adopt_stored(self, max_age=None):
+        """
+        Update the list from its stored copy, if there is one.
+        
+        An empty list takes all of the stored items. With ``max_age``, only
+        items saved since our own last update are merged in, and only if the
+        stored list was updated after us and less than ``max_age`` seconds ago
+        (as happens when another process shares the storage). Returns whether
+        the stored copy was taken.
+        """
+        key = self._storage_key()
+        local_time = self._updated.get('__time', 0)
+        stored = key is not None and self._storage.load_list(
+            type(self).__name__, key,
+            since=local_time if max_age is not None else None)
+        if not stored:
+            return False
+        meta, items = stored
+        stored_time = meta.get('__time', 0)
+        if max_age is not None and (stored_time <= local_time or
+            time.time() - stored_time >= max_age):
+            return False
+        keyed, stored_freshness = [], {}
+        for item_id, data, count, timestamp in items:
+            data, obj = self._canonical_pair(data, timestamp)
+            if self._item_id(data) in self._ids:
+                continue
+            key = self._sort_key(obj)
+            keyed.append((key, data, obj))
+            stored_freshness[key] = (count, timestamp)
+        keyed.sort(key=operator.itemgetter(0), reverse=self._descending)
+        if self._cache:
+            for obj in self._merge_items(keyed, save=False):
+                pass
+            self._lock.acquire()
+            try:
+                # Merged items keep the freshness they were stored with.
+                for key, (count, timestamp) in stored_freshness.iteritems():
+                    position = self._bisect(key)
+                    if (position < len(self._keys) and
+                        self._keys[position] == key):
+                        self._freshness.set(position, count, timestamp)
+            finally:
+                self._lock.release()
+        else:
+            self._lock.acquire()
+            try:
+                self._keys[:] = [key for key, data, obj in keyed]
+                self._cache[:] = [data for key, data, obj in keyed]
+                self._bytes = None
+                self._ids.update(zip(map(self._item_id, self._cache),
+                    self._keys))
+                self._freshness = Freshness(
+                    array.array('I', [stored_freshness[key][0]
+                        for key in self._keys]),
+                    array.array('d', [stored_freshness[key][1]
+                        for key in self._keys]))
+                subscriptions = self._subscriptions[:]
+                for key, data, obj in keyed:
+                    for subscription in subscriptions:
+                        subscription._push(obj)
+            finally:
+                self._lock.release()
+            for subscription in subscriptions:
+                subscription._flush()
+        self._lock.acquire()
+        try:
+            self._load_storage_meta(meta)
+        finally:
+            self._lock.release()
+        self._enforce_limits()
+        return True
+    
+    def _lease_key(self):
+        return self._storage_key()
+    
+    def _save_to_storage(self, items):
+        if self._storage is None:
+            return
+        key = self._storage_key()
+        if key is not None:
+            self._storage.save_list(type(self).__name__, key,
+                self._storage_meta(), items)
+    
+    def stream_update(self):
+        """
+        Update the cache from a streamed response, yielding new objects.
+        
+        Instead of waiting for the whole response to be downloaded and decoded,
+        this merges each item into the cache as soon as it has been read off
+        the socket, and yields the objects which were added, so callers can
+        start work on the first items straight away. This is a generator; the
+        update only happens as it is consumed.
+        
+        ``_update_received`` is only called once the whole response has been
+        read, with the items read, so that its bookkeeping (such as
+        ``UserHistory``'s page count) isn't advanced by a response which fails
+        halfway; as the items have already been merged by then, what it
+        returns is not used.
+        """
+        request = self._update_request()
+        if request is None:
+            return
+        path, params = request
+        items = self._connection_broker.get_stream(path, params=params)
+        def keyed_items():
+            received = []
+            for item in items:
+                received.append(item)
+                data, obj = self._canonical_pair(item, time.time())
+                yield self._sort_key(obj), data, obj
+            # Before ``_merge_items`` records the update (and stores it).
+            self._update_received(received)
+        for obj in self._merge_items(keyed_items()):
+            yield obj
+    
     @property
     def _objects(self):
-        return map(self._cache_to_obj, self._cache)
+        return map(self._cache_to_obj, self._cache_snapshot())
+    
+    def prefetch(self):
+        """
+        Hydrate every object in this list at once, and return the objects.
+        
+        If ``OBJ_CLASS`` provides a ``prefetch()`` classmethod (which should
+        fill many caches with bulk requests), it is handed all of the list's
+        objects in one go; slice the list first to hydrate just a page.
+        """
+        objects = self._objects
+        if hasattr(self.OBJ_CLASS, 'prefetch'):
+            self.OBJ_CLASS.prefetch(objects,
+                connection_broker=self._connection_broker)
+        return objects
+    
+    def _prefetch_to(self, index):
+        """Hook for fetching everything up to ``index`` ahead of time."""
+        pass
     
     def _resolve_cache_index(self, index, start=True):
+        self._load_from_storage()
+        if (index is not None) and (index < 0 or index >= len(self._cache)):
+            _record(self, 'index', 'miss')
+            # Threads racing for the same list wait on one prefetch; any which
+            # wanted more than it fetched carry on with ordinary updates.
+            IN_FLIGHT.do(('prefetch', id(self)), self._prefetch_to, index)
+        else:
+            _record(self, 'index', 'hit')
         if index < 0:
             old_length, length = None, len(self._cache)
             while (old_length != length):
@@ -237,100 +1120,743 @@ class CachedList(object):
     def _sort_key(self, item):
         return operator.attrgetter(*self._sort_attrs)(item)
     
+    def _update_request(self):
+        """Return the ``(path, params)`` to fetch on update, or ``None``."""
+        return None
+    
+    def _update_received(self, data):
+        """Return the fetched items which should be merged into the cache."""
+        return data
+    
+    def _update_cache_async(self, connection_broker=None):
+        """
+        Asynchronous counterpart of ``_update_cache``.
+        
+        Returns an ``eventloop.Future`` which fires with this list once the
+        fetched items have been merged into the cache.
+        """
+        def received(data):
+            if data is not None:
+                data = self._update_received(data)
+            self._insert_into_cache(data or [])
+            return self
+        return fetch_async(self, connection_broker).then(received)
+    
+    def monitor_async(self, connection_broker=None):
+        """
+        Keep this list up-to-date from an event loop instead of a thread.
+        
+        Schedules ``_update_cache_async`` every ``UPDATE_INTERVAL`` seconds on
+        the async connection broker's event loop, and returns the
+        ``eventloop.PeriodicCall`` (call its ``stop()`` method to stop).
+        """
+        connection_broker = (connection_broker or
+            self._async_connection_broker)
+        return eventloop.PeriodicCall(connection_broker.loop,
+            self.UPDATE_INTERVAL, self._update_cache_async,
+            connection_broker).start()
+    
     def _with_connection_broker(self, connection_broker):
         copy = self._copy()
         copy._connection_broker = connection_broker
+        # Keep positions counted as before, for views onto the copy.
+        copy._offset = self._offset
         return copy
 
 
-class CachedListUpdateMonitorThread(threading.Thread):
+class CachedListView(object):
+    
+    """
+    A slice of a cached list, which copies nothing.
+    
+    Slicing a ``CachedList`` returns one of these. A view holds just its parent
+    list and a range of the parent's positions (``start``, ``stop`` and
+    ``step``, as for ``slice``), and reads the parent's cache whenever it is
+    used. Items keep their positions once they are in a list (new ones only
+    ever go after them), so a view goes on referring to the same items as the
+    list grows, and a view whose ``stop`` was left open (``timeline[20:]``)
+    takes in the new items too. Positions are counted from the first item the
+    list ever held, so items evicted from the list simply drop out of the
+    view. Views can be sliced in turn; ``copy()`` makes an independent list
+    holding just the view's items.
+    
+    A view is not itself a ``CachedList``, so ``isinstance`` checks against
+    the parent's class fail; use ``copy()`` where one is needed. ``str()`` and
+    ``unicode()`` of a view are those of its parent. The parent's public
+    attributes (such as a timeline's ``user`` or ``update_monitor``), and the
+    private ones listed in ``PARENT_ATTRS``, are forwarded to the parent, so
+    updating through a view updates the list it is a view of.
+    """
+    
+    PARENT_ATTRS = frozenset(['OBJ_CLASS', '_connection_broker',
+        '_async_connection_broker', '_update_cache', '_update_cache_async',
+        '_load_from_storage'])
+    
+    def __init__(self, parent, start=None, stop=None, step=None):
+        if step == 0:
+            raise ValueError('slice step cannot be zero')
+        self.parent = parent
+        self.start = start
+        self.stop = stop
+        self.step = step or 1
+    
+    def __getattr__(self, attr):
+        # Only called for attributes the view lacks; ``parent`` is always set
+        # in ``__init__``, so looking it up here can't recurse.
+        if attr == 'parent' or (attr.startswith('_') and
+            attr not in self.PARENT_ATTRS):
+            raise AttributeError(attr)
+        return getattr(self.parent, attr)
+    
+    def _with_connection_broker(self, connection_broker):
+        return type(self)(
+            self.parent._with_connection_broker(connection_broker),
+            self.start, self.stop, self.step)
     
-    def __init__(self, object, *args, **kwargs):
-        super(CachedListUpdateMonitorThread, self).__init__(
-            *args, **kwargs)
-        self.object = object
-        self.kill_flag = False
+    def __repr__(self):
+        return '<%s of %r [%s:%s:%s]>' % (type(self).__name__, self.parent,
+            self.start, self.stop, self.step)
     
-    def run(self):
-        while not self.kill_flag:
-            self.object._update_cache()
-            time.sleep(self.object.UPDATE_INTERVAL)
-        self.kill_flag = False
+    # Special methods are looked up on the type, so ``__getattr__`` doesn't
+    # forward them; a view describes itself as its parent does.
+    def __str__(self):
+        return str(self.parent)
+    
+    def __unicode__(self):
+        return unicode(self.parent)
+    
+    def _bounds(self):
+        """Return the view's current ``(start, stop, step)`` in the parent."""
+        length, offset = len(self.parent._cache), self.parent._offset
+        start, stop, step = self.start, self.stop, self.step
+        if step > 0:
+            # Skip (in steps) past any items which have been evicted.
+            start = 0 if start is None else start - offset
+            if start < 0:
+                start %= step
+            stop = length if stop is None else min(stop - offset, length)
+        else:
+            start = (length - 1 if start is None else
+                min(start - offset, length - 1))
+            stop = -1 if stop is None else max(stop - offset, -1)
+        return start, stop, step
+    
+    def _range(self):
+        """Return the parent positions currently in the view."""
+        return xrange(*self._bounds())
+    
+    def __len__(self):
+        return len(self._range())
+    
+    def __getitem__(self, pos_or_slice):
+        parent = self.parent
+        if isinstance(pos_or_slice, (int, long)):
+            parent._lock.acquire()
+            try:
+                return parent._cache_to_obj(
+                    parent._cache[self._range()[pos_or_slice]])
+            finally:
+                parent._lock.release()
+        bounds = self._bounds()
+        first, offset = bounds[0], parent._offset
+        start, stop, step = pos_or_slice.indices(len(xrange(*bounds)))
+        if pos_or_slice.stop is None and self.stop is None and (
+            step > 0 and self.step > 0):
+            # Open-ended on open-ended: the new view grows with the parent
+            # (and may start beyond its current end).
+            if pos_or_slice.start is not None and pos_or_slice.start >= 0:
+                start = pos_or_slice.start
+            return type(self)(parent, offset + first + start * self.step,
+                None, step * self.step)
+        if not len(xrange(start, stop, step)):
+            return type(self)(parent, 0, 0)
+        stop = first + stop * self.step
+        return type(self)(parent, offset + first + start * self.step,
+            offset + stop if stop >= 0 else None, step * self.step)
+    
+    def __iter__(self):
+        parent = self.parent
+        parent._load_from_storage()
+        # Walk absolute positions, so evictions mid-iteration don't shift us.
+        start, stop, step = self._bounds()
+        offset = parent._offset
+        for position in xrange(start + offset, stop + offset, step):
+            parent._lock.acquire()
+            try:
+                index = position - parent._offset
+                if index < 0:
+                    if step < 0:
+                        break
+                    continue
+                if index >= len(parent._cache):
+                    if step > 0:
+                        break
+                    continue
+                item = parent._cache[index]
+            finally:
+                parent._lock.release()
+            yield parent._cache_to_obj(item)
+    
+    def __contains__(self, obj):
+        try:
+            self.index(obj)
+        except ValueError:
+            return False
+        return True
+    
+    def index(self, obj):
+        """Return the position of an object in the view."""
+        position, positions = self.parent.index(obj), self._range()
+        if positions:
+            offset, remainder = divmod(position - positions[0], self.step)
+            if not remainder and 0 <= offset < len(positions):
+                return offset
+        raise ValueError('%r is not in view' % (obj,))
+    
+    @property
+    def _objects(self):
+        return list(self)
+    
+    def copy(self):
+        """Return a new list of the parent's class, holding just these items."""
+        return self.parent._copy(self._range())
+    
+    def prefetch(self):
+        """Hydrate every object in the view at once (see ``CachedList``)."""
+        objects = self._objects
+        if hasattr(self.parent.OBJ_CLASS, 'prefetch'):
+            self.parent.OBJ_CLASS.prefetch(objects,
+                connection_broker=self.parent._connection_broker)
+        return objects
+
+
+class Subscription(object):
+    
+    """
+    A feed of the items newly merged into a ``ForwardCachedList``.
+    
+    Get one from ``ForwardCachedList.subscribe()``. Every item the list merges
+    in from then on (after any already cached beyond ``since_id``) is queued
+    for the subscription, in the order it was merged, so consumers can handle
+    just the new items after each update rather than rescanning the list.
+    
+    Without a callback, take items off the queue by iterating (which blocks
+    until the next item arrives, and ends once the subscription is closed),
+    with ``next(timeout)``, with ``poll()`` (everything queued, without
+    waiting), or with ``next_async()``, which returns an ``eventloop.Future``.
+    With a callback, it is called with a list of the new objects after each
+    merge, in the thread which merged them, and nothing is queued.
+    ``since_id`` always holds the ID of the last item handed over, so a
+    consumer can resubscribe where it left off. ``close()`` a subscription
+    which is no longer wanted, or its queue goes on growing.
+    """
+    
+    def __init__(self, parent, callback=None, since_id=None):
+        self.parent = parent
+        self.callback = callback
+        self.since_id = since_id
+        self.closed = False
+        self._items = collections.deque()
+        self._futures = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+    
+    def __repr__(self):
+        return '<%s of %r since %r>' % (type(self).__name__, self.parent,
+            self.since_id)
+    
+    def __iter__(self):
+        return self
+    
+    def _push(self, obj):
+        # Called with the parent's lock held, so this only queues the object.
+        self._condition.acquire()
+        try:
+            self._items.append(obj)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+    
+    def _flush(self):
+        """Hand queued objects to the callback or to waiting futures."""
+        if self.callback is not None:
+            objects = self.poll()
+            if objects:
+                try:
+                    self.callback(objects)
+                except Exception, exc:
+                    # A broken callback mustn't break updates.
+                    log.getLogger('twactor.cache.subscription').exception(
+                        'Error in subscription callback %r' % (self.callback,))
+            return
+        ready = []
+        self._condition.acquire()
+        try:
+            while self._items and self._futures:
+                ready.append((self._futures.popleft(), self._take()))
+        finally:
+            self._condition.release()
+        for future, obj in ready:
+            future.set_result(obj)
+    
+    def _take(self):
+        obj = self._items.popleft()
+        self.since_id = getattr(obj, '_cache', obj).get('id', self.since_id)
+        return obj
+    
+    def next(self, timeout=None):
+        """
+        Return the next new object, waiting for it if need be.
+        
+        Raises ``Queue.Empty`` if nothing arrives within ``timeout`` seconds,
+        and ``StopIteration`` once the subscription is closed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self._condition.acquire()
+        try:
+            while not self._items and not self.closed:
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self._condition.wait(remaining)
+            if self._items:
+                return self._take()
+            raise StopIteration
+        finally:
+            self._condition.release()
+    
+    def poll(self):
+        """Return (and take) every object queued so far, without waiting."""
+        self._condition.acquire()
+        try:
+            return [self._take() for i in xrange(len(self._items))]
+        finally:
+            self._condition.release()
+    
+    def next_async(self):
+        """
+        Return an ``eventloop.Future`` for the next new object.
+        
+        The future fires in the thread which merges the object (the event
+        loop's, for a list kept up-to-date with ``monitor_async()``), or
+        straight away if one is already queued. Once the subscription is
+        closed, futures fail with ``StopIteration``.
+        """
+        future = eventloop.Future()
+        self._condition.acquire()
+        try:
+            if self._items:
+                obj = self._take()
+            elif self.closed:
+                obj = None
+            else:
+                self._futures.append(future)
+                return future
+        finally:
+            self._condition.release()
+        if obj is None:
+            future.set_exception(StopIteration())
+        else:
+            future.set_result(obj)
+        return future
+    
+    def close(self):
+        """Stop receiving items, and wake anything waiting for them."""
+        self.parent._unsubscribe(self)
+        self._condition.acquire()
+        try:
+            self.closed = True
+            self._condition.notifyAll()
+            futures, self._futures = self._futures, collections.deque()
+        finally:
+            self._condition.release()
+        for future in futures:
+            future.set_exception(StopIteration())
+
+
+class WorkerPool(object):
+    
+    """A fixed-size pool of daemon threads which run queued calls."""
+    
+    def __init__(self, size=4, name='twactor.worker'):
+        self.size = size
+        self.name = name
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+    
+    def submit(self, function, *args, **kwargs):
+        if len(self._threads) < self.size:
+            self._start_threads()
+        self._queue.put((function, args, kwargs))
+    
+    def map(self, function, items):
+        """
+        Call ``function`` on each item in the pool, and return the results.
+        
+        This blocks until every call has finished, and returns the results in
+        the same order as ``items``. If any call raised an exception, the first
+        one is re-raised. Don't call this from one of the pool's own threads.
+        """
+        items = list(items)
+        results, errors = [None] * len(items), []
+        remaining = [len(items)]
+        lock, done = threading.Lock(), threading.Event()
+        def run(index, item):
+            try:
+                results[index] = function(item)
+            except Exception, exc:
+                errors.append(exc)
+            lock.acquire()
+            try:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    done.set()
+            finally:
+                lock.release()
+        if not items:
+            return results
+        for index, item in enumerate(items):
+            self.submit(run, index, item)
+        done.wait()
+        if errors:
+            raise errors[0]
+        return results
+    
+    def _start_threads(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.size:
+                thread = threading.Thread(target=self._work,
+                    name='%s-%d' % (self.name, len(self._threads)))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+    
+    def _work(self):
+        logger = log.getLogger(self.name)
+        while True:
+            function, args, kwargs = self._queue.get()
+            try:
+                function(*args, **kwargs)
+            except Exception, exc:
+                logger.error('Error in background call to %r: %s' % (
+                    function, exc))
+
+
+class ScheduleEntry(object):
+    
+    def __init__(self, ref, interval):
+        self.ref = ref
+        self.interval = interval
+        self.cancelled = False
+
+
+class RefreshScheduler(object):
+    
+    """
+    Drive the periodic updates of many cached lists from a single thread.
+    
+    Registered lists sit in a priority queue ordered by when their next update
+    is due. One dispatcher thread pops due lists and hands their
+    ``_update_cache`` calls to a bounded ``WorkerPool``; a list's next update is
+    only scheduled once its current one has finished, so updates of a single
+    list never overlap. Each interval is stretched or shrunk at random by up to
+    ``jitter`` (a fraction) so that lists registered together don't all poll
+    together. The scheduler only keeps weak references, so lists which are
+    garbage collected simply drop out of the queue.
+    """
+    
+    def __init__(self, workers=4, jitter=0.1):
+        self.jitter = jitter
+        self.pool = WorkerPool(workers, name='twactor.scheduler')
+        self._heap = []
+        self._entries = {}
+        self._pending = set()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def register(self, obj, interval=None, delay=0):
+        """
+        Start updating ``obj`` periodically.
+        
+        ``interval`` defaults to the object's ``UPDATE_INTERVAL`` (read afresh
+        each time). The first update happens after ``delay`` seconds.
+        """
+        self.unregister(obj)
+        key = id(obj)
+        entry = ScheduleEntry(weakref.ref(obj,
+            lambda ref: self._forget(key)), interval)
+        self._condition.acquire()
+        try:
+            self._entries[key] = entry
+            self._push(entry, time.time() + delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch,
+                    name='twactor.scheduler')
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._condition.release()
+    
+    def unregister(self, obj):
+        self._forget(id(obj))
+    
+    def refresh_soon(self, obj):
+        """
+        Queue a one-off background update of ``obj``.
+        
+        The update runs on the scheduler's workers at background priority.
+        Returns ``False`` (and queues nothing) if one is already queued.
+        """
+        self._condition.acquire()
+        try:
+            if id(obj) in self._pending:
+                return False
+            self._pending.add(id(obj))
+        finally:
+            self._condition.release()
+        self.pool.submit(self._refresh_once, obj)
+        return True
+    
+    def _refresh_once(self, obj):
+        priority = governor.set_priority(governor.PRIORITY_BACKGROUND)
+        try:
+            obj._update_cache()
+            obj._updated['__time'] = time.time()
+        finally:
+            governor.set_priority(priority)
+            self._condition.acquire()
+            try:
+                self._pending.discard(id(obj))
+            finally:
+                self._condition.release()
+    
+    def is_registered(self, obj):
+        entry = self._entries.get(id(obj), None)
+        return entry is not None and entry.ref() is obj
+    
+    def _forget(self, key):
+        self._condition.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                entry.cancelled = True
+                # Let the dispatcher drop it, rather than wait until it's due.
+                self._condition.notify()
+        finally:
+            self._condition.release()
+    
+    def _push(self, entry, due):
+        # Must be called with the condition held.
+        heapq.heappush(self._heap, (due, self._sequence.next(), entry))
+        self._condition.notify()
+    
+    def _dispatch(self):
+        while True:
+            self._condition.acquire()
+            try:
+                while True:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    wait = self._heap[0][0] - time.time()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                entry = heapq.heappop(self._heap)[2]
+            finally:
+                self._condition.release()
+            self.pool.submit(self._refresh, entry)
+    
+    def _refresh(self, entry):
+        obj = entry.ref()
+        if obj is None or entry.cancelled:
+            return
+        priority = governor.set_priority(governor.PRIORITY_BACKGROUND)
+        try:
+            obj._update_cache()
+        finally:
+            governor.set_priority(priority)
+            interval = entry.interval or obj.UPDATE_INTERVAL
+            interval *= 1 + random.uniform(-self.jitter, self.jitter)
+            del obj
+            self._condition.acquire()
+            try:
+                if not entry.cancelled:
+                    self._push(entry, time.time() + interval)
+            finally:
+                self._condition.release()
+
+
+global SCHEDULER
+
+SCHEDULER = RefreshScheduler()
+
+
+class CachedListUpdateMonitor(object):
+    
+    """
+    Start or stop the periodic updating of a cached list.
+    
+    This is a lightweight handle onto ``SCHEDULER``; it does not own a thread.
+    """
+    
+    def __init__(self, object, scheduler=None):
+        self._object = weakref.ref(object)
+        self.scheduler = scheduler or SCHEDULER
+    
+    def start(self, interval=None):
+        self.scheduler.register(self._object(), interval=interval)
     
     def stop(self):
-        self.kill_flag = True
+        obj = self._object()
+        if obj is not None:
+            self.scheduler.unregister(obj)
+    
+    def is_alive(self):
+        obj = self._object()
+        return obj is not None and self.scheduler.is_registered(obj)
 
 
 class ForwardCachedList(CachedList):
-        
+    
     def _insert_into_cache(self, fetched_data):
-        if not fetched_data:
-            self._updated['__count'] = self._updated.get('__count', 0) + 1
-            self._updated['__time'] = time.time()
-            return
-        fetched_objects = zip(fetched_data,
-            map(self._cache_to_obj, fetched_data))
-        sorted_objects = sorted(fetched_objects,
-            key=lambda pair: self._sort_key(pair[1]))
-        timestamp = time.time()
-        if not self._cache:
-            for data, object in sorted_objects:
-                count_key = '%s__count' % (getattr(object, 'id', repr(object)),)
-                time_key = '%s__time' % (getattr(object, 'id', repr(object)),)
-                self._updated[count_key] = self._updated.get(count_key, 0) + 1
-                self._updated[time_key] = timestamp
-            self._cache.extend(pair[0] for pair in sorted_objects)
-        else:
-            latest_key = self._sort_key(self._cache_to_obj(self._cache[-1]))
-            add_to_cache = self._sort_key(sorted_objects[0][1]) > latest_key
-            for data, object in sorted_objects:
-                count_key = '%s__count' % (getattr(object, 'id', repr(object)),)
-                time_key = '%s__time' % (getattr(object, 'id', repr(object)),)
-                self._updated[count_key] = self._updated.get(count_key, 0) + 1
-                self._updated[time_key] = timestamp
-                if add_to_cache or (self._sort_key(object) > latest_key):
-                    self._cache.append(data)
-                if self._sort_key(object) >= latest_key:
-                    add_to_cache = True
-        self._updated['__count'] = self._updated.get('__count', 0) + 1
-        self._updated['__time'] = time.time()
-        self._clean_object_cache()
+        self._merge_into_cache(fetched_data)
+    
+    def subscribe(self, callback=None, since_id=None):
+        """
+        Return a ``Subscription`` to the items this list merges from now on.
+        
+        With ``since_id``, any cached items with a greater ID are queued
+        first (newest items are at the end of a forward list, so finding them
+        costs only as many steps as there are). With ``callback``, it is
+        called with each batch of new objects instead of queueing them.
+        """
+        self._load_from_storage()
+        subscription = Subscription(self, callback, since_id)
+        self._lock.acquire()
+        try:
+            if since_id is not None:
+                position = len(self._cache)
+                while (position and
+                    self._cache[position - 1].get('id', None) > since_id):
+                    position -= 1
+                for item in self._cache[position:]:
+                    subscription._push(self._cache_to_obj(item))
+            self._subscriptions.append(subscription)
+        finally:
+            self._lock.release()
+        subscription._flush()
+        return subscription
 
 
 class ReverseCachedList(CachedList):
     
+    _descending = True
+    
     def _insert_into_cache(self, fetched_data):
-        if not fetched_data:
-            self._updated['__count'] = self._updated.get('__count', 0) + 1
-            self._updated['__time'] = time.time()
-            return
-        fetched_objects = zip(fetched_data,
-            map(self._cache_to_obj, fetched_data))
-        sorted_objects = sorted(fetched_objects, reverse=True,
-            key=lambda pair: self._sort_key(pair[1]))
-        timestamp = time.time()
-        if not self._cache:
-            for data, object in sorted_objects:
-                count_key = '%s__count' % (getattr(object, 'id', repr(object)),)
-                time_key = '%s__time' % (getattr(object, 'id', repr(object)),)
-                self._updated[count_key] = self._updated.get(count_key, 0) + 1
-                self._updated[time_key] = timestamp
-            self._cache.extend(pair[0] for pair in sorted_objects)
-        else:
-            latest_key = self._sort_key(self._cache_to_obj(self._cache[-1]))
-            add_to_cache = self._sort_key(sorted_objects[0][1]) < latest_key
-            for data, object in sorted_objects:
-                count_key = '%s__count' % (getattr(object, 'id', repr(object)),)
-                time_key = '%s__time' % (getattr(object, 'id', repr(object)),)
-                self._updated[count_key] = self._updated.get(count_key, 0) + 1
-                self._updated[time_key] = timestamp
-                if add_to_cache or (self._sort_key(object) < latest_key):
-                    self._cache.append(data)
-                if self._sort_key(object) <= latest_key:
-                    add_to_cache = True
-        self._updated['__count'] = self._updated.get('__count', 0) + 1
-        self._updated['__time'] = time.time()
-        self._clean_object_cache()
+        self._merge_into_cache(fetched_data)
+
+
+def fetch_async(obj, connection_broker=None):
+    """
+    Fetch a cached object's ``_update_request()`` asynchronously.
+    
+    Returns an ``eventloop.Future`` for the decoded response, which fires with
+    ``None`` straight away if the object has nothing to request.
+    """
+    connection_broker = connection_broker or obj._async_connection_broker
+    request = obj._update_request()
+    if request is None:
+        return eventloop.succeed(None)
+    path, params = request
+    return connection_broker.get(path, params=params)
+
+
+_async_refreshes = {}
+_async_refreshes_lock = threading.Lock()
+
+def refresh_async(obj):
+    """
+    Start an asynchronous update of ``obj``, unless one is already running.
+    
+    Returns an ``eventloop.Future`` for the update in progress: a new one, or
+    the one already pending, so any number of callers share a single request.
+    """
+    _async_refreshes_lock.acquire()
+    try:
+        future = _async_refreshes.get(id(obj))
+        if future is not None:
+            return future
+        future = _async_refreshes[id(obj)] = eventloop.Future()
+    finally:
+        _async_refreshes_lock.release()
+    def finished(update):
+        _async_refreshes_lock.acquire()
+        try:
+            _async_refreshes.pop(id(obj), None)
+        finally:
+            _async_refreshes_lock.release()
+        future._copy_from(update)
+    try:
+        update = obj._update_cache_async()
+    except Exception, exc:
+        update = eventloop.Future()
+        update.set_exception(exc)
+    update.add_done_callback(finished)
+    return future
+
+
+def shared_update(obj, update):
+    """
+    Call ``update()`` to update ``obj``, unless another process just did.
+    
+    This only applies when ``obj._storage`` is shared between processes;
+    otherwise ``update()`` is simply called. If another process saved a newer
+    copy of the object (or list) less than ``max_age`` seconds ago, that copy
+    is taken instead of fetching. Otherwise the storage's lease on the record
+    is taken first, so that only one process fetches it at a time; a process
+    which can't get the lease waits for the holder to publish its result, and
+    only fetches the record itself if that takes longer than ``lease_ttl``.
+    """
+    storage = obj._storage
+    key = storage is not None and storage.shared and obj._lease_key()
+    if not key:
+        return update()
+    kind = type(obj).__name__
+    if obj._adopt_stored(storage.max_age):
+        return None
+    deadline = time.time() + storage.lease_ttl
+    while not storage.acquire_lease(kind, key):
+        if time.time() >= deadline:
+            break
+        time.sleep(storage.poll_interval)
+        if obj._adopt_stored(storage.max_age):
+            return None
+    try:
+        return update()
+    finally:
+        storage.release_lease(kind, key)
+
+
+def _record(obj, decorator, outcome):
+    metrics.METRICS.record_cache(type(obj).__name__, decorator, outcome)
+
+def _fetch_outcome(obj):
+    # A fetch either fills an empty cache, or refreshes one.
+    return obj._updated.get('__count', 0) and 'refresh' or 'miss'
+
 
 def update_once(method):
     """
@@ -342,9 +1868,13 @@ def update_once(method):
     is especially useful when fetching data over the network.
     """
     def wrapper(self, *args, **kwargs):
+        self._load_from_storage()
         if not self._updated.get('__count', 0):
+            _record(self, 'update_once', 'miss')
             self._update_cache()
             self._updated['__count'] = self._updated.get('__count', 0) + 1
+        else:
+            _record(self, 'update_once', 'hit')
         return method(self, *args, **kwargs)
     return function_sync(method, wrapper)
 
@@ -366,19 +1896,20 @@ def update_on_key(key, always=False):
     """
     def wrapper_deco(method):
         def wrapper(self, *args, **kwargs):
-            if always:
-                if key not in self._cache:
-                    self._update_cache()
-                return method(self, *args, **kwargs)
-            elif (key not in self._cache and
-                (not self._updated.get('key__' + key, False))):
+            self._load_from_storage()
+            if key in self._cache or (not always and
+                self._updated.get('key__' + key, False)):
+                _record(self, 'update_on_key', 'hit')
+            else:
+                _record(self, 'update_on_key', 'miss')
                 self._update_cache()
-                self._updated['key__' + key] = True
+                if not always:
+                    self._updated['key__' + key] = True
             return method(self, *args, **kwargs)
         return function_sync(method, wrapper)
     return wrapper_deco
 
-def update_on_time(length):
+def update_on_time(length, max_age=None):
     """
     Update the cache if an amount of time has passed before calling a method.
 
@@ -387,10 +1918,25 @@ def update_on_time(length):
     check to see that a certain amount of time has passed. If the time that has
     passed is greater than or equal to the specified length, the cache is
     updated. Finally, the method is called.
+
+    You may also pass ``max_age``, a longer length of time, to serve stale data
+    while revalidating. Cached data which is older than ``length`` but not
+    older than ``max_age`` is returned straight away, and an update is queued
+    on ``SCHEDULER``'s workers in the background; the caller only waits for an
+    update if the cache has never been updated, or is older than ``max_age``.
     """
     def wrapper_deco(method):
         def wrapper(self, *args, **kwargs):
-            if (time.time() - self._updated.get('__time', 0)) >= length:
+            self._load_from_storage()
+            age = time.time() - self._updated.get('__time', 0)
+            if age < length:
+                _record(self, 'update_on_time', 'hit')
+            elif (max_age is not None and age < max_age and
+                self._updated.get('__count', 0)):
+                _record(self, 'update_on_time', 'stale')
+                SCHEDULER.refresh_soon(self)
+            else:
+                _record(self, 'update_on_time', _fetch_outcome(self))
                 self._update_cache()
                 self._updated['__time'] = time.time()
             return method(self, *args, **kwargs)
@@ -408,17 +1954,107 @@ def update_on_count(num):
     """
     def wrapper_deco(method):
         def wrapper(self, *args, **kwargs):
-            if self._updated.get('count__' + method.__name__, num) == num:
+            self._load_from_storage()
+            count_key = 'count__' + method.__name__
+            if self._updated.get(count_key, num) == num:
+                _record(self, 'update_on_count', _fetch_outcome(self))
                 self._update_cache()
-                self._updated['count__' + method.__name__] = 1
+                self._updated[count_key] = 1
             else:
-                self._updated['count__' + method] = self._updated.get(
-                    'count__' + method, 0) + 1
+                _record(self, 'update_on_count', 'hit')
+                self._updated[count_key] = self._updated.get(count_key, 0) + 1
             return method(self, *args, **kwargs)
         return function_sync(method, wrapper)
     return wrapper_deco
 
 
+def _update_then_call_async(self, needs_update, method, args, kwargs):
+    if needs_update:
+        future = refresh_async(self)
+    else:
+        future = eventloop.succeed(self)
+    return future.then(lambda obj: method(self, *args, **kwargs))
+
+
+def update_once_async(method):
+    """
+    Asynchronous counterpart of ``update_once``.
+    
+    The wrapped method returns an ``eventloop.Future`` which fires with the
+    method's return value, once the cache has been updated if necessary.
+    """
+    def wrapper(self, *args, **kwargs):
+        self._load_from_storage()
+        needs_update = not self._updated.get('__count', 0)
+        _record(self, 'update_once_async', needs_update and 'miss' or 'hit')
+        return _update_then_call_async(self, needs_update, method, args,
+            kwargs)
+    return function_sync(method, wrapper)
+
+
+def update_on_key_async(key, always=False):
+    """Asynchronous counterpart of ``update_on_key``."""
+    def wrapper_deco(method):
+        def wrapper(self, *args, **kwargs):
+            self._load_from_storage()
+            needs_update = key not in self._cache and (always or
+                not self._updated.get('key__' + key, False))
+            _record(self, 'update_on_key_async',
+                needs_update and 'miss' or 'hit')
+            if needs_update and not always:
+                self._updated['key__' + key] = True
+            return _update_then_call_async(self, needs_update, method, args,
+                kwargs)
+        return function_sync(method, wrapper)
+    return wrapper_deco
+
+
+def update_on_time_async(length, max_age=None):
+    """
+    Asynchronous counterpart of ``update_on_time``.
+    
+    With ``max_age``, stale data is returned at once while an asynchronous
+    update runs in the background, as with ``update_on_time``.
+    """
+    def wrapper_deco(method):
+        def wrapper(self, *args, **kwargs):
+            self._load_from_storage()
+            age = time.time() - self._updated.get('__time', 0)
+            if (age >= length and max_age is not None and age < max_age and
+                self._updated.get('__count', 0)):
+                _record(self, 'update_on_time_async', 'stale')
+                refresh_async(self)
+                return _update_then_call_async(self, False, method, args,
+                    kwargs)
+            _record(self, 'update_on_time_async',
+                age >= length and _fetch_outcome(self) or 'hit')
+            return _update_then_call_async(self, age >= length, method, args,
+                kwargs)
+        return function_sync(method, wrapper)
+    return wrapper_deco
+
+
+def derived(method):
+    """
+    Compute a value from the cache once per cache refresh.
+    
+    This decorator wraps a method which takes no arguments (typically a
+    property getter that parses something out of ``_cache``). The result is
+    kept in the object's derived-value cache, and recomputed only after the
+    cache has been updated or replaced. Put it *below* any ``update_on_*``
+    decorators, so that the update happens before the cached value is checked.
+    """
+    name = method.__name__
+    def wrapper(self):
+        derived_cache = self._derived_cache()
+        try:
+            return derived_cache[name]
+        except KeyError:
+            value = derived_cache[name] = method(self)
+            return value
+    return function_sync(method, wrapper)
+
+
 def simple_map(key):
     """
     Shortcut for a typical cacheing use-case.
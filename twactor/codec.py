@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# twactor.codec - Pluggable JSON codecs, and lazily-decoded records.
+
+import re
+import sys
+import UserDict
+
+from twactor import json
+
+
+class Codec(object):
+    
+    """
+    Decode (and encode) JSON with a pair of functions.
+    
+    ``loads`` should accept a byte string and return the decoded document;
+    ``dumps`` does the reverse. Any JSON library with that interface (or a
+    thin wrapper around one) can be plugged in as a codec.
+    """
+    
+    def __init__(self, loads, dumps=json.dumps, name=None):
+        self._loads = loads
+        self.dumps = dumps
+        self.name = name or getattr(loads, '__module__', None)
+    
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.name)
+    
+    def loads(self, text, encoding='utf-8'):
+        if isinstance(text, str) and encoding.lower() not in ('utf-8', 'utf8'):
+            text = text.decode(encoding)
+        return self._loads(text)
+    
+    def load(self, fp, encoding='utf-8'):
+        return self.loads(fp.read(), encoding)
+
+
+# Tokens which matter when splitting up a JSON document: whole strings, and
+# structural characters outside strings.
+STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+TOKEN_RE = re.compile(STRING + r'|[{}\[\],:]')
+
+# Inside a nested value, only brackets matter; this skips straight to the next
+# one (past any strings) in a single match.
+BRACKET_RE = re.compile(r'[^"{}\[\]]*(?:%s[^"{}\[\]]*)*([{}\[\]])' % (STRING,))
+
+LEADING_RE = re.compile(r'\s*(.)\s*(.?)')
+
+
+class LazyRecord(UserDict.DictMixin, object):
+    
+    """
+    A JSON object whose members are only decoded when they are read.
+    
+    The record holds the raw JSON text of each member, and decodes (and keeps)
+    a member's value the first time it is looked up, so nested objects such as
+    a tweet's ``user`` cost nothing until something reads them. Records behave
+    like dictionaries; ``copy()`` returns a plain, fully-decoded ``dict``.
+    """
+    
+    def __init__(self, members=None, decode=json.loads):
+        self._raw = members or {}
+        self._values = {}
+        self._decode = decode
+    
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raw = self._raw.get(key, _MISSING)
+            if raw is _MISSING:
+                # Another thread may have decoded it in the meantime.
+                return self._values[key]
+            value = self._values.setdefault(key, self._decode(raw))
+            self._raw.pop(key, None)
+            return value
+    
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._raw.pop(key, None)
+    
+    def __delitem__(self, key):
+        found = self._values.pop(key, _MISSING) is not _MISSING
+        if self._raw.pop(key, _MISSING) is _MISSING and not found:
+            raise KeyError(key)
+    
+    def __contains__(self, key):
+        return key in self._values or key in self._raw
+    
+    has_key = __contains__
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def keys(self):
+        return self._values.keys() + [key for key in self._raw.keys()
+            if key not in self._values]
+    
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+    
+    def update(self, other=None, **kwargs):
+        if isinstance(other, LazyRecord) and other._decode is self._decode:
+            # Take the other record's undecoded members as they are.
+            for key, raw in other._raw.items():
+                self._raw[key] = raw
+                self._values.pop(key, None)
+            other = other._values
+        UserDict.DictMixin.update(self, other or {}, **kwargs)
+    
+    def copy(self):
+        return dict(self.iteritems())
+    
+    def __sizeof__(self):
+        # Count the raw text and decoded values held, not just the record.
+        return (object.__sizeof__(self) + sys.getsizeof(self._raw) +
+            sys.getsizeof(self._values) +
+            sum(map(sys.getsizeof, self._raw.values())) +
+            sum(map(sys.getsizeof, self._values.values())))
+    
+    def is_decoded(self, key):
+        """Whether a member's value has been decoded yet."""
+        return key in self._values
+
+
+_MISSING = object()
+
+
+def lazy_loads(text, decode=json.loads):
+    """
+    Split a JSON document into ``LazyRecord``s without decoding their values.
+    
+    An object becomes a single record, and an array of objects a list of them.
+    Only the top-level members of each record are found (with one regular
+    expression scan over the text); their values are left as raw JSON. Any
+    other document is decoded straight away with ``decode``.
+    """
+    match = LEADING_RE.match(text)
+    if not match:
+        return decode(text)
+    if match.group(1) == '{':
+        record_depth = 1
+    elif match.group(1) == '[' and match.group(2) in ('{', ']'):
+        record_depth = 2
+    else:
+        return decode(text)
+    records, members, key, start, depth = [], None, None, None, 0
+    names, position = {}, match.start(1)
+    while True:
+        if depth > record_depth:
+            token = BRACKET_RE.match(text, position)
+            if token is None:
+                break
+            char = token.group(1)
+        else:
+            token = TOKEN_RE.search(text, position)
+            if token is None:
+                break
+            char = token.group()[0]
+        position = token.end()
+        if char == '"':
+            if key is None and depth == record_depth:
+                name = token.group()
+                key = names.get(name)
+                if key is None:
+                    key = names[name] = decode(name)
+        elif char in '{[':
+            depth += 1
+            if depth == record_depth:
+                members = {}
+        elif char in '}]':
+            if depth == record_depth:
+                if key is not None:
+                    members[key] = text[start:token.start()]
+                records.append(LazyRecord(members, decode))
+                key = None
+            depth -= 1
+            if not depth:
+                break
+        elif depth == record_depth:
+            if char == ':':
+                start = position
+            else:
+                members[key] = text[start:token.start()]
+                key = None
+    if depth:
+        raise ValueError('Unterminated JSON document')
+    if record_depth == 1:
+        return records[0]
+    return records
+
+
+class LazyCodec(Codec):
+    
+    """
+    A codec which decodes objects into ``LazyRecord``s.
+    
+    Values are decoded on demand by ``base`` (the default codec, unless
+    another is given). This saves decoding (and holding) nested objects which
+    are never read, at the cost of a scan over each document.
+    """
+    
+    def __init__(self, base=None):
+        self.base = base or JSON
+        super(LazyCodec, self).__init__(self._lazy_loads, self.base.dumps,
+            name='lazy:%s' % (self.base.name,))
+    
+    def _lazy_loads(self, text):
+        return lazy_loads(text, self.base._loads)
+
+
+JSON = Codec(json.loads, json.dumps, name=json.__name__)
+
+CODECS = {'json': JSON}
+
+# Faster decoders, where they are installed.
+try:
+    import ujson
+except ImportError:
+    pass
+else:
+    CODECS['ujson'] = Codec(ujson.loads, ujson.dumps, name='ujson')
+try:
+    import cjson
+except ImportError:
+    pass
+else:
+    CODECS['cjson'] = Codec(cjson.decode, cjson.encode, name='cjson')
+
+
+def get(name):
+    """
+    Return a codec by name.
+    
+    Names are ``'json'`` and any faster libraries which are installed
+    (``'ujson'``, ``'cjson'``); prefix a name with ``'lazy:'`` (or just use
+    ``'lazy'``) for a ``LazyCodec`` on top of it.
+    """
+    if name == 'lazy':
+        return LazyCodec()
+    elif name.startswith('lazy:'):
+        return LazyCodec(get(name[5:]))
+    return CODECS[name]
+
+
+global DEFAULT
+
+DEFAULT = JSON
+
+def configure(codec):
+    """Make ``codec`` (a ``Codec``, or the name of one) the default codec."""
+    global DEFAULT
+    if isinstance(codec, basestring):
+        codec = get(codec)
+    DEFAULT = codec
+    return codec
\ No newline at end of file
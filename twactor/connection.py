@@ -1,13 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import base64
 import httplib
 import re
+import socket
+import time
 import types
 import urllib
 import urllib2
 import urlparse
+try:
+    import threading
+except:
+    import dummy_threading as threading
 
-from twactor import json, propertyfix
+from twactor import (codec, eventloop, exceptions, governor, json, log,
+    metrics, propertyfix)
 
 
 VALID_USERNAME_RE = re.compile(r'^[A-Za-z0-9_]+$')
@@ -15,6 +23,9 @@ VALID_PASSWORD_RE = re.compile(r'^.{6,}$')
 
 SSL_SUPPORTED = hasattr(httplib, 'HTTPS')
 
+# Returned by ``ConnectionBroker.get_conditional`` for a 304 response.
+NOT_MODIFIED = object()
+
 
 def xunique(items, reverse=False):
     def rest(items, i):
@@ -30,6 +41,73 @@ def xunique(items, reverse=False):
 def unique(*args, **kwargs):
     return list(xunique(*args, **kwargs))
 
+# Characters which matter when scanning JSON: outside strings, and inside.
+JSON_STRUCTURE_RE = re.compile(r'["\[\]{}]')
+JSON_STRING_RE = re.compile(r'["\\]')
+
+def iter_json_array(fp, decode=json.loads, chunk_size=16384):
+    """
+    Decode the elements of a JSON array incrementally from a file object.
+    
+    The array's elements (which must be objects or arrays, as API results are)
+    are yielded one at a time as soon as their closing bracket has been read,
+    without waiting for the rest of the document. Only the current element is
+    held in memory. A document which is not an array is decoded whole; if it
+    is not a list either, ``ValueError`` is raised.
+    """
+    buffer = fp.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        document = decode(buffer + fp.read())
+        if not isinstance(document, list):
+            raise ValueError('Expected a JSON array, got %r' % (document,))
+        for item in document:
+            yield item
+        return
+    position, depth, in_string, start = 0, 0, False, None
+    while True:
+        while True:
+            if in_string:
+                match = JSON_STRING_RE.search(buffer, position)
+                if not match:
+                    position = len(buffer)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(buffer):
+                        # The escaped character is in the next chunk.
+                        position = match.start()
+                        break
+                    position = match.end() + 1
+                    continue
+                in_string, position = False, match.end()
+                continue
+            match = JSON_STRUCTURE_RE.search(buffer, position)
+            if not match:
+                position = len(buffer)
+                break
+            char, position = match.group(), match.end()
+            if char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+                if depth == 2:
+                    start = match.start()
+            else:
+                depth -= 1
+                if depth == 1:
+                    yield decode(buffer[start:position])
+                    start = None
+                elif depth == 0:
+                    return
+        # Drop everything before the element currently being read.
+        cut = position if start is None else start
+        buffer, position = buffer[cut:], position - cut
+        if start is not None:
+            start = 0
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            raise ValueError('Unterminated JSON array')
+        buffer += chunk
+
 def parse_content_type(content_type):
     parts = content_type.split(';')
     content_type, params = parts[0], parts[1:]
@@ -38,6 +116,201 @@ def parse_content_type(content_type):
     return content_type, dict(params)
 
 
+class ConnectionPool(object):
+    
+    """A thread-safe pool of persistent HTTP/1.1 connections, keyed by host."""
+    
+    def __init__(self, max_per_host=4, idle_timeout=30,
+        retry_methods=('GET', 'HEAD')):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.retry_methods = retry_methods
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, http_class, host, timeout):
+        """Return a ``(connection, reused)`` pair for the given host."""
+        key = (http_class, host)
+        now = time.time()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, last_used = idle.pop()
+                if (now - last_used) < self.idle_timeout:
+                    self.reused += 1
+                    return connection, True
+                connection.close()
+            self.created += 1
+        finally:
+            self._lock.release()
+        return http_class(host, timeout=timeout), False
+    
+    def release(self, http_class, host, connection):
+        """Return a connection to the pool, or close it if the pool is full."""
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault((http_class, host), [])
+            if len(idle) < self.max_per_host:
+                idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+    
+    def clear(self):
+        """Close every idle connection held by the pool."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection, last_used in connections:
+                connection.close()
+    
+    def stats(self):
+        self._lock.acquire()
+        try:
+            idle = sum(map(len, self._idle.values()))
+        finally:
+            self._lock.release()
+        return {'created': self.created, 'reused': self.reused, 'idle': idle}
+    
+    def urlopen(self, http_class, request):
+        """
+        Perform a request over a pooled connection.
+        
+        This mirrors ``urllib2.AbstractHTTPHandler.do_open``, except that it
+        asks the server to keep the connection alive, and hands the connection
+        back to the pool once the response body has been read in full. A
+        failure on a reused connection (typically because the server closed it
+        while it was idle) is retried on a fresh connection, but only if the
+        request couldn't be sent or its method is one of ``retry_methods``:
+        once a POST has been written, the server may have acted on it.
+        """
+        host = request.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        headers = dict(request.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in request.headers.items()
+            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        
+        while True:
+            connection, reused = self.acquire(http_class, host,
+                request.timeout)
+            sent = False
+            try:
+                connection.request(request.get_method(),
+                    request.get_selector(), request.data, headers)
+                sent = True
+                response = connection.getresponse(buffering=True)
+            except (socket.error, httplib.HTTPException), exc:
+                connection.close()
+                if reused and (not sent or
+                    request.get_method() in self.retry_methods):
+                    continue
+                raise urllib2.URLError(exc)
+            break
+        
+        fp = socket._fileobject(PooledResponse(self, http_class, host,
+            connection, response), close=True)
+        resp = urllib2.addinfourl(fp, response.msg, request.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class PooledResponse(object):
+    
+    """Socket-like wrapper which returns a connection to its pool on close."""
+    
+    def __init__(self, pool, http_class, host, connection, response):
+        self._pool = pool
+        self._http_class = http_class
+        self._host = host
+        self._connection = connection
+        self._response = response
+    
+    def recv(self, amt=None):
+        if self._response is None:
+            return ''
+        return self._response.read(amt)
+    
+    def close(self):
+        if self._connection is None:
+            return
+        connection, response = self._connection, self._response
+        self._connection, self._response = None, None
+        if response.length == 0:
+            # Bodiless responses (e.g. 304s) are complete without a read.
+            response.read()
+        if response.isclosed() and not response.will_close:
+            self._pool.release(self._http_class, self._host, connection)
+        else:
+            response.close()
+            connection.close()
+
+
+class PooledHTTPHandler(urllib2.HTTPHandler):
+    
+    pool = None
+    
+    def http_open(self, request):
+        if self.pool is None or getattr(request, '_tunnel_host', None):
+            return urllib2.HTTPHandler.http_open(self, request)
+        return self.pool.urlopen(httplib.HTTPConnection, request)
+
+
+if SSL_SUPPORTED:
+    class PooledHTTPSHandler(urllib2.HTTPSHandler):
+        
+        pool = None
+        
+        def https_open(self, request):
+            if self.pool is None or getattr(request, '_tunnel_host', None):
+                return urllib2.HTTPSHandler.https_open(self, request)
+            return self.pool.urlopen(httplib.HTTPSConnection, request)
+
+
+class MeteredResponse(object):
+    
+    """
+    Wrap a response, counting the bytes read from it.
+    
+    The request's ``metrics.RequestEvent`` is finished (and handed to the
+    broker's ``after_request`` hooks) when the response is closed.
+    """
+    
+    def __init__(self, response, event, finish):
+        self._response = response
+        self._event = event
+        self._finish = finish
+    
+    def __getattr__(self, attr):
+        return getattr(self._response, attr)
+    
+    def read(self, *args):
+        data = self._response.read(*args)
+        self._event.bytes_received += len(data)
+        return data
+    
+    def readline(self, *args):
+        line = self._response.readline(*args)
+        self._event.bytes_received += len(line)
+        return line
+    
+    def close(self):
+        self._response.close()
+        if self._finish is not None:
+            finish, self._finish = self._finish, None
+            finish(self._event)
+
+
 class ConnectionBroker(object):
     
     HTTP_AUTH_REALM = 'Twitter API'
@@ -45,18 +318,43 @@ class ConnectionBroker(object):
     SECURE = SSL_SUPPORTED
     
     DEFAULT_HANDLERS = [urllib2.ProxyHandler, urllib2.UnknownHandler,
-        urllib2.HTTPHandler, urllib2.HTTPDefaultErrorHandler,
+        PooledHTTPHandler, urllib2.HTTPDefaultErrorHandler,
         urllib2.HTTPRedirectHandler, urllib2.FTPHandler, urllib2.FileHandler,
         urllib2.HTTPErrorProcessor]
     
     if SECURE:
-        DEFAULT_HANDLERS.append(urllib2.HTTPSHandler)
+        DEFAULT_HANDLERS.append(PooledHTTPSHandler)
+    
+    # Idle keep-alive connections held open per host, and how long (in seconds)
+    # an idle connection may sit in the pool before it is discarded.
+    POOL_MAX_PER_HOST = 4
+    POOL_IDLE_TIMEOUT = 30
+    
+    # Responses which are retried (with exponential backoff) by ``_open``, for
+    # requests which are safe to repeat. Twitter also sends a 400 when the rate
+    # limit has been exceeded; that is only retried if the rate-limit headers
+    # say so, since other 400s are simply bad requests.
+    RETRY_CODES = (502, 503)
+    RETRY_METHODS = ('GET', 'HEAD')
+    MAX_RETRIES = 3
     
     extra_handlers = []
     
+    # The ``codec.Codec`` responses are decoded with; ``None`` means whichever
+    # is the default (see ``codec.configure``).
+    codec = None
+    
     def __init__(self, username=None, password=None):
         self._username = username
         self._password = password
+        self._pool = ConnectionPool(max_per_host=self.POOL_MAX_PER_HOST,
+            idle_timeout=self.POOL_IDLE_TIMEOUT,
+            retry_methods=self.RETRY_METHODS)
+        self.governor = governor.RequestGovernor()
+        # Callables taking a ``metrics.RequestEvent``, called before each
+        # request attempt and once its response has been read (or has failed).
+        self.before_request = []
+        self.after_request = []
         self._update()
     
     @propertyfix
@@ -91,6 +389,15 @@ class ConnectionBroker(object):
     def handlers(self):
         return self._get_handlers()
     
+    @property
+    def connection_stats(self):
+        """Counters for new versus reused keep-alive connections."""
+        return self._pool.stats()
+    
+    def close(self):
+        """Close all idle pooled connections."""
+        self._pool.clear()
+    
     def _update(self):
         self._http_auth_handler = self._get_http_auth_handler()
         self._opener = self._get_opener()
@@ -118,6 +425,8 @@ class ConnectionBroker(object):
         handlers = self._get_handlers(*more_handlers)
         opener = urllib2.OpenerDirector()
         for handler in handlers:
+            if hasattr(handler, 'pool'):
+                handler.pool = self._pool
             opener.add_handler(handler)
         return opener
     
@@ -127,18 +436,138 @@ class ConnectionBroker(object):
         query = urllib.urlencode(params)
         return urlparse.urlunsplit((scheme, netloc, path, query, ''))
     
-    def get(self, path, params={}):
+    def _open(self, request, path, priority=None):
+        """
+        Open a request, subject to the rate-limiting governor.
+        
+        Waits for the governor's permission (in order of ``priority``, which
+        defaults to the current thread's), records the response's rate-limit
+        headers, and retries ``RETRY_CODES`` (and 400s from an exhausted rate
+        limit) up to ``MAX_RETRIES`` times with exponential backoff. Only
+        ``RETRY_METHODS`` are retried: a POST which failed after the server
+        acted on it must not be sent twice.
+        """
+        key = self.governor.key(self._username, path)
+        attempt = 0
+        while True:
+            self.governor.acquire(key, priority)
+            event = self._start_request(request.get_method(),
+                request.get_full_url(), path, attempt,
+                len(request.get_data() or ''))
+            try:
+                connection = self._opener.open(request)
+            except urllib2.HTTPError, exc:
+                event.headers_received(exc.code)
+                self._finish_request(event)
+                self.governor.record(key, exc.code, exc.info())
+                if (attempt < self.MAX_RETRIES and
+                    self._retryable(request, exc.code, exc.info())):
+                    exc.close()
+                    self.governor.backoff(key, attempt, exc.info())
+                    attempt += 1
+                    continue
+                raise
+            except Exception, exc:
+                self._finish_request(event, exc)
+                raise
+            event.headers_received(connection.code)
+            self.governor.record(key, connection.code, connection.info())
+            return MeteredResponse(connection, event, self._finish_request)
+    
+    def _retryable(self, request, code, headers):
+        if request.get_method() not in self.RETRY_METHODS:
+            return False
+        if code == 400:
+            return governor.limit_exhausted(headers)
+        return code in self.RETRY_CODES
+    
+    def _start_request(self, method, url, path, attempt=0, bytes_sent=0):
+        event = metrics.RequestEvent(method, url, path, attempt, bytes_sent)
+        self._call_hooks(self.before_request, event)
+        return event
+    
+    def _finish_request(self, event, error=None):
+        event.finish(error)
+        metrics.METRICS.record_request(event)
+        self._call_hooks(self.after_request, event)
+    
+    def _call_hooks(self, hooks, event):
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception, exc:
+                # A broken hook mustn't break requests.
+                log.getLogger('twactor.connection.hooks').exception(
+                    'Error in request hook %r' % (hook,))
+    
+    def _codec(self):
+        return self.codec or codec.DEFAULT
+    
+    def get(self, path, params={}, priority=None):
         request = Request(self._build_url(path, params), method='GET')
-        connection = self._opener.open(request)
+        connection = self._open(request, path, priority)
         try:
             if 'json' in connection.info().dict['content-type']:
-                return json.load(connection)
+                return self._codec().load(connection)
             else:
                 return connection.read()
         finally:
             connection.close()
     
-    def post(self, path, params={}, data={}, content_type=''):
+    def get_stream(self, path, params={}, priority=None):
+        """
+        Fetch a JSON array, yielding its elements as they are downloaded.
+        
+        This is a generator (so nothing is requested until it is iterated);
+        see ``iter_json_array``. The connection is closed (and returned to the
+        pool, if it was read to the end) when the generator finishes.
+        """
+        request = Request(self._build_url(path, params), method='GET')
+        connection = self._open(request, path, priority)
+        try:
+            content_type, params = parse_content_type(
+                connection.info().dict.get('content-type', ''))
+            if 'json' not in content_type:
+                raise ValueError('Expected JSON from %s, got %r' % (path,
+                    content_type))
+            for item in iter_json_array(connection, self._codec().loads):
+                yield item
+        finally:
+            connection.close()
+    
+    def get_conditional(self, path, params={}, etag=None, last_modified=None,
+        priority=None):
+        """
+        Perform a conditional GET, revalidating a previously-fetched resource.
+        
+        ``etag`` and ``last_modified`` should be the ``ETag`` and
+        ``Last-Modified`` headers from the previous response, if any. Returns a
+        ``(data, headers)`` pair, where ``data`` is ``NOT_MODIFIED`` if the
+        server answered with a 304 (in which case no body is decoded).
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        request = Request(self._build_url(path, params), headers=headers,
+            method='GET')
+        try:
+            connection = self._open(request, path, priority)
+        except urllib2.HTTPError, exc:
+            if exc.code != 304:
+                raise
+            exc.close()
+            return NOT_MODIFIED, exc.info()
+        try:
+            if 'json' in connection.info().dict['content-type']:
+                return self._codec().load(connection), connection.info()
+            else:
+                return connection.read(), connection.info()
+        finally:
+            connection.close()
+    
+    def post(self, path, params={}, data={}, content_type='', priority=None):
         # Deal with content type and POST data.
         if hasattr(data, '__iter__') and not isinstance(data, basestring):
             data = urllib.urlencode(data)
@@ -150,12 +579,12 @@ class ConnectionBroker(object):
         request = Request(self._build_url(path, params), data=data,
             headers=headers, method='POST')
         try:
-            connection = self._opener.open(request)
+            connection = self._open(request, path, priority)
             content_type, params = parse_content_type(
                 connection.info().dict.get('content-type', ''))
             charset = params.get('charset', 'utf-8')
             if content_type.endswith('json'):
-                return json.load(connection, encoding=charset)
+                return self._codec().load(connection, encoding=charset)
             else:
                 return connection.read().decode(charset)
         finally:
@@ -164,17 +593,87 @@ class ConnectionBroker(object):
     def delete(self, path, *args, **kwargs):
         params = kwargs.pop('params', {})
         request = Request(self._build_url(path, params), method='DELETE')
-        connection = self._opener.open(request)
+        connection = self._open(request, path, kwargs.pop('priority', None))
         try:
             if 'json' in connection.info().dict['content-type']:
-                return json.load(connection)
+                return self._codec().load(connection)
             else:
                 return connection.read()
         finally:
             connection.close()
 
 
-class Request(urllib2.Request):
+class AsyncConnectionBroker(ConnectionBroker):
+    
+    """
+    A connection broker whose requests run on an ``eventloop.EventLoop``.
+    
+    ``get``, ``post`` and ``delete`` take the same arguments as they do on
+    ``ConnectionBroker``, but return an ``eventloop.Future`` which fires with
+    the decoded response, or with a ``TwitterError`` for HTTP error statuses.
+    """
+    
+    TIMEOUT = 30
+    
+    def __init__(self, username=None, password=None, loop=None):
+        self.loop = loop or eventloop.DEFAULT_LOOP
+        super(AsyncConnectionBroker, self).__init__(username, password)
+    
+    def _update(self):
+        self._auth_header = None
+        if self._username and self._password:
+            self._auth_header = 'Basic ' + base64.b64encode('%s:%s' % (
+                self._username, self._password))
+    
+    def _request(self, method, path, params={}, data=None, headers={}):
+        headers = dict(headers)
+        if self._auth_header:
+            headers['Authorization'] = self._auth_header
+        url = self._build_url(path, params)
+        event = self._start_request(method, url, path,
+            bytes_sent=len(data or ''))
+        def finish(future):
+            if future.exception() is not None:
+                self._finish_request(event, future.exception())
+                return
+            response = future.result()
+            event.headers_received(response.status)
+            event.bytes_received = len(response.body)
+            self._finish_request(event)
+        future = eventloop.fetch(self.loop, method, url, data=data,
+            headers=headers, timeout=self.TIMEOUT)
+        future.add_done_callback(finish)
+        return future.then(self._decode)
+    
+    def _decode(self, response):
+        if not (200 <= response.status < 300):
+            raise exceptions.CODE_EXCEPTION_MAP.get(response.status,
+                exceptions.TwitterError)(response.url, None, response.status,
+                    response.reason, response.headers)
+        content_type, params = parse_content_type(
+            response.headers.get('content-type', ''))
+        if 'json' in content_type:
+            return self._codec().loads(response.body,
+                encoding=params.get('charset', 'utf-8'))
+        return response.body
+    
+    def get(self, path, params={}):
+        return self._request('GET', path, params)
+    
+    def post(self, path, params={}, data={}, content_type=''):
+        if hasattr(data, '__iter__') and not isinstance(data, basestring):
+            data = urllib.urlencode(data)
+            content_type = 'application/x-www-form-urlencoded'
+        headers = {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        return self._request('POST', path, params, data=data, headers=headers)
+    
+    def delete(self, path, *args, **kwargs):
+        return self._request('DELETE', path, kwargs.pop('params', {}))
+
+
+class Request(urllib2.Request, object):
     
     _set_method = False
     _get_method = 'GET'
@@ -212,10 +711,12 @@ class TwitterErrorHandler(urllib2.BaseHandler):
                 request, fp, code, msg, hdrs)
 
 
-global DEFAULT_CB
+global DEFAULT_CB, DEFAULT_ASYNC_CB
 
 DEFAULT_CB = ConnectionBroker()
+DEFAULT_ASYNC_CB = AsyncConnectionBroker()
 
 def configure(username, password):
-    DEFAULT_CB.username = username
-    DEFAULT_CB.password = password
\ No newline at end of file
+    for broker in (DEFAULT_CB, DEFAULT_ASYNC_CB):
+        broker.username = username
+        broker.password = password
\ No newline at end of file
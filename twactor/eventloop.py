@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+# twactor.eventloop - A small asyncore-based event loop and HTTP client.
+
+import asyncore
+import errno
+import heapq
+import itertools
+import mimetools
+import socket
+import StringIO
+import sys
+import time
+import urlparse
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+class Future(object):
+    
+    """The eventual result of an asynchronous operation."""
+    
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+    
+    def done(self):
+        return self._done
+    
+    def result(self):
+        if not self._done:
+            raise RuntimeError('Future is not done yet')
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+    
+    def exception(self):
+        if not self._done:
+            raise RuntimeError('Future is not done yet')
+        return self._exception
+    
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+    
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+    
+    def add_done_callback(self, function):
+        if self._done:
+            function(self)
+        else:
+            self._callbacks.append(function)
+    
+    def then(self, function):
+        """
+        Chain a function onto this future.
+        
+        Returns a new future which fires with ``function(result)`` once this
+        one has a result. If ``function`` returns another ``Future``, the new
+        future fires with *its* result instead. Exceptions (from this future or
+        from ``function``) propagate down the chain without calling
+        ``function``.
+        """
+        chained = Future()
+        def callback(future):
+            if future._exception is not None:
+                chained.set_exception(future._exception)
+                return
+            try:
+                result = function(future._result)
+            except Exception, exc:
+                chained.set_exception(exc)
+            else:
+                if isinstance(result, Future):
+                    result.add_done_callback(chained._copy_from)
+                else:
+                    chained.set_result(result)
+        self.add_done_callback(callback)
+        return chained
+    
+    def _copy_from(self, future):
+        if future._exception is not None:
+            self.set_exception(future._exception)
+        else:
+            self.set_result(future._result)
+    
+    def _finish(self):
+        if self._done:
+            raise RuntimeError('Future has already been resolved')
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+def succeed(result):
+    """Return a future which has already resolved to ``result``."""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class Timer(object):
+    
+    """A handle for a call scheduled on an ``EventLoop``."""
+    
+    def __init__(self, when, function, args):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.cancelled = False
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop(object):
+    
+    """
+    A single-threaded event loop driving timers and asyncore channels.
+    
+    One loop can hold any number of outstanding HTTP requests and scheduled
+    calls, so many cached objects can be kept fresh without a thread each.
+    """
+    
+    def __init__(self):
+        self._map = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._running = False
+    
+    def call_later(self, delay, function, *args):
+        timer = Timer(time.time() + delay, function, args)
+        heapq.heappush(self._timers,
+            (timer.when, self._sequence.next(), timer))
+        return timer
+    
+    def call_soon(self, function, *args):
+        return self.call_later(0, function, *args)
+    
+    def stop(self):
+        self._running = False
+    
+    def run(self, until=None):
+        """
+        Run the loop.
+        
+        The loop runs until ``stop()`` is called, until the future ``until``
+        (if given) is done, or until there is nothing left to do.
+        """
+        self._running = True
+        try:
+            while self._running:
+                self._run_timers()
+                if until is not None and until.done():
+                    break
+                if not (self._map or self._timers):
+                    break
+                timeout = 1.0
+                if self._timers:
+                    timeout = min(timeout,
+                        max(0, self._timers[0][0] - time.time()))
+                if self._map:
+                    asyncore.loop(timeout, count=1, map=self._map)
+                else:
+                    time.sleep(timeout)
+        finally:
+            self._running = False
+    
+    def run_until_complete(self, future):
+        self.run(until=future)
+        return future.result()
+    
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                timer.function(*timer.args)
+
+
+class PeriodicCall(object):
+    
+    """
+    Repeatedly call a function on an event loop.
+    
+    The function may return a ``Future``, in which case the next call is only
+    scheduled once that future is done, so slow calls never overlap.
+    """
+    
+    def __init__(self, loop, interval, function, *args):
+        self.loop = loop
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self._timer = None
+        self._stopped = True
+    
+    def start(self, delay=0):
+        self._stopped = False
+        self._timer = self.loop.call_later(delay, self._run)
+        return self
+    
+    def stop(self):
+        self._stopped = True
+        if self._timer is not None:
+            self._timer.cancel()
+    
+    def _run(self):
+        if self._stopped:
+            return
+        try:
+            result = self.function(*self.args)
+        except Exception:
+            result = None
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self._schedule())
+        else:
+            self._schedule()
+    
+    def _schedule(self):
+        if not self._stopped:
+            self._timer = self.loop.call_later(self.interval, self._run)
+
+
+class Response(object):
+    
+    """A complete HTTP response, as delivered by ``fetch()``."""
+    
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+    
+    def __repr__(self):
+        return '<Response %d %s>' % (self.status, self.url)
+
+
+class HTTPChannel(asyncore.dispatcher):
+    
+    """An asyncore channel which performs a single HTTP/1.0 request."""
+    
+    def __init__(self, loop, future, url, data, timeout):
+        asyncore.dispatcher.__init__(self, map=loop._map)
+        self.future = future
+        self.url = url
+        self._out = data
+        self._in = []
+        self._secure = url.startswith('https:')
+        self._handshaking = False
+        self._timer = loop.call_later(timeout, self._timed_out)
+        scheme, netloc = urlparse.urlsplit(url)[:2]
+        host, port = netloc, (443 if self._secure else 80)
+        if ':' in netloc:
+            host, port = netloc.rsplit(':', 1)
+            port = int(port)
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            self.connect((host, port))
+        except socket.error, exc:
+            self._fail(exc)
+    
+    def writable(self):
+        return (not self.connected) or self._handshaking or bool(self._out)
+    
+    def handle_connect(self):
+        if self._secure:
+            if ssl is None:
+                self._fail(IOError('SSL is not supported'))
+                return
+            self.socket = ssl.wrap_socket(self.socket,
+                do_handshake_on_connect=False)
+            self._handshaking = True
+    
+    def handle_write(self):
+        if self._handshaking:
+            self._handshake()
+            return
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+    
+    def handle_read(self):
+        if self._handshaking:
+            self._handshake()
+            return
+        try:
+            chunk = self.recv(65536)
+            while chunk:
+                self._in.append(chunk)
+                if not (self._secure and self.socket.pending()):
+                    break
+                chunk = self.recv(65536)
+        except socket.error, exc:
+            if not would_block(exc):
+                raise
+    
+    def handle_close(self):
+        self.close()
+        if self.future.done():
+            return
+        try:
+            response = parse_response(self.url, ''.join(self._in))
+        except Exception, exc:
+            self.future.set_exception(exc)
+        else:
+            self.future.set_result(response)
+    
+    def handle_error(self):
+        exc = sys.exc_info()[1]
+        self._fail(exc)
+    
+    def close(self):
+        self._timer.cancel()
+        asyncore.dispatcher.close(self)
+    
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except socket.error, exc:
+            if not would_block(exc):
+                raise
+        else:
+            self._handshaking = False
+    
+    def _timed_out(self):
+        self._fail(socket.timeout('timed out fetching %s' % (self.url,)))
+    
+    def _fail(self, exception):
+        self.close()
+        if not self.future.done():
+            self.future.set_exception(exception)
+
+
+def would_block(exc):
+    """Whether a socket (or SSL) error just means 'try again later'."""
+    if ssl is not None and isinstance(exc, ssl.SSLError):
+        return exc.args[0] in (ssl.SSL_ERROR_WANT_READ,
+            ssl.SSL_ERROR_WANT_WRITE)
+    return exc.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+def parse_response(url, raw):
+    """Parse a raw HTTP response into a ``Response``."""
+    head, sep, body = raw.partition('\r\n\r\n')
+    if not sep:
+        raise IOError('Incomplete HTTP response from %s' % (url,))
+    status_line, sep, header_text = head.partition('\r\n')
+    version, status, reason = (status_line.split(None, 2) + [''])[:3]
+    headers = mimetools.Message(StringIO.StringIO(header_text))
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = decode_chunked(body)
+    return Response(url, int(status), reason.strip(), headers, body)
+
+
+def decode_chunked(body):
+    chunks, position = [], 0
+    while True:
+        line_end = body.index('\r\n', position)
+        size = int(body[position:line_end].split(';')[0], 16)
+        if not size:
+            return ''.join(chunks)
+        chunks.append(body[line_end + 2:line_end + 2 + size])
+        position = line_end + 4 + size
+
+
+def fetch(loop, method, url, data=None, headers={}, timeout=30):
+    """
+    Perform an HTTP request on an event loop.
+    
+    Returns a ``Future`` which fires with a ``Response`` once the whole
+    response has arrived. Note that host name resolution still blocks.
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+    selector = urlparse.urlunsplit(('', '', path or '/', query, ''))
+    headers = dict((name.title(), value) for name, value in headers.items())
+    headers.setdefault('Host', netloc)
+    headers['Connection'] = 'close'
+    if data is not None:
+        headers['Content-Length'] = str(len(data))
+    lines = ['%s %s HTTP/1.0' % (method, selector)]
+    lines.extend('%s: %s' % pair for pair in sorted(headers.items()))
+    request = '\r\n'.join(lines) + '\r\n\r\n' + (data or '')
+    future = Future()
+    HTTPChannel(loop, future, url, request, timeout)
+    return future
+
+
+global DEFAULT_LOOP
+
+DEFAULT_LOOP = EventLoop()
\ No newline at end of file
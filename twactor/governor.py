@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# twactor.governor - Rate limiting and backoff for API requests.
+
+import heapq
+import itertools
+import random
+import time
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+from twactor import exceptions
+
+
+# Lower numbers go first. Interactive lookups (the default) jump ahead of
+# background polling, such as the refresh scheduler's updates.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_local = threading.local()
+
+def current_priority():
+    """Return the request priority for the current thread."""
+    return getattr(_local, 'priority', PRIORITY_INTERACTIVE)
+
+def set_priority(priority):
+    """Set the request priority for the current thread; returns the old one."""
+    previous = current_priority()
+    _local.priority = priority
+    return previous
+
+
+def endpoint_family(path):
+    """Return the endpoint family of an API path, e.g. ``'statuses'``."""
+    return path.strip('/').split('/', 1)[0].split('.', 1)[0]
+
+
+def limit_exhausted(headers):
+    """Whether a response's rate-limit headers say none are remaining."""
+    try:
+        return int(headers.get('x-ratelimit-remaining', '')) <= 0
+    except (AttributeError, ValueError):
+        return False
+
+
+class TokenBucket(object):
+    
+    """A bucket of ``capacity`` tokens, refilled at ``rate`` per second."""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.timestamp = time.time()
+    
+    def refill(self, now):
+        self.tokens = min(self.capacity,
+            self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+    
+    def delay(self, now, reserve=0):
+        """How long until a token can be taken, leaving ``reserve`` behind."""
+        self.refill(now)
+        missing = (1 + reserve) - self.tokens
+        if missing <= 0:
+            return 0
+        return missing / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+
+
+class RequestGovernor(object):
+    
+    """
+    Keep API requests within the rate limit, and back off from errors.
+    
+    Requests are keyed by credential and endpoint family. A key is only
+    limited once the server has advertised a limit for it, in Twitter's
+    ``X-RateLimit-*`` response headers (or from the start, if ``limit`` is
+    given): it then has a token bucket allowing that many requests per
+    ``period`` seconds, and once the remaining count hits zero, requests for
+    that key wait until the advertised reset.
+    Waiting requests are served in priority order, and background requests may
+    not use the last ``background_reserve`` fraction of a bucket, so that
+    interactive lookups aren't starved by polling. A request which would have
+    to wait longer than ``max_wait`` seconds fails with ``APILimitError``.
+    """
+    
+    def __init__(self, limit=None, period=3600, background_reserve=0.1,
+        max_wait=60, backoff_base=1.0, backoff_cap=60.0):
+        self.limit = limit
+        self.period = period
+        self.background_reserve = background_reserve
+        self.max_wait = max_wait
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._buckets = {}
+        self._resets = {}
+        self._blocked_until = {}
+        self._waiting = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+    
+    def key(self, credential, path):
+        return (credential, endpoint_family(path))
+    
+    def _bucket(self, key, limit=None):
+        """Return the token bucket for ``key`` (``None`` if it's unlimited)."""
+        limit = limit or self.limit
+        if key not in self._buckets and limit is not None:
+            self._buckets[key] = TokenBucket(float(limit) / self.period, limit)
+        return self._buckets.get(key, None)
+    
+    def _delay(self, key, priority, now):
+        bucket, delay = self._bucket(key), 0
+        if bucket is not None:
+            if self._resets.get(key, now) < now:
+                # Twitter's rate-limit window has been reset.
+                del self._resets[key]
+                bucket.tokens = bucket.capacity
+            reserve = 0
+            if priority > PRIORITY_INTERACTIVE:
+                reserve = bucket.capacity * self.background_reserve
+            delay = bucket.delay(now, reserve)
+            if key in self._resets:
+                delay = min(delay, self._resets[key] - now)
+        return max(delay, self._blocked_until.get(key, 0) - now)
+    
+    def acquire(self, key, priority=None):
+        """Block until a request for ``key`` may be made."""
+        if priority is None:
+            priority = current_priority()
+        ticket = (priority, self._sequence.next())
+        self._condition.acquire()
+        try:
+            waiting = self._waiting.setdefault(key, [])
+            heapq.heappush(waiting, ticket)
+            try:
+                while True:
+                    delay = None
+                    if waiting[0] == ticket:
+                        delay = self._delay(key, priority, time.time())
+                        if delay <= 0:
+                            if key in self._buckets:
+                                self._buckets[key].take()
+                            return
+                        if delay > self.max_wait:
+                            raise exceptions.APILimitError(None, None, None,
+                                'Rate limit for %s/%s exhausted for %d more '
+                                'seconds' % (key + (delay,)), None)
+                    self._condition.wait(delay)
+            finally:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+                self._condition.notifyAll()
+        finally:
+            self._condition.release()
+    
+    def record(self, key, status, headers):
+        """Take note of a response's status and rate-limit headers."""
+        if headers is None:
+            return
+        try:
+            limit = int(headers.get('x-ratelimit-limit', ''))
+            remaining = int(headers.get('x-ratelimit-remaining', ''))
+            reset = float(headers.get('x-ratelimit-reset', ''))
+        except ValueError:
+            return
+        self._condition.acquire()
+        try:
+            bucket = self._bucket(key, limit)
+            bucket.rate = float(limit) / self.period
+            bucket.capacity = limit
+            bucket.tokens = remaining
+            bucket.timestamp = time.time()
+            self._resets[key] = reset
+            if remaining <= 0:
+                self._blocked_until[key] = max(reset,
+                    self._blocked_until.get(key, 0))
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+    
+    def backoff(self, key, attempt, headers=None):
+        """
+        Hold back requests for ``key`` after a failed attempt.
+        
+        The delay grows exponentially with ``attempt`` (starting from zero),
+        up to ``backoff_cap``, with random jitter; a ``Retry-After`` header
+        takes precedence. Returns the delay.
+        """
+        delay = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.5)
+        if headers is not None:
+            try:
+                delay = float(headers.get('retry-after', ''))
+            except ValueError:
+                pass
+        self._condition.acquire()
+        try:
+            self._blocked_until[key] = max(time.time() + delay,
+                self._blocked_until.get(key, 0))
+        finally:
+            self._condition.release()
+        return delay
\ No newline at end of file
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
+try:
+    import threading
+except:
+    import dummy_threading as threading
 
 
 DEFAULT_FORMATTER = logging.Formatter(
@@ -12,10 +16,40 @@ DEFAULT_HANDLER = logging.StreamHandler()
 DEFAULT_HANDLER.setFormatter(DEFAULT_FORMATTER)
 DEFAULT_HANDLER.setLevel(logging.DEBUG)
 
+# Debug messages are logged on every cache update, so they are only written
+# once an application asks for them.
+DEFAULT_LEVEL = logging.WARNING
 
-def getLogger(*args, **kwargs):
-    logger = logging.getLogger(*args, **kwargs)
-    logger.handlers = [DEFAULT_HANDLER]
-    logger.propagate = 0
-    logger.setLevel(logging.DEBUG)
+
+_configured = set()
+_configure_lock = threading.Lock()
+
+def getLogger(name=None):
+    """
+    Get a logger, giving it twactor's handler the first time it's asked for.
+    
+    Loggers under ``twactor.`` share the ``twactor`` logger's handler and
+    level, so the whole library can be made more (or less) verbose with
+    ``logging.getLogger('twactor').setLevel(...)``; other loggers are set up
+    individually. The level defaults to ``DEFAULT_LEVEL``. Either way they are
+    only configured once (and not where the application has set a handler or
+    level already), so later changes stick, and getting a logger on every call
+    stays cheap.
+    """
+    logger = logging.getLogger(name)
+    root_name = (name or '').split('.', 1)[0] == 'twactor' and 'twactor' or name
+    if root_name not in _configured:
+        _configure_lock.acquire()
+        try:
+            if root_name not in _configured:
+                root = logging.getLogger(root_name)
+                # Leave alone anything the application has already set up.
+                if not root.handlers:
+                    root.handlers = [DEFAULT_HANDLER]
+                    root.propagate = 0
+                if root.level == logging.NOTSET:
+                    root.setLevel(DEFAULT_LEVEL)
+                _configured.add(root_name)
+        finally:
+            _configure_lock.release()
     return logger
\ No newline at end of file
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# twactor.metrics - Counters for API requests and cache lookups.
+
+import time
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+from twactor import governor
+
+
+# Upper bounds (in seconds) of the request latency histogram's buckets; the
+# last bucket catches everything slower.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# What a cache lookup can come to: served from the cache, fetched because the
+# cache didn't have it, re-fetched because it was out of date, or served out
+# of date while a refresh happens in the background.
+CACHE_OUTCOMES = ('hit', 'miss', 'refresh', 'stale')
+
+
+class RequestEvent(object):
+    
+    """
+    One attempt at an HTTP request, as passed to request hooks.
+    
+    Before the request, ``method``, ``url``, ``path``, ``family`` (the endpoint
+    family, e.g. ``'statuses'``), ``attempt`` (counting retries from zero),
+    ``bytes_sent`` and ``started`` are set. Afterwards, ``status`` holds the
+    HTTP status (or ``None``, and ``error`` the exception, if there wasn't
+    one), ``first_byte`` the seconds until the response headers arrived,
+    ``elapsed`` the seconds until the body had been read, and
+    ``bytes_received`` the size of the body read.
+    """
+    
+    def __init__(self, method, url, path, attempt=0, bytes_sent=0):
+        self.method = method
+        self.url = url
+        self.path = path
+        self.family = governor.endpoint_family(path)
+        self.attempt = attempt
+        self.bytes_sent = bytes_sent
+        self.bytes_received = 0
+        self.status = None
+        self.error = None
+        self.first_byte = None
+        self.elapsed = None
+        self.started = time.time()
+    
+    def __repr__(self):
+        return '<RequestEvent %s %s: %r>' % (self.method, self.path,
+            self.status if self.error is None else self.error)
+    
+    def headers_received(self, status):
+        self.status = status
+        self.first_byte = time.time() - self.started
+    
+    def finish(self, error=None):
+        self.error = error
+        self.elapsed = time.time() - self.started
+        if self.first_byte is None:
+            self.first_byte = self.elapsed
+
+
+class RequestStats(object):
+    
+    """Totals for the requests to one endpoint family with one method."""
+    
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+    
+    def add(self, event):
+        self.count += 1
+        if event.status is None:
+            self.errors += 1
+        else:
+            self.statuses[event.status] = self.statuses.get(event.status,
+                0) + 1
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.seconds += event.elapsed
+        self.max_seconds = max(self.max_seconds, event.elapsed)
+        for bucket, bound in enumerate(LATENCY_BUCKETS):
+            if event.elapsed <= bound:
+                break
+        else:
+            bucket = len(LATENCY_BUCKETS)
+        self.histogram[bucket] += 1
+    
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'statuses': dict((str(status), count)
+                for status, count in self.statuses.iteritems()),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds,
+            'histogram': zip(LATENCY_BUCKETS + (None,), self.histogram),
+        }
+
+
+class Metrics(object):
+    
+    """
+    Counters for API requests and cache lookups.
+    
+    Connection brokers record every request attempt, by method and endpoint
+    family; the ``update_*`` cache decorators (and list indexing) record what
+    each lookup came to, by model class and decorator. Cache lookups are
+    counted per thread, without taking a lock (they happen on every attribute
+    read), and the threads' counts are added up by ``snapshot()``; the counts
+    of threads which have finished are folded into one total as new threads
+    start, and at each snapshot, so they don't pile up. Recording is cheap, so
+    it can be left on; set ``enabled`` to ``False`` to stop it altogether.
+    ``snapshot()`` returns everything recorded so far as plain
+    (JSON-serializable) data.
+    """
+    
+    # Finished threads' counts are folded together once this many threads
+    # (or twice as many as were running at the last fold) have counted.
+    RETIRE_THREADS_AT = 16
+    
+    def __init__(self):
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+    
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._requests = {}
+            # ``(thread, counts)`` for each thread's cache counts; a new list
+            # makes every thread start afresh.
+            self._thread_caches = []
+            # The counts of threads which have finished, added together.
+            self._retired = {}
+            self._retire_at = self.RETIRE_THREADS_AT
+            self.since = time.time()
+        finally:
+            self._lock.release()
+    
+    def _thread_cache(self):
+        local = self._local
+        if getattr(local, 'caches', None) is not self._thread_caches:
+            self._lock.acquire()
+            try:
+                local.caches = self._thread_caches
+                local.cache = {}
+                if len(local.caches) >= self._retire_at:
+                    self._retire_threads()
+                local.caches.append((threading.currentThread(), local.cache))
+            finally:
+                self._lock.release()
+        return local.cache
+    
+    def _retire_threads(self):
+        # Must be called with the lock held. The list is changed in place, as
+        # threads recognise a reset by its identity.
+        running = []
+        for thread, thread_cache in self._thread_caches:
+            if thread.isAlive():
+                running.append((thread, thread_cache))
+            else:
+                _add_counts(self._retired, thread_cache)
+        self._thread_caches[:] = running
+        self._retire_at = max(self.RETIRE_THREADS_AT, 2 * len(running))
+    
+    def record_request(self, event):
+        if not self.enabled:
+            return
+        key = '%s %s' % (event.method, event.family)
+        self._lock.acquire()
+        try:
+            stats = self._requests.get(key)
+            if stats is None:
+                stats = self._requests[key] = RequestStats()
+            stats.add(event)
+        finally:
+            self._lock.release()
+    
+    def record_cache(self, model, decorator, outcome):
+        """Count a cache lookup; ``outcome`` is one of ``CACHE_OUTCOMES``."""
+        if not self.enabled:
+            return
+        cache = self._thread_cache()
+        counts = cache.get((model, decorator))
+        if counts is None:
+            counts = cache[(model, decorator)] = dict.fromkeys(
+                CACHE_OUTCOMES, 0)
+        counts[outcome] += 1
+    
+    def snapshot(self):
+        """
+        Return the counters as a dictionary.
+        
+        ``requests`` maps ``'<METHOD> <family>'`` to the request count, errors
+        (requests which got no response), responses by status, bytes each way,
+        total and maximum seconds, and a latency histogram of ``(upper bound,
+        count)`` pairs. ``cache`` maps model class name to decorator name to
+        the count of each of ``CACHE_OUTCOMES``. ``since`` and ``time`` give
+        the period covered.
+        """
+        self._lock.acquire()
+        try:
+            self._retire_threads()
+            totals = {}
+            _add_counts(totals, self._retired)
+            for thread, thread_cache in self._thread_caches:
+                _add_counts(totals, thread_cache)
+            cache = {}
+            for (model, decorator), counts in totals.iteritems():
+                cache.setdefault(model, {})[decorator] = counts
+            return {
+                'since': self.since,
+                'time': time.time(),
+                'requests': dict((key, stats.as_dict())
+                    for key, stats in self._requests.iteritems()),
+                'cache': cache,
+            }
+        finally:
+            self._lock.release()
+
+
+def _add_counts(totals, thread_cache):
+    # items() and copy() don't let go of the GIL, so a thread adding to its
+    # counts meanwhile is no trouble.
+    for key, counts in thread_cache.items():
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = dict.fromkeys(CACHE_OUTCOMES, 0)
+        for outcome, count in counts.copy().iteritems():
+            total[outcome] += count
+
+
+global METRICS
+
+METRICS = Metrics()
+
+def snapshot():
+    """Return a snapshot of the global counters (see ``Metrics.snapshot``)."""
+    return METRICS.snapshot()
+
+def reset():
+    METRICS.reset()
\ No newline at end of file
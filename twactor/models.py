@@ -1,20 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import calendar
 import datetime
+import math
 import os
 import re
+import sys
 import time
+import weakref
 
 import pytz
-try:
-    import json
-except ImportError:
-    try:
-        import simplejson as json
-    except ImportError:
-        from django.utils import simplejson as json
 
-from twactor import cache, connection, json, log
+from twactor import archive, cache, connection, log
 
 
 class User(cache.CachedObject):
@@ -22,6 +19,8 @@ class User(cache.CachedObject):
     """Get info on a twitter user."""
     
     STATUS_UPDATE_INTERVAL = 3 * 60 # 3 minutes between each status update.
+    STATUS_MAX_AGE = 15 * 60 # Until then, refresh stale ones in background.
+    LOOKUP_CHUNK_SIZE = 100 # Maximum number of users per bulk lookup.
     
     def __init__(self, username_or_id, *args, **kwargs):
         if isinstance(username_or_id, basestring):
@@ -44,19 +43,79 @@ class User(cache.CachedObject):
     @classmethod
     def me(cls):
         return cls(cls._connection_broker.username)
+    
+    @classmethod
+    def prefetch(cls, users, connection_broker=None):
+        """
+        Fill the caches of many users with as few requests as possible.
         
+        ``users`` may contain ``User`` instances, usernames or user IDs. They
+        are grouped by identifier type and looked up in chunks of
+        ``LOOKUP_CHUNK_SIZE`` through ``/users/lookup.json``, so that N users
+        cost one request per chunk instead of N requests. Each user's cache is
+        updated in place (so any tweet sharing that user's data sees the new
+        values), and the list of ``User`` objects is returned.
+        """
+        logger = log.getLogger('twactor.User.prefetch')
+        connection_broker = connection_broker or cls._connection_broker
+        users = [user if isinstance(user, User) else cls(user)
+            for user in users]
+        by_id, by_name = {}, {}
+        for user in users:
+            if user._cache.get('id', None):
+                by_id.setdefault(user._cache['id'], []).append(user)
+            elif user._cache.get('screen_name', None):
+                by_name.setdefault(user._cache['screen_name'].lower(),
+                    []).append(user)
+        for param, group in (('user_id', by_id), ('screen_name', by_name)):
+            identifiers = group.keys()
+            for i in xrange(0, len(identifiers), cls.LOOKUP_CHUNK_SIZE):
+                chunk = identifiers[i:i + cls.LOOKUP_CHUNK_SIZE]
+                try:
+                    data = connection_broker.get('/users/lookup.json',
+                        params={param: ','.join(
+                            unicode(ident).encode('utf-8') for ident in chunk)})
+                except Exception, exc:
+                    # One failed chunk shouldn't stop the rest; its users keep
+                    # whatever was in their caches already.
+                    logger.error('Error fetching info for %d users: %s' % (
+                        len(chunk), exc))
+                    continue
+                for user_data in data:
+                    matched = by_id.get(user_data.get('id'), []) + by_name.get(
+                        user_data.get('screen_name', '').lower(), [])
+                    for user in matched:
+                        lock = cache.object_lock(user)
+                        lock.acquire()
+                        try:
+                            user._cache.update(user_data)
+                        finally:
+                            lock.release()
+                        cache.CachedObject._update_cache(user)
+        return users
+    
     def _update_cache(self):
         logger = log.getLogger('twactor.User.update')
         logger.debug('Updating cache for user %s' % (self._identifier,))
         try:
-            data = self._connection_broker.get('/users/show/%s.json' % (
-                self._identifier,))
+            data = self._conditional_get(*self._update_request())
         except Exception, exc:
             # TODO: implement better error handling.
             logger.error('Error fetching user info for %s' % (
                 self._identifier,))
         else:
-            self._cache = data
+            if data is not None:
+                self._update_received(data)
+    
+    def _update_request(self):
+        return '/users/show/%s.json' % (self._identifier,), {}
+    
+    def _storage_keys(self):
+        keys = super(User, self)._storage_keys()
+        if self._cache.get('screen_name', None):
+            keys.append('screen_name:%s' % (
+                self._cache['screen_name'].lower(),))
+        return keys
     
     @property
     def _identifier(self):
@@ -64,20 +123,20 @@ class User(cache.CachedObject):
             self._cache.get('id', None) or '')
     
     @property
-    @cache.update_on_time(STATUS_UPDATE_INTERVAL)
+    @cache.update_on_time(STATUS_UPDATE_INTERVAL, max_age=STATUS_MAX_AGE)
     def status(self):
         status_data = self._cache['status'].copy()
         status_data['user'] = self._cache.copy()
         status_data['user'].pop('status')
-        return Tweet(status_data['id'], cache=status_data
-            )._with_connection_broker(self._connection_broker)
+        return Tweet._resolve(status_data['id'], cache=status_data,
+            fetched=self._data_time())._with_connection_broker(
+            self._connection_broker)
     
     @property
     @cache.update_on_key('created_at')
+    @cache.derived
     def joined(self):
-        dtime = datetime.datetime.strptime(self._cache['created_at'],
-            '%a %b %d %H:%M:%S +0000 %Y')
-        return dtime.replace(tzinfo=pytz.utc)
+        return parse_twitter_datetime(self._cache['created_at'])
     
     @property
     @cache.update_on_key('utc_offset')
@@ -126,6 +185,206 @@ class UserProfile(cache.CachedMirror):
     text_color = cache.simple_map('profile_text_color')
 
 
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S +0000 %Y'
+MONTHS = dict((name, number) for (number, name) in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+        'Nov', 'Dec'), 1))
+
+SOURCE_NAME_RE = re.compile(r'>(.*)<')
+SOURCE_URL_RE = re.compile(r'<a href="(.*)">')
+
+_MISSING = object()
+
+
+def _parse_twitter_time(value):
+    # Twitter always uses the fixed-width format 'Wed Aug 27 13:08:45 +0000
+    # 2008', so slicing is much cheaper than ``strptime``. Returns the UTC
+    # offset in seconds, plus the fields of the local time.
+    try:
+        offset = (int(value[21:23]) * 3600) + (int(value[23:25]) * 60)
+        if value[20] == '-':
+            offset = -offset
+        return offset, (int(value[26:30]), MONTHS[value[4:7]],
+            int(value[8:10]), int(value[11:13]), int(value[14:16]),
+            int(value[17:19]))
+    except (IndexError, KeyError, ValueError):
+        return 0, time.strptime(value, TWITTER_TIME_FORMAT)[:6]
+
+def parse_twitter_datetime(value):
+    """Parse a Twitter ``created_at`` string into an aware UTC datetime."""
+    offset, fields = _parse_twitter_time(value)
+    dtime = datetime.datetime(*(fields + (0, pytz.utc)))
+    if offset:
+        dtime -= datetime.timedelta(seconds=offset)
+    return dtime
+
+def parse_twitter_timestamp(value):
+    """Parse a Twitter ``created_at`` string into a UTC timestamp."""
+    offset, fields = _parse_twitter_time(value)
+    return calendar.timegm(fields + (0, 0, 0)) - offset
+
+
+class UserData(dict):
+    
+    """A user's cached data, shared by every tweet record which refers to it."""
+    
+    __slots__ = ('__weakref__',)
+
+
+_INTERNED_USERS = weakref.WeakValueDictionary()
+
+def intern_user(user_data, replace=True):
+    """
+    Return the single shared ``UserData`` dictionary for a user.
+    
+    The first dictionary seen for a user ID becomes the shared one. Values
+    from later dictionaries replace its own, as they are newer; with
+    ``replace=False`` (for data which may be older, such as archived tweets)
+    they only fill in values it is missing. The shared dictionary lives for as
+    long as some record refers to it.
+    """
+    user_id = user_data.get('id', None)
+    if user_id is None:
+        return user_data
+    interned = _INTERNED_USERS.get(user_id)
+    if interned is None:
+        interned = UserData(user_data)
+        _INTERNED_USERS[user_id] = interned
+    elif interned is not user_data:
+        for key, value in user_data.iteritems():
+            if replace or key not in interned:
+                interned[key] = value
+    return interned
+
+
+class TweetRecord(object):
+    
+    """
+    A compact, dictionary-like record of a tweet's cached data.
+    
+    The fields twactor reads are held in ``__slots__``, ``created_at`` is held
+    as a UTC timestamp, and the nested ``user`` dictionary is interned so that
+    all of one user's tweets share it. Any other keys go into a small overflow
+    dictionary. Records support the parts of the dictionary interface which
+    ``Tweet`` and the cache framework use, so they can stand in for the decoded
+    JSON as a tweet's ``_cache``. Pass ``fresh=False`` for data which may be
+    older than what is already known about its user (see ``intern_user``).
+    """
+    
+    __slots__ = ('id', 'created', 'text', 'source', 'truncated', 'favorited',
+        'in_reply_to_status_id', 'in_reply_to_user_id',
+        'in_reply_to_screen_name', 'user', 'extra')
+    
+    _SLOT_KEYS = ('id', 'text', 'source', 'truncated', 'favorited',
+        'in_reply_to_status_id', 'in_reply_to_user_id',
+        'in_reply_to_screen_name', 'user')
+    
+    def __init__(self, data=None, fresh=True):
+        for slot in self.__slots__:
+            setattr(self, slot, _MISSING)
+        self.extra = None
+        if data:
+            for key, value in data.iteritems():
+                if key == 'user' and not fresh and hasattr(value, 'keys'):
+                    self.user = intern_user(value, replace=False)
+                else:
+                    self[key] = value
+    
+    def __getitem__(self, key):
+        if key in self._SLOT_KEYS:
+            value = getattr(self, key)
+        elif key == 'created_at':
+            value = self.created
+            if value is not _MISSING:
+                value = time.strftime(TWITTER_TIME_FORMAT, time.gmtime(value))
+        elif self.extra is not None:
+            value = self.extra.get(key, _MISSING)
+        else:
+            value = _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+    
+    def __setitem__(self, key, value):
+        if key == 'user' and hasattr(value, 'keys'):
+            self.user = intern_user(value)
+        elif key in self._SLOT_KEYS:
+            setattr(self, key, value)
+        elif key == 'created_at':
+            self.created = parse_twitter_timestamp(value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+    
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def __repr__(self):
+        return 'TweetRecord(%r)' % (self.copy(),)
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def keys(self):
+        keys = [key for key in self._SLOT_KEYS
+            if getattr(self, key) is not _MISSING]
+        if self.created is not _MISSING:
+            keys.append('created_at')
+        if self.extra:
+            keys.extend(self.extra.keys())
+        return keys
+    
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+    
+    def items(self):
+        return list(self.iteritems())
+    
+    def setdefault(self, key, default=None):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+    
+    def update(self, other=None, **kwargs):
+        if other is not None:
+            if hasattr(other, 'keys'):
+                other = [(key, other[key]) for key in other.keys()]
+            for key, value in other:
+                self[key] = value
+        for key, value in kwargs.iteritems():
+            self[key] = value
+    
+    def copy(self):
+        """Return the record's contents as a plain dictionary."""
+        return dict(self.iteritems())
+    
+    def __sizeof__(self):
+        # Count the values held as well as the record. The interned user is
+        # shared by all of the user's tweets (and outlives any one of them),
+        # so it isn't counted.
+        size = object.__sizeof__(self)
+        for slot in self.__slots__:
+            value = getattr(self, slot)
+            if value is not _MISSING and slot not in ('user', 'extra'):
+                size += sys.getsizeof(value)
+        if self.extra is not None:
+            size += sys.getsizeof(self.extra)
+            size += sum(map(sys.getsizeof, self.extra.itervalues()))
+        return size
+
+
 class Tweet(cache.CachedObject):
     
     def __init__(self, id, *args, **kwargs):
@@ -144,40 +403,68 @@ class Tweet(cache.CachedObject):
     def __repr__(self):
         return 'Tweet(%r)' % (self.id,)
     
+    @classmethod
+    def prefetch(cls, tweets, connection_broker=None):
+        """
+        Refresh the user info embedded in many tweets with bulk lookups.
+        
+        The ``user`` dictionary held in each tweet's cache is updated in place
+        via ``User.prefetch``. Returns the list of tweets.
+        """
+        tweets = list(tweets)
+        users = [User(tweet._cache['user'].get('id', None),
+            cache=tweet._cache['user'])
+            for tweet in tweets if tweet._cache.get('user', None)]
+        User.prefetch(users, connection_broker=connection_broker)
+        return tweets
+    
     def _update_cache(self):
         logger = log.getLogger('twactor.Tweet.update')
         logger.debug('Updating cache for tweet %d' % (self.id,))
         try:
-            data = self._connection_broker.get(
-                '/statuses/show/%d.json' % (self.id,))
+            data = self._conditional_get(*self._update_request())
         except Exception, exc:
             # TODO: implement better error handling.
             logger.error('Error fetching info for tweet ID %d' % (self.id,))
         else:
-            self._cache = data
+            if data is not None:
+                self._update_received(data)
+    
+    def _update_request(self):
+        return '/statuses/show/%d.json' % (self.id,), {}
     
     @property
     @cache.update_on_key('user')
     def user(self):
-        return User(self._cache['user']['screen_name'],
-            cache=self._cache['user'])._with_connection_broker(
-                self._connection_broker)
+        user_data = self._cache['user']
+        if user_data.get('id', None) is None:
+            user = User(user_data['screen_name'], cache=user_data)
+        else:
+            user = User._resolve(user_data['id'], cache=user_data,
+                fetched=self._data_time())
+        return user._with_connection_broker(self._connection_broker)
     
     @property
     @cache.update_on_key('source')
+    @cache.derived
     def source_name(self):
-        return re.search(r'>(.*)<', self._cache['source']).groups()[0]
+        return SOURCE_NAME_RE.search(self._cache['source']).groups()[0]
     
     @property
     @cache.update_on_key('source')
+    @cache.derived
     def source_url(self):
-        return re.search(r'<a href="(.*)">', self._cache['source']).groups()[0]
+        return SOURCE_URL_RE.search(self._cache['source']).groups()[0]
     
     @property
     @cache.update_on_key('created_at')
+    @cache.derived
     def created(self):
-        return datetime.datetime.strptime(self._cache['created_at'],
-            '%a %b %d %H:%M:%S +0000 %Y').replace(tzinfo=pytz.utc)
+        timestamp = getattr(self._cache, 'created', None)
+        if isinstance(timestamp, (int, long)):
+            # A ``TweetRecord``, which has already parsed the timestamp.
+            return datetime.datetime.fromtimestamp(timestamp, pytz.utc)
+        return parse_twitter_datetime(self._cache['created_at'])
     
     @property
     @cache.update_on_key('in_reply_to_status_id')
@@ -186,7 +473,7 @@ class Tweet(cache.CachedObject):
             return
         cache = {'id': self._cache['in_reply_to_status_id']}
         cache['user'] = {'id': self._cache['in_reply_to_user_id']}
-        return Tweet(self._cache['in_reply_to_status_id']
+        return Tweet._resolve(self._cache['in_reply_to_status_id']
             )._with_connection_broker(self._connection_broker)
     
     id = cache.simple_map('id')
@@ -198,6 +485,8 @@ class PublicTimeline(cache.ForwardCachedList):
     
     OBJ_CLASS = Tweet
     UPDATE_INTERVAL = 60
+    # Polled for as long as a process runs, so only the latest tweets are kept.
+    MAX_ITEMS = 10000
     
     _sort_attrs = ('id',)
     
@@ -211,10 +500,16 @@ class PublicTimeline(cache.ForwardCachedList):
         logger = log.getLogger('twactor.PublicTimeline.update')
         logger.debug('Updating public timeline')
         try:
-            return self._connection_broker.get('/statuses/public_timeline.json')
+            return self._connection_broker.get(*self._update_request())
         except Exception, exc:
             # TODO: implement better error handling.
             logger.error('Error fetching public timeline update')
+    
+    def _update_request(self):
+        return '/statuses/public_timeline.json', {}
+    
+    def _storage_key(self):
+        return 'public'
 
 
 class UserTimeline(cache.ForwardCachedList):
@@ -234,12 +529,6 @@ class UserTimeline(cache.ForwardCachedList):
             user = User.me()
         self.user = user
     
-    def __getitem__(self, pos_or_slice):
-        new_timeline = super(UserTimeline, self).__getitem__(pos_or_slice)
-        if isinstance(new_timeline, UserTimeline):
-            new_timeline.user = self.user
-        return new_timeline
-    
     def __len__(self):
         return self.user._status_count
     
@@ -252,22 +541,20 @@ class UserTimeline(cache.ForwardCachedList):
     def __unicode__(self):
         return self.user.username
     
-    def _copy(self):
-        copy = type(self)(self.user, cache=self._cache[:],
-            updated=self._updated.copy())
+    def _copy(self, indices=None):
+        cache, updated, keys, freshness = self._snapshot(indices)
+        copy = type(self)(self.user, cache=cache, updated=updated, keys=keys,
+            freshness=freshness)
         copy._connection_broker = self._connection_broker
         return copy
     
     def _update_cache(self):
         logger = log.getLogger('twactor.UserTimeline.update')
-        if ((time.time() - self._updated.get('__time', 0)) <
-            self.UPDATE_INTERVAL):
+        request = self._update_request()
+        if request is None:
             return []
         logger.debug('Updating data for user %s' % (self.user.username,))
-        params = {'count': self._count}
-        if self._cache:
-            params['since_id'] = self._cache[-1]['id']
-        path = '/statuses/user_timeline/%s.json' % (self.user.username,)
+        path, params = request
         try:
             data = self._connection_broker.get(path, params=params)
         except Exception, exc:
@@ -276,12 +563,32 @@ class UserTimeline(cache.ForwardCachedList):
         else:
             logger.debug('Data for %s fetched' % (self.user.username,))
             return data
+    
+    def _update_request(self):
+        if ((time.time() - self._updated.get('__time', 0)) <
+            self.UPDATE_INTERVAL):
+            return None
+        params = {'count': self._count}
+        if self._cache:
+            params['since_id'] = self._cache[-1]['id']
+        return '/statuses/user_timeline/%s.json' % (self.user.username,), params
+    
+    def _storage_key(self):
+        return unicode(self.user._identifier).lower()
 
 
 class UserHistory(cache.ReverseCachedList):
     
     OBJ_CLASS = Tweet
     
+    # Deep indexing (e.g. ``history[-1]``) fetches the pages it needs through
+    # this pool, several at a time.
+    page_pool = cache.WorkerPool(4, name='twactor.UserHistory.pages')
+    
+    # Set this to ``TweetRecord`` to store long histories compactly; it may be
+    # set on any of the tweet lists.
+    RECORD_CLASS = None
+    
     # Too low and we make too many API calls. Too high and it takes too long to
     # fetch the data. 100 is a reasonable amount, which can be changed at any
     # time by just setting the attribute.
@@ -298,12 +605,6 @@ class UserHistory(cache.ReverseCachedList):
         self.user = user
         self._cache_page = kwargs.get('cache_page', 1)
     
-    def __getitem__(self, pos_or_slice):
-        new_history = super(UserHistory, self).__getitem__(pos_or_slice)
-        if isinstance(new_history, UserHistory):
-            new_history.user = self.user
-        return new_history
-    
     def __len__(self):
         return self.user._status_count
     
@@ -316,17 +617,17 @@ class UserHistory(cache.ReverseCachedList):
     def __unicode__(self):
         return self.user.username
     
-    def _copy(self):
-        copy = type(self)(self.user, cache=self._cache[:],
-            updated=self._updated.copy())
+    def _copy(self, indices=None):
+        cache, updated, keys, freshness = self._snapshot(indices)
+        copy = type(self)(self.user, cache=cache, updated=updated, keys=keys,
+            freshness=freshness)
         copy._connection_broker = self._connection_broker
         return copy
     
     def _update_cache(self):
         logger = log.getLogger('twactor.UserHistory.update')
         logger.debug('Updating data for user %s' % (self.user.username,))
-        path = '/statuses/user_timeline/%s.json' % (self.user.username,)
-        params = {'page': self._cache_page, 'count': self._count}
+        path, params = self._update_request()
         try:
             data = self._connection_broker.get(path, params=params)
         except Exception, exc:
@@ -334,8 +635,154 @@ class UserHistory(cache.ReverseCachedList):
             logger.error('Error fetching data')
         else:
             logger.debug('Data for %s fetched' % (self.user.username,))
-            self._cache_page += 1
-            return data
+            return self._update_received(data)
+    
+    def _update_request(self):
+        return self._page_request(self._cache_page)
+    
+    def _update_received(self, data):
+        self._cache_page += 1
+        return data
+    
+    def _storage_key(self):
+        return unicode(self.user._identifier).lower()
+    
+    def _storage_meta(self):
+        meta = super(UserHistory, self)._storage_meta()
+        meta['page'] = self._cache_page
+        return meta
+    
+    def _load_storage_meta(self, meta):
+        self._cache_page = max(self._cache_page,
+            meta.pop('page', self._cache_page))
+        super(UserHistory, self)._load_storage_meta(meta)
+    
+    def _page_request(self, page):
+        path = '/statuses/user_timeline/%s.json' % (self.user.username,)
+        return path, {'page': page, 'count': self._count}
+    
+    def _fetch_page(self, page):
+        logger = log.getLogger('twactor.UserHistory.update')
+        path, params = self._page_request(page)
+        try:
+            return self._connection_broker.get(path, params=params)
+        except Exception, exc:
+            # ``_prefetch_to`` stops at the missing page, and the ordinary
+            # updates fetch it again.
+            logger.error('Error fetching page %d for %s: %s' % (page,
+                self.user.username, exc))
+    
+    def _prefetch_to(self, index):
+        """
+        Fetch every page needed to reach ``index`` in parallel.
+        
+        The number of pages is worked out from the user's status count and
+        ``_count``; a negative index needs all of them. The missing pages are
+        fetched concurrently through ``page_pool`` and merged in page order,
+        stopping at the first page which could not be fetched (the usual
+        sequential updates pick up from there).
+        """
+        pages = int(math.ceil(float(self.user._status_count) / self._count))
+        last_page = pages
+        if index >= 0:
+            last_page = min(pages, (index // self._count) + 1)
+        page_numbers = range(self._cache_page, last_page + 1)
+        if len(page_numbers) < 2:
+            return
+        for page, data in zip(page_numbers,
+            self.page_pool.map(self._fetch_page, page_numbers)):
+            if data is None:
+                break
+            self._cache_page = page + 1
+            self._insert_into_cache(data)
+
+
+class ArchivedUserHistory(UserHistory):
+    
+    """
+    A user's history, kept in a memory-mapped archive instead of in memory.
+    
+    Pass ``archive`` (a ``twactor.archive.RecordArchive`` or a path to create
+    one at) to the constructor. Fetched pages are appended to the archive, and
+    items are only decoded when they are accessed, so a single process can
+    hold millions of tweets with little resident memory. Reopening an archive
+    resumes the crawl from the page after the last one archived. Slices are
+    ``CachedListView``s reading the archive like the history itself; call a
+    slice's ``copy()`` for an ordinary, in-memory history holding just the
+    sliced tweets.
+    """
+    
+    RECORD_CLASS = TweetRecord
+    
+    def __init__(self, *args, **kwargs):
+        tweet_archive = kwargs.get('archive', None)
+        if isinstance(tweet_archive, basestring):
+            tweet_archive = archive.RecordArchive(tweet_archive)
+        self.archive = tweet_archive
+        if tweet_archive is not None:
+            self._cache = archive.ArchiveRecords(tweet_archive,
+                _archived_record, _archive_identity)
+            self._keys = archive.ArchiveKeys(tweet_archive, _archive_key)
+            self._ids = archive.ArchiveIDs(tweet_archive, _archive_key)
+            if kwargs.get('freshness', None) is None:
+                self._freshness = cache.Freshness(
+                    untracked=len(tweet_archive))
+            if 'cache_page' not in kwargs:
+                self._cache_page = len(tweet_archive) // self._count + 1
+    
+    def __repr__(self):
+        return 'ArchivedUserHistory(%r)' % (self.user,)
+    
+    def _copy(self, indices=None):
+        if self.archive is None or indices is not None:
+            # A copy of part of an archive is an ordinary, in-memory history.
+            return super(ArchivedUserHistory, self)._copy(indices)
+        copy = type(self)(self.user, archive=self.archive,
+            updated=self._updated.copy(), freshness=self._freshness.copy(),
+            cache_page=self._cache_page)
+        copy._connection_broker = self._connection_broker
+        return copy
+    
+    def _snapshot(self, indices=None):
+        if self.archive is None or indices is not None:
+            return super(ArchivedUserHistory, self)._snapshot(indices)
+        # Archives are append-only, so the records and keys are stable as they
+        # are; copying them would decode the whole archive.
+        return (self._cache, self._updated.copy(), self._keys,
+            self._freshness.copy())
+    
+    def _cache_snapshot(self):
+        if self.archive is None:
+            return super(ArchivedUserHistory, self)._cache_snapshot()
+        return self._cache
+    
+    def _storage_key(self):
+        # The archive is already persistent.
+        if self.archive is None:
+            return super(ArchivedUserHistory, self)._storage_key()
+    
+    def _enforce_limits(self):
+        # Archives are append-only, and hold their records on disk anyway.
+        if self.archive is None:
+            return super(ArchivedUserHistory, self)._enforce_limits()
+        return 0
+
+
+def _archived_record(data):
+    # Archived tweets may be older than what is known about their users.
+    return TweetRecord(data, fresh=False)
+
+
+def _archive_identity(item):
+    timestamp = getattr(item, 'created', None)
+    if not isinstance(timestamp, (int, long)):
+        timestamp = parse_twitter_timestamp(item['created_at'])
+    return item['id'], timestamp
+
+
+def _archive_key(id, timestamp):
+    # Must match ``UserHistory._sort_key`` for the equivalent ``Tweet``.
+    return (datetime.datetime.fromtimestamp(timestamp, pytz.utc), id)
 
 
 class UserFollowers(cache.CachedObject):
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# twactor.storage - Persistent storage for cached objects and lists.
+
+import os
+import socket
+import sqlite3
+import time
+try:
+    import threading
+except:
+    import dummy_threading as threading
+
+from twactor import cache, json
+
+
+class Storage(object):
+    
+    """
+    Interface for persistent cache storage.
+    
+    Objects are stored under a kind (usually the class name) and one or more
+    keys, as their raw cache dictionary plus their ``_updated`` dictionary.
+    Lists are stored as a small dictionary of metadata plus their items, each
+    with its own update count and timestamp. This base class stores nothing.
+    
+    Storage which is ``shared`` between processes is also consulted before
+    each update: a record another process saved less than ``max_age`` seconds
+    ago is used instead of fetching, and leases make sure only one process
+    fetches a given record at a time (see ``cache.shared_update``).
+    """
+    
+    shared = False
+    max_age = 0
+    
+    def load_object(self, kind, key):
+        """Return the ``(cache, updated)`` stored for an object, or ``None``."""
+        return None
+    
+    def save_object(self, kind, keys, data, updated):
+        pass
+    
+    def load_list(self, kind, key, since=None):
+        """
+        Return the ``(meta, items)`` stored for a list, or ``None``.
+        
+        ``items`` is a list of ``(item_id, data, count, time)`` tuples, in the
+        order they were first saved. If ``since`` is given, only items saved
+        at or after that time are returned.
+        """
+        return None
+    
+    def save_list(self, kind, key, meta, items):
+        """Store a list's metadata, and add or replace some of its items."""
+        pass
+    
+    def acquire_lease(self, kind, key):
+        """Try to take the lease on fetching a record; returns success."""
+        return True
+    
+    def release_lease(self, kind, key):
+        pass
+    
+    def close(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    
+    """
+    Keep cached data in an SQLite database.
+    
+    Records are stored as JSON. A single connection is shared between threads
+    (behind a lock), and every save is committed straight away. File databases
+    use write-ahead logging, so readers in other processes aren't blocked.
+    """
+    
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS objects (kind TEXT, key TEXT, data TEXT, '
+            'updated TEXT, PRIMARY KEY (kind, key))',
+        'CREATE TABLE IF NOT EXISTS lists (kind TEXT, key TEXT, meta TEXT, '
+            'PRIMARY KEY (kind, key))',
+        'CREATE TABLE IF NOT EXISTS list_items (kind TEXT, key TEXT, '
+            'item_id TEXT, data TEXT, count INTEGER, time REAL, '
+            'PRIMARY KEY (kind, key, item_id))',
+    )
+    
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connect()
+    
+    def _connect(self):
+        # Must be called with the lock held (or from ``__init__``).
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._pid = os.getpid()
+        if self.path != ':memory:':
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+    
+    @property
+    def db(self):
+        """The connection; call with the lock held."""
+        if self._pid != os.getpid():
+            # A connection can't be carried across ``fork()``.
+            self._connect()
+        return self._db
+    
+    def _query(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            return self.db.execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+    
+    def _write(self, sql, rows):
+        self._lock.acquire()
+        try:
+            cursor = self.db.executemany(sql, rows)
+            self._db.commit()
+            return cursor.rowcount
+        finally:
+            self._lock.release()
+    
+    def load_object(self, kind, key):
+        rows = self._query('SELECT data, updated FROM objects '
+            'WHERE kind = ? AND key = ?', (kind, key))
+        if not rows:
+            return None
+        return json.loads(rows[0][0]), json.loads(rows[0][1])
+    
+    def save_object(self, kind, keys, data, updated):
+        data, updated = encode(data), encode(updated)
+        self._write('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)',
+            [(kind, key, data, updated) for key in keys])
+    
+    def load_list(self, kind, key, since=None):
+        rows = self._query('SELECT meta FROM lists WHERE kind = ? AND key = ?',
+            (kind, key))
+        if not rows:
+            return None
+        items = self._query('SELECT item_id, data, count, time '
+            'FROM list_items WHERE kind = ? AND key = ? AND time >= ? '
+            'ORDER BY rowid', (kind, key, since or 0))
+        return json.loads(rows[0][0]), [(item_id, json.loads(data), count,
+            timestamp) for item_id, data, count, timestamp in items]
+    
+    def save_list(self, kind, key, meta, items):
+        self._lock.acquire()
+        try:
+            self.db.execute('INSERT OR REPLACE INTO lists VALUES (?, ?, ?)',
+                (kind, key, encode(meta)))
+            # Existing items only have their freshness updated, so that they
+            # keep their place in the table.
+            for item_id, data, count, timestamp in items:
+                cursor = self._db.execute('UPDATE list_items SET count = ?, '
+                    'time = ? WHERE kind = ? AND key = ? AND item_id = ?',
+                    (count, timestamp, kind, key, unicode(item_id)))
+                if not cursor.rowcount:
+                    self._db.execute('INSERT INTO list_items '
+                        'VALUES (?, ?, ?, ?, ?, ?)', (kind, key,
+                        unicode(item_id), encode(data), count, timestamp))
+            self._db.commit()
+        finally:
+            self._lock.release()
+    
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._db.close()
+        finally:
+            self._lock.release()
+
+
+class SharedSQLiteStorage(SQLiteStorage):
+    
+    """
+    An SQLite database shared by several worker processes.
+    
+    Every process opens the same file (write-ahead logging lets them read
+    while another writes). Records saved by any process are used by the others
+    for ``max_age`` seconds, and a lease table serialises fetches: a process
+    which can't get the lease on a record waits (polling every
+    ``poll_interval`` seconds) for the holder to publish it. Leases expire
+    after ``lease_ttl`` seconds, so a process which dies mid-fetch only holds
+    the others up for that long.
+    """
+    
+    shared = True
+    
+    SCHEMA = SQLiteStorage.SCHEMA + (
+        'CREATE TABLE IF NOT EXISTS leases (kind TEXT, key TEXT, owner TEXT, '
+            'expires REAL, PRIMARY KEY (kind, key))',
+    )
+    
+    def __init__(self, path, max_age=60, lease_ttl=30, poll_interval=0.05):
+        self.max_age = max_age
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        super(SharedSQLiteStorage, self).__init__(path)
+    
+    def _owner(self):
+        return '%s:%d:%d' % (socket.gethostname(), os.getpid(),
+            threading.currentThread().ident or 0)
+    
+    def acquire_lease(self, kind, key):
+        now, owner = time.time(), self._owner()
+        return bool(self._write('INSERT OR REPLACE INTO leases '
+            'SELECT ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM leases '
+            'WHERE kind = ? AND key = ? AND expires > ? AND owner != ?)',
+            [(kind, key, owner, now + self.lease_ttl, kind, key, now, owner)]))
+    
+    def release_lease(self, kind, key):
+        self._write('DELETE FROM leases WHERE kind = ? AND key = ? AND '
+            'owner = ?', [(kind, key, self._owner())])
+
+
+def encode(data):
+    """Encode a cache record (or any dict-like record) as compact JSON."""
+    if not isinstance(data, (dict, list)) and hasattr(data, 'copy'):
+        data = data.copy()
+    return json.dumps(data, separators=(',', ':'))
+
+
+def configure(storage, shared=False):
+    """
+    Use ``storage`` for all cached objects and lists.
+    
+    ``storage`` may be a ``Storage`` instance, or the path of an SQLite
+    database; pass ``None`` to stop persisting. With ``shared=True``, the
+    database is shared with other processes (see ``SharedSQLiteStorage``).
+    Returns the storage.
+    """
+    if isinstance(storage, basestring):
+        storage = (shared and SharedSQLiteStorage or SQLiteStorage)(storage)
+    cache.CachedObject._storage = storage
+    cache.CachedList._storage = storage
+    return storage
\ No newline at end of file